@@ -0,0 +1,633 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Create and configure jails from a declarative manifest."""
+import hashlib
+import json
+import os
+import time
+import typing
+import click
+
+import libioc.Config.Jail.File.Fstab
+import libioc.errors
+import libioc.Host
+import libioc.Jail
+import libioc.Logger
+import libioc.Release
+import libioc.Types
+import libioc.ZFS
+
+from .shared.click import IocClickContext
+from .shared.inventory import get_config_mtime, get_inventory, update_jail
+from .shared.jail import get_isolated_host, get_isolated_resource
+from .shared.output import print_table_stream
+from .shared.parallel import run_parallel
+
+try:
+    import yaml
+except ImportError:
+    yaml = None  # type: ignore
+
+__rootcmd__ = True
+
+# keys a jail may have in the manifest
+JAIL_KEYS = ("release", "template", "basejail", "properties", "fstab",)
+
+# the digests of applied jails are stored in the root dataset mountpoint
+APPLY_STATE_FILENAME = ".ioc-apply.json"
+
+FSTAB_DEFAULTS = dict(type="nullfs", options="ro", freq=0, passno=0)
+
+ApplyState = typing.Dict[str, typing.Dict[str, typing.Any]]
+
+
+class ManifestError(Exception):
+    """Raised when a manifest cannot be read or is invalid."""
+
+
+class JailSpec(typing.NamedTuple):
+    """The desired state of one jail of a manifest."""
+
+    name: str
+    release: typing.Optional[str]
+    template: typing.Optional[str]
+    basejail: bool
+    properties: typing.Dict[str, str]
+    fstab: typing.List[typing.Dict[str, typing.Any]]
+
+    @property
+    def digest(self) -> str:
+        """Return a digest of the desired state."""
+        data = json.dumps(self._asdict(), sort_keys=True)
+        return hashlib.sha256(data.encode("UTF-8")).hexdigest()
+
+
+class PlannedJail:
+    """A jail and the action that brings it into its desired state."""
+
+    def __init__(
+        self,
+        spec: JailSpec,
+        action: str,
+        jail: typing.Optional[libioc.Jail.JailGenerator]=None,
+        changes: typing.Optional[typing.List[str]]=None,
+        fstab_lines: typing.Optional[
+            typing.List[typing.Dict[str, typing.Any]]
+        ]=None
+    ) -> None:
+        self.spec = spec
+        self.action = action
+        self.jail = jail
+        self.changes = changes or []
+        self.fstab_lines = fstab_lines or []
+
+
+@click.command(
+    name="apply",
+    help="Create and configure jails described in a manifest."
+)
+@click.pass_context
+@click.option("--dry-run", "-n", is_flag=True, default=False,
+              help="Only show the plan.")
+@click.option("--jobs", "-j", default=1, type=click.IntRange(min=1),
+              help="Number of jails that are changed concurrently.")
+@click.option("--source", default=None,
+              help="Root dataset of the jails (default: first one).")
+@click.argument("manifest", nargs=1, type=click.Path(exists=True))
+def cli(
+    ctx: IocClickContext,
+    dry_run: bool,
+    jobs: int,
+    source: typing.Optional[str],
+    manifest: str
+) -> None:
+    """Apply a jail manifest."""
+    logger = ctx.parent.logger
+    zfs = ctx.parent.zfs
+    host: libioc.Host.HostGenerator = ctx.parent.host
+
+    try:
+        specs = read_manifest(
+            manifest,
+            default_release=ctx.parent.capabilities.release_version
+        )
+    except ManifestError as e:
+        logger.error(str(e))
+        exit(1)
+
+    try:
+        inventory = get_inventory(host, source)
+    except KeyError:
+        logger.error(f"Root dataset '{source}' not found")
+        exit(1)
+
+    state_file = os.path.join(
+        os.path.dirname(inventory.file),
+        APPLY_STATE_FILENAME
+    )
+    state = _read_state(state_file)
+
+    started_at = time.monotonic()
+    try:
+        plan = _plan(
+            specs,
+            existing_names=set(inventory.list_names()),
+            jails_mountpoint=inventory.jails_mountpoint,
+            state=state,
+            source=inventory.source,
+            zfs=zfs,
+            host=host,
+            logger=logger
+        )
+    except ManifestError as e:
+        logger.error(str(e))
+        exit(1)
+    except libioc.errors.IocException:
+        exit(1)
+    planned_at = time.monotonic()
+
+    _print_plan(plan)
+    changed = [x for x in plan if x.action != "unchanged"]
+    logger.log(
+        f"Planned {len(changed)} of {len(plan)} jails"
+        f" in {planned_at - started_at:.2f}s"
+    )
+    if dry_run is True:
+        return
+    if len(changed) == 0:
+        _update_state(
+            state,
+            [x for x in plan if x.action == "unchanged"],
+            inventory.jails_mountpoint
+        )
+        _write_state(state_file, state)
+        return
+
+    try:
+        failed = _execute(
+            changed,
+            source=inventory.source,
+            jobs=jobs,
+            zfs=zfs,
+            host=host,
+            logger=logger
+        )
+    except libioc.errors.IocException:
+        exit(1)
+
+    _update_state(
+        state,
+        [x for x in plan if x not in failed],
+        inventory.jails_mountpoint
+    )
+    _write_state(state_file, state)
+
+    logger.log(
+        f"Applied {len(changed) - len(failed)} of {len(changed)} jails"
+        f" in {time.monotonic() - planned_at:.2f}s"
+    )
+    if len(failed) > 0:
+        failed_names = ", ".join(x.spec.name for x in failed)
+        logger.error(f"Failed: {failed_names}")
+        exit(1)
+
+
+def read_manifest(
+    filename: str,
+    default_release: typing.Optional[str]=None
+) -> typing.List[JailSpec]:
+    """
+    Read the jails of a JSON or YAML manifest.
+
+    The manifest maps jail names to their release or template, properties
+    and fstab entries. Values in the optional defaults section apply to all
+    jails, properties and fstab entries are merged.
+    """
+    try:
+        with open(filename, "r", encoding="UTF-8") as f:
+            if filename.endswith((".yml", ".yaml",)):
+                if yaml is None:
+                    raise ManifestError(
+                        "Reading YAML manifests requires PyYAML"
+                    )
+                data = yaml.safe_load(f)
+            else:
+                data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ManifestError(f"Cannot read manifest {filename}: {e}")
+
+    if not isinstance(data, dict) or not isinstance(data.get("jails"), dict):
+        raise ManifestError("The manifest requires a jails mapping")
+
+    defaults = data.get("defaults", {}) or {}
+    if not isinstance(defaults, dict):
+        raise ManifestError("The manifest defaults need to be a mapping")
+    specs = []
+    for name, jail_data in data["jails"].items():
+        jail_data = jail_data or {}
+        if not isinstance(jail_data, dict):
+            raise ManifestError(f"The jail {name} needs to be a mapping")
+        unknown_keys = set(jail_data.keys()) - set(JAIL_KEYS)
+        if len(unknown_keys) > 0:
+            raise ManifestError(
+                f"Unknown keys of jail {name}: " + ", ".join(unknown_keys)
+            )
+        properties = dict(defaults.get("properties", {}) or {})
+        properties.update(jail_data.get("properties", {}) or {})
+        template = jail_data.get("template", defaults.get("template"))
+        release = jail_data.get("release", defaults.get("release"))
+        if (release is None) and (template is None):
+            release = default_release
+        fstab = [
+            _read_fstab_entry(name, x)
+            for x in _get_list(jail_data, "fstab", f"jail {name}")
+        ]
+        # jail entries replace default entries with the same destination
+        destinations = set(x["destination"] for x in fstab)
+        default_fstab = [
+            x for x in (
+                _read_fstab_entry(name, y)
+                for y in _get_list(defaults, "fstab", "the defaults")
+            )
+            if x["destination"] not in destinations
+        ]
+        specs.append(JailSpec(
+            name=str(name),
+            release=None if (template is not None) else release,
+            template=template,
+            basejail=bool(jail_data.get(
+                "basejail",
+                defaults.get("basejail", True)
+            )),
+            properties=dict(
+                (str(key), _to_property_value(value),)
+                for key, value in properties.items()
+            ),
+            fstab=default_fstab + fstab
+        ))
+    return specs
+
+
+def _get_list(
+    data: typing.Dict[str, typing.Any],
+    key: str,
+    owner: str
+) -> typing.List[typing.Any]:
+    value = data.get(key, []) or []
+    if not isinstance(value, list):
+        raise ManifestError(f"The {key} of {owner} needs to be a list")
+    return list(value)
+
+
+def _to_property_value(value: typing.Any) -> str:
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    elif isinstance(value, (list, tuple,)):
+        return ",".join(str(x) for x in value)
+    return str(value)
+
+
+def _read_fstab_entry(
+    jail_name: str,
+    entry: typing.Any
+) -> typing.Dict[str, typing.Any]:
+    if isinstance(entry, str):
+        entry = dict(source=entry)
+    if not isinstance(entry, dict) or ("source" not in entry):
+        raise ManifestError(f"Invalid fstab entry of jail {jail_name}")
+    result = dict(FSTAB_DEFAULTS)
+    result.update(entry)
+    result.setdefault("destination", entry["source"])
+    return result
+
+
+def _plan(
+    specs: typing.List[JailSpec],
+    existing_names: typing.Set[str],
+    jails_mountpoint: str,
+    state: ApplyState,
+    source: str,
+    zfs: 'libioc.ZFS.ZFS',
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger
+) -> typing.List[PlannedJail]:
+    changed_resources = [
+        x.name for x in specs
+        if (x.name in existing_names) and _has_changed_resource(x, state)
+    ]
+    if len(changed_resources) > 0:
+        raise ManifestError(
+            "The release or template of existing jails can not be changed: "
+            f"{', '.join(changed_resources)}"
+        )
+
+    plan = []
+    for spec in specs:
+        if spec.name not in existing_names:
+            plan.append(PlannedJail(spec, "create", fstab_lines=spec.fstab))
+            continue
+
+        # jails that were not modified since they were applied are skipped
+        # without reading their configuration
+        jail_state = state.get(spec.name, None)
+        if (jail_state is not None) and (jail_state == _get_jail_state(
+            spec,
+            os.path.join(jails_mountpoint, spec.name)
+        )):
+            plan.append(PlannedJail(spec, "unchanged"))
+            continue
+
+        jail = libioc.Jail.JailGenerator(
+            dict(id=spec.name),
+            root_datasets_name=source,
+            logger=logger,
+            host=host,
+            zfs=zfs
+        )
+        # changes are only written when the plan is executed
+        changes = sorted(jail.config.set_dict(spec.properties))
+        fstab_lines = _get_missing_fstab_lines(jail, spec.fstab)
+        if len(fstab_lines) > 0:
+            changes.append("fstab")
+        action = "update" if (len(changes) > 0) else "unchanged"
+        plan.append(PlannedJail(spec, action, jail, changes, fstab_lines))
+    return plan
+
+
+def _has_changed_resource(spec: JailSpec, state: ApplyState) -> bool:
+    # jails that were not applied before have no recorded release
+    resource = state.get(spec.name, {}).get("resource", None)
+    if resource is None:
+        return False
+    return tuple(resource) != _get_resource_key(spec)
+
+
+def _get_missing_fstab_lines(
+    jail: libioc.Jail.JailGenerator,
+    entries: typing.List[typing.Dict[str, typing.Any]]
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    if len(entries) == 0:
+        return []
+    fstab = jail.fstab
+    fstab.read_file()
+    existing = set(
+        (str(x["source"]), str(x["destination"]),)
+        for x in fstab
+        if isinstance(x, libioc.Config.Jail.File.Fstab.FstabLine)
+    )
+    return [
+        x for x in entries
+        if (
+            str(x["source"]),
+            _get_fstab_destination(jail, x["destination"]),
+        ) not in existing
+    ]
+
+
+def _get_fstab_destination(
+    jail: libioc.Jail.JailGenerator,
+    destination: str
+) -> str:
+    root_path = jail.root_path.rstrip("/")
+    path = os.path.realpath(
+        os.path.join(root_path, destination.lstrip("/"))
+    )
+    if (path != root_path) and not path.startswith(root_path + "/"):
+        raise libioc.errors.InsecureJailPath(path=path, logger=jail.logger)
+    return path
+
+
+def _print_plan(plan: typing.List[PlannedJail]) -> None:
+    print_table_stream(
+        (
+            [x.action, x.spec.name, ", ".join(x.changes) or "-"]
+            for x in plan
+        ),
+        ["action", "name", "changes"]
+    )
+
+
+def _execute(
+    plan: typing.List[PlannedJail],
+    source: str,
+    jobs: int,
+    zfs: 'libioc.ZFS.ZFS',
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger
+) -> typing.List[PlannedJail]:
+    """
+    Run the plan and return the jails that failed.
+
+    libioc and py-libzfs handles are not thread-safe, so every jail is
+    loaded again with its own ZFS handle and host before it is changed.
+    """
+    resources: typing.Dict[typing.Tuple[str, str], typing.Any] = {}
+    for planned in plan:
+        if planned.action != "create":
+            continue
+        resource_key = _get_resource_key(planned.spec)
+        if resource_key not in resources:
+            resources[resource_key] = _get_resource(
+                planned.spec,
+                source,
+                zfs,
+                host,
+                logger
+            )
+
+    def _apply(planned: PlannedJail) -> None:
+        spec = planned.spec
+        isolated_zfs = libioc.ZFS.get_zfs(logger=logger)
+        isolated_host = get_isolated_host(host, logger, zfs=isolated_zfs)
+        if planned.action == "create":
+            jail_data: typing.Dict[str, typing.Any] = dict(spec.properties)
+            jail_data["name"] = spec.name
+            if spec.basejail is True:
+                jail_data["basejail"] = True
+            jail = libioc.Jail.JailGenerator(
+                jail_data,
+                root_datasets_name=source,
+                logger=logger,
+                host=isolated_host,
+                zfs=isolated_zfs,
+                new=True
+            )
+            jail.create(get_isolated_resource(
+                resources[_get_resource_key(spec)],
+                source,
+                isolated_host,
+                logger,
+                isolated_zfs
+            ))
+        else:
+            jail = libioc.Jail.JailGenerator(
+                dict(id=spec.name),
+                root_datasets_name=source,
+                logger=logger,
+                host=isolated_host,
+                zfs=isolated_zfs
+            )
+            # all property changes are written at once
+            jail.config.set_dict(spec.properties)
+            jail.save()
+        if len(planned.fstab_lines) > 0:
+            _add_fstab_lines(jail, planned.fstab_lines)
+        planned.jail = jail
+
+    # the first jail of each source resource is created alone, so that
+    # the snapshot it is cloned from exists before all others use it
+    first_creates: typing.Dict[typing.Tuple[str, str], PlannedJail] = {}
+    for planned in plan:
+        if planned.action == "create":
+            first_creates.setdefault(_get_resource_key(planned.spec), planned)
+    first_phase = list(first_creates.values())
+    second_phase = [x for x in plan if x not in first_phase]
+
+    failed = []
+    for phase, phase_jobs in ((first_phase, 1,), (second_phase, jobs,)):
+        for result in run_parallel(phase, worker=_apply, jobs=phase_jobs):
+            planned = result.item
+            if result.failed is True:
+                logger.error(f"Failed to {planned.action} {planned.spec.name}")
+                failed.append(planned)
+                continue
+            update_jail(
+                typing.cast(libioc.Jail.JailGenerator, planned.jail),
+                host
+            )
+            logger.verbose(
+                f"{planned.spec.name} {planned.action}d"
+                f" in {result.duration:.1f}s"
+            )
+    return failed
+
+
+def _get_resource_key(spec: JailSpec) -> typing.Tuple[str, str]:
+    if spec.template is not None:
+        return ("template", spec.template,)
+    return ("release", str(spec.release),)
+
+
+def _get_resource(
+    spec: JailSpec,
+    source: str,
+    zfs: 'libioc.ZFS.ZFS',
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger
+) -> typing.Union[libioc.Jail.JailGenerator, libioc.Release.ReleaseGenerator]:
+    if spec.template is not None:
+        return libioc.Jail.JailGenerator(
+            spec.template,
+            root_datasets_name=source,
+            logger=logger,
+            host=host,
+            zfs=zfs
+        )
+    release = libioc.Release.ReleaseGenerator(
+        name=spec.release,
+        root_datasets_name=source,
+        logger=logger,
+        host=host,
+        zfs=zfs
+    )
+    if release.fetched is False:
+        logger.log(f"Automatically fetching release '{release.name}'")
+        release.fetch()
+    return release
+
+
+def _add_fstab_lines(
+    jail: libioc.Jail.JailGenerator,
+    entries: typing.List[typing.Dict[str, typing.Any]]
+) -> None:
+    fstab = jail.fstab
+    fstab.read_file()
+    for entry in entries:
+        destination = _get_fstab_destination(jail, entry["destination"])
+        fstab.new_line(
+            source=libioc.Types.AbsolutePath(entry["source"]),
+            destination=destination,
+            type=entry["type"],
+            options=entry["options"],
+            freq=int(entry["freq"]),
+            passno=int(entry["passno"]),
+            comment=entry.get("comment", None)
+        )
+        os.makedirs(destination, exist_ok=True)
+    fstab.save()
+
+
+def _get_jail_state(
+    spec: JailSpec,
+    jail_mountpoint: str
+) -> typing.Dict[str, typing.Any]:
+    try:
+        fstab_mtime: typing.Optional[float] = os.stat(
+            os.path.join(jail_mountpoint, "fstab")
+        ).st_mtime
+    except OSError:
+        fstab_mtime = None
+    return dict(
+        digest=spec.digest,
+        resource=list(_get_resource_key(spec)),
+        config_mtime=get_config_mtime(jail_mountpoint),
+        fstab_mtime=fstab_mtime
+    )
+
+
+def _update_state(
+    state: ApplyState,
+    plan: typing.List[PlannedJail],
+    jails_mountpoint: str
+) -> None:
+    for planned in plan:
+        if planned.action == "unchanged":
+            state[planned.spec.name] = _get_jail_state(
+                planned.spec,
+                os.path.join(jails_mountpoint, planned.spec.name)
+            )
+        elif planned.jail is not None:
+            state[planned.spec.name] = _get_jail_state(
+                planned.spec,
+                planned.jail.dataset.mountpoint
+            )
+
+
+def _read_state(state_file: str) -> ApplyState:
+    try:
+        with open(state_file, "r") as f:
+            return dict(json.load(f))
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def _write_state(state_file: str, state: ApplyState) -> None:
+    temporary_file = f"{state_file}.{os.getpid()}"
+    try:
+        with open(temporary_file, "w") as f:
+            json.dump(state, f, sort_keys=True)
+        os.rename(temporary_file, state_file)
+    except OSError:
+        pass
@@ -0,0 +1,176 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Manage the local release asset cache from the CLI."""
+import datetime
+import typing
+import click
+
+from .shared.cache import (
+    parse_size,
+    AssetCache,
+    CACHE_DIRECTORY,
+    CACHE_MAX_SIZE
+)
+from .shared.click import IocClickContext
+from .shared.download import serve_directory
+from .shared.output import format_size, print_table_stream
+
+__rootcmd__ = True
+
+
+def _parse_size_option(
+    ctx: click.core.Context,
+    param: click.core.Parameter,
+    value: typing.Optional[str]
+) -> typing.Optional[int]:
+    if value is None:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@click.command(name="list", help="List the cached release files.")
+@click.pass_context
+@click.option("--directory", "-d", default=CACHE_DIRECTORY,
+              help=f"Cache directory (default: {CACHE_DIRECTORY}).")
+def cli_list(
+    ctx: IocClickContext,
+    directory: str
+) -> None:
+    """List cached assets and update files, least recently used first."""
+    entries = AssetCache(directory).entries()
+    print_table_stream(
+        (
+            [
+                entry.sha256,
+                format_size(entry.size),
+                datetime.datetime.fromtimestamp(
+                    entry.last_used
+                ).strftime("%Y-%m-%d %H:%M:%S")
+            ] for entry in entries
+        ),
+        ["sha256", "size", "last_used"]
+    )
+    total_size = sum(x.size for x in entries)
+    ctx.parent.logger.verbose(
+        f"{len(entries)} files, {format_size(total_size)} in total"
+    )
+
+
+@click.command(name="prune", help="Remove least recently used assets.")
+@click.pass_context
+@click.option("--directory", "-d", default=CACHE_DIRECTORY,
+              help=f"Cache directory (default: {CACHE_DIRECTORY}).")
+@click.option("--max-size", "-s", default=None, callback=_parse_size_option,
+              help=(
+                  "Size the cache is pruned to, such as 2G "
+                  f"(default: {format_size(CACHE_MAX_SIZE)})."
+              ))
+def cli_prune(
+    ctx: IocClickContext,
+    directory: str,
+    max_size: typing.Optional[int]
+) -> None:
+    """Remove the least recently used assets above the size limit."""
+    removed = AssetCache(directory).prune(max_size)
+    reclaimed_size = sum(x.size for x in removed)
+    ctx.parent.logger.log(
+        f"{len(removed)} files removed, "
+        f"{format_size(reclaimed_size)} reclaimed"
+    )
+
+
+@click.command(name="serve", help="Serve the asset cache to peer hosts.")
+@click.pass_context
+@click.option("--directory", "-d", default=CACHE_DIRECTORY,
+              help=f"Cache directory (default: {CACHE_DIRECTORY}).")
+@click.option("--address", "-a", default="127.0.0.1",
+              help="Address to listen on, 0.0.0.0 for all interfaces.")
+@click.option("--port", "-p", default=8080, type=click.IntRange(1, 65535),
+              help="TCP port to listen on.")
+def cli_serve(
+    ctx: IocClickContext,
+    directory: str,
+    address: str,
+    port: int
+) -> None:
+    """Serve cached assets over HTTP until interrupted."""
+    ctx.parent.logger.log(
+        f"Serving {directory} on http://{address}:{port}/ - "
+        f"fetch with --cache-peer http://<host>:{port}"
+    )
+    try:
+        serve_directory(directory, address, port)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        ctx.parent.logger.error(str(e))
+        exit(1)
+
+
+class CacheCli(click.MultiCommand):
+    """Python Click cache subcommand boilerplate."""
+
+    def list_commands(self, ctx: click.core.Context) -> list:
+        """Mock subcommands for Python Click."""
+        return [
+            "list",
+            "prune",
+            "serve"
+        ]
+
+    def get_command(
+        self,
+        ctx: click.core.Context,
+        cmd_name: str
+    ) -> click.core.Command:
+        """Wrap subcommand for Python Click."""
+        command: typing.Optional[click.core.Command] = None
+
+        if cmd_name == "list":
+            command = cli_list
+        elif cmd_name == "prune":
+            command = cli_prune
+        elif cmd_name == "serve":
+            command = cli_serve
+
+        if command is None:
+            raise NotImplementedError("action does not exist")
+
+        return command
+
+
+@click.group(
+    name="cache",
+    cls=CacheCli
+)
+@click.pass_context
+def cli(
+    ctx: IocClickContext
+) -> None:
+    """Manage the content-addressed cache of release assets."""
+    ctx.logger = ctx.parent.logger
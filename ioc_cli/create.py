@@ -24,6 +24,8 @@
 # POSSIBILITY OF SUCH DAMAGE.
 """Create jails with the CLI."""
 import click
+import itertools
+import time
 import typing
 
 import libioc.errors
@@ -34,6 +36,15 @@ import libioc.Release
 import libioc.ZFS
 
 from .shared.click import IocClickContext
+from .shared.inventory import (
+    get_inventory,
+    remove_jail,
+    update_jail,
+    NameReservationError
+)
+from .shared.jail import get_isolated_host, get_isolated_resource
+from .shared.pool import get_pool, refill_in_background, PoolKey
+from .shared.parallel import run_parallel
 
 __rootcmd__ = True
 
@@ -71,10 +82,16 @@ def validate_count(
     callback=validate_count,
     default=1,
     help=(
-        "Designate a number of jails to create."
-        "Jails are numbered sequentially."
+        "Designate a number of jails to create. "
+        "Jails are numbered sequentially (NAME_1, NAME_2, ...)."
     )
 )
+@click.option(
+    "--jobs", "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of jails that are created concurrently with --count."
+)
 @click.option(
     "--release", "-r",
     required=False,
@@ -113,6 +130,7 @@ def cli(
     release: typing.Optional[str],
     template: typing.Optional[str],
     count: int,
+    jobs: int,
     props: typing.Tuple[str, ...],
     basejail: bool,
     empty: bool,
@@ -127,11 +145,12 @@ def cli(
     jail_data: typing.Dict[str, typing.Any] = {}
 
     if (release is None) and (template is None):
+        host_release = ctx.parent.capabilities.release_version
         logger.spam(
             "No release selected (-r, --release)."
-            f" Selecting host release '{host.release_version}' as default."
+            f" Selecting host release '{host_release}' as default."
         )
-        release = host.release_version
+        release = host_release
 
     try:
         resource_selector = libioc.ResourceSelector.ResourceSelector(
@@ -199,28 +218,239 @@ def cli(
     except libioc.errors.IocException:
         exit(1)
 
-    errors = False
-    for i in range(count):
+    if count == 1:
+        if template is not None:
+            pool_key = PoolKey("template", template, basejail)
+        else:
+            pool_key = PoolKey("release", resource.name, basejail)
+        try:
+            warm_jail = _create_from_pool(
+                pool_key,
+                jail_data,
+                root_datasets_name,
+                zfs,
+                host,
+                logger
+            )
+        except libioc.errors.IocException:
+            exit(1)
+        if warm_jail is not None:
+            logger.log(
+                f"{warm_jail.humanreadable_name} successfully created"
+                f" from the warm pool of {resource.name}!"
+            )
+            exit(0)
 
-        jail = libioc.Jail.JailGenerator(
-            jail_data,
-            root_datasets_name=root_datasets_name,
-            logger=logger,
-            host=host,
-            zfs=zfs,
-            new=True
-        )
-        suffix = f" ({i}/{count})" if count > 1 else ""
+    if count == 1:
+        names = [jail_data["name"]]
+    else:
+        names = [f"{jail_data['name']}_{i}" for i in range(1, count + 1)]
+
+    try:
+        jails = [
+            libioc.Jail.JailGenerator(
+                dict(jail_data, name=jail_name),
+                root_datasets_name=root_datasets_name,
+                logger=logger,
+                host=host,
+                zfs=zfs,
+                new=True
+            ) for jail_name in names
+        ]
+    except libioc.errors.IocException:
+        exit(1)
+
+    if count == 1:
+        jail = jails[0]
         try:
             jail.create(resource)
+            update_jail(jail, host)
             msg_source = f" on {jail.source}" if len(host.datasets) > 1 else ""
             msg = (
                 f"{jail.humanreadable_name} successfully created"
                 f" from {resource.name}"
-                f"{msg_source}!{suffix}"
+                f"{msg_source}!"
             )
             logger.log(msg)
         except libioc.errors.IocException:
             exit(1)
+        exit(0)
+
+    try:
+        with get_inventory(host, jails[0].source).reserve(names):
+            created_jails = _create_bulk(
+                jails,
+                jail_data,
+                resource,
+                root_datasets_name,
+                host,
+                logger,
+                jobs
+            )
+    except NameReservationError as e:
+        logger.error(str(e))
+        exit(1)
+
+    exit(int(len(created_jails) < count))
+
+
+def _create_from_pool(
+    key: PoolKey,
+    jail_data: typing.Dict[str, typing.Any],
+    root_datasets_name: typing.Optional[str],
+    zfs: libioc.ZFS.ZFS,
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger
+) -> typing.Optional[libioc.Jail.JailGenerator]:
+    """
+    Claim, rename and configure a member of a warm pool.
+
+    Returns None when there is no pool for the release or template or when
+    it has no ready members. A claimed member that cannot be renamed or
+    configured is returned to the pool, and None is returned as well, so
+    that the jail is created without the pool. The pool is refilled in the
+    background.
+    """
+    try:
+        pool = get_pool(host, root_datasets_name)
+    except KeyError:
+        return None
+
+    member_name = pool.claim(key)
+    if member_name is None:
+        return None
+
+    try:
+        jail = libioc.Jail.JailGenerator(
+            member_name,
+            root_datasets_name=pool.source,
+            logger=logger,
+            host=host,
+            zfs=zfs
+        )
+        for event in jail.rename(jail_data["name"]):
+            pass
+    except libioc.errors.IocException:
+        logger.verbose(f"Cannot claim {member_name} from the warm pool")
+        pool.release(key, member_name)
+        return None
+    remove_jail(member_name, pool.source, host)
+
+    try:
+        _configure_pool_member(jail, jail_data)
+    except libioc.errors.IocException:
+        logger.verbose(f"Cannot configure {member_name} from the warm pool")
+        try:
+            for event in jail.rename(member_name):
+                pass
+        except libioc.errors.IocException:
+            logger.error(f"{jail.humanreadable_name} was left behind")
+            raise
+        pool.release(key, member_name)
+        return None
+    update_jail(jail, host)
+
+    refill_in_background(pool.source, key)
+    return jail
+
+
+def _configure_pool_member(
+    jail: libioc.Jail.JailGenerator,
+    jail_data: typing.Dict[str, typing.Any]
+) -> None:
+    # members are not started on boot until they were claimed
+    try:
+        del jail.config["boot"]
+    except KeyError:
+        pass
+    jail.config.set_dict(dict(
+        (property_name, value,)
+        for property_name, value in jail_data.items()
+        if property_name != "name"
+    ))
+    jail.save()
+
+
+def _create_bulk(
+    jails: typing.List[libioc.Jail.JailGenerator],
+    jail_data: typing.Dict[str, typing.Any],
+    resource: typing.Union[
+        libioc.Jail.JailGenerator,
+        libioc.Release.ReleaseGenerator
+    ],
+    root_datasets_name: typing.Optional[str],
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger,
+    jobs: int=1
+) -> typing.List[libioc.Jail.JailGenerator]:
+    """
+    Create many jails from the same release or template.
 
-    exit(int(errors))
+    The first jail is created alone, so that the snapshot of the source
+    resource it is cloned from exists before all other jails are cloned
+    from it concurrently. libioc and py-libzfs handles are not thread-safe,
+    so every jail is created by a copy with its own ZFS handle and host.
+    """
+    started_at = time.monotonic()
+    created_jails = []
+    failed_jails = []
+    isolated_jails: typing.Dict[str, libioc.Jail.JailGenerator] = {}
+
+    def _create(jail: libioc.Jail.JailGenerator) -> None:
+        zfs = libioc.ZFS.get_zfs(logger=logger)
+        isolated_host = get_isolated_host(host, logger, zfs=zfs)
+        isolated_jail = libioc.Jail.JailGenerator(
+            dict(jail_data, name=jail.name),
+            root_datasets_name=root_datasets_name,
+            logger=logger,
+            host=isolated_host,
+            zfs=zfs,
+            new=True
+        )
+        isolated_jail.create(get_isolated_resource(
+            resource,
+            root_datasets_name,
+            isolated_host,
+            logger,
+            zfs
+        ))
+        isolated_jails[jail.name] = isolated_jail
+
+    first_results = list(run_parallel(jails[:1], worker=_create))
+    if first_results[0].failed is True:
+        logger.error("The first jail failed - skipping all other jails")
+        remaining_jails: typing.List[libioc.Jail.JailGenerator] = []
+        failed_jails = list(jails)
+    else:
+        remaining_jails = jails[1:]
+
+    for result in itertools.chain(
+        first_results,
+        run_parallel(remaining_jails, worker=_create, jobs=jobs)
+    ):
+        jail = result.item
+        if result.failed is True:
+            logger.error(f"{jail.humanreadable_name} could not be created")
+            if jail not in failed_jails:
+                failed_jails.append(jail)
+            continue
+        jail = isolated_jails[jail.name]
+        update_jail(jail, host)
+        created_jails.append(jail)
+        logger.verbose(
+            f"{jail.humanreadable_name} created in {result.duration:.1f}s"
+        )
+
+    duration = time.monotonic() - started_at
+    logger.log(
+        f"{len(created_jails)} of {len(jails)} jails created"
+        f" from {resource.name} in {duration:.1f}s"
+        f" ({len(created_jails) / duration:.2f} jails/s)"
+    )
+    if len(created_jails) > 0:
+        created_names = ", ".join(x.humanreadable_name for x in created_jails)
+        logger.screen(f"Created: {created_names}")
+    if len(failed_jails) > 0:
+        failed_names = ", ".join(x.humanreadable_name for x in failed_jails)
+        logger.error(f"Failed: {failed_names}")
+    return created_jails
@@ -0,0 +1,125 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Serve read-only ioc commands from a long-lived process."""
+import contextlib
+import sys
+import traceback
+import typing
+import click
+
+import libioc.errors
+
+from .shared import inventory
+from .shared import iocd
+from .shared import main
+from .shared.click import IocClickContext
+
+__rootcmd__ = True
+
+
+@click.command(
+    name="daemon",
+    help="Serve read-only commands from a warm process."
+)
+@click.pass_context
+@click.option(
+    "--socket", "socket_path",
+    default=iocd.SOCKET_PATH,
+    help="Path of the Unix socket to listen on."
+)
+def cli(
+    ctx: IocClickContext,
+    socket_path: str
+) -> None:
+    """
+    Run iocd in the foreground.
+
+    The ZFS handle and the host with its root datasets are created once and
+    reused for every request, and jail inventories stay in memory while
+    their index file is unchanged. Output is streamed to the client while
+    a command is running. The ioc commands listed in
+    iocd.DELEGATED_COMMANDS connect to the socket and fall back to running
+    in-process when the daemon is not reachable. Use daemon(8) to detach:
+
+        daemon -p /var/run/iocd.pid ioc daemon
+    """
+    logger = ctx.parent.logger
+
+    main.warm_state.update(
+        capabilities=ctx.parent.capabilities,
+        zfs=ctx.parent.zfs,
+        host=ctx.parent.host
+    )
+    inventory.keep_warm()
+
+    logger.log(f"iocd listening on {socket_path}")
+    try:
+        iocd.serve(socket_path, run_command)
+    except OSError as e:
+        logger.error(f"iocd failed to listen on {socket_path}: {e}")
+        exit(1)
+
+
+def run_command(
+    argv: typing.List[str],
+    stdout: typing.TextIO,
+    stderr: typing.TextIO
+) -> int:
+    """Run an ioc command in this process and return its exit code."""
+    print_level = main.logger.print_level
+    daemon_argv = sys.argv
+    exit_code = 0
+
+    with contextlib.redirect_stdout(stdout), \
+            contextlib.redirect_stderr(stderr):
+        # the command group inspects sys.argv, not only the parsed args
+        sys.argv = ["ioc"] + argv
+        try:
+            main.cli.main(args=argv, prog_name="ioc", standalone_mode=False)
+        except SystemExit as e:
+            exit_code = _get_exit_code(e.code)
+        except click.exceptions.ClickException as e:
+            e.show()
+            exit_code = e.exit_code
+        except (click.exceptions.Abort, libioc.errors.IocException):
+            exit_code = 1
+        except Exception:
+            # a failing request must not take down the daemon
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            main.logger.print_level = print_level
+            sys.argv = daemon_argv
+
+    return exit_code
+
+
+def _get_exit_code(code: typing.Optional[typing.Union[int, str]]) -> int:
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
@@ -28,6 +28,7 @@ import typing
 
 import libioc.errors
 import libioc.Filter
+import libioc.Host
 import libioc.Jail
 import libioc.Jails
 import libioc.Logger
@@ -35,6 +36,20 @@ import libioc.Releases
 import libioc.Resource
 
 from .shared.click import IocClickContext
+from .shared.inventory import remove_jail
+from .shared.jail import get_isolated_jail
+from .shared.parallel import run_parallel
+from .shared.pool import exclude_pool_members
+from .shared.runtime import get_runtime
+from .shared.trash import (
+    destroy_batch,
+    get_root_dataset_name,
+    move_to_trash,
+    reap_in_background,
+    restore,
+    unmount_batch
+)
+from .shared.zfs import ZFSCommandError
 
 __rootcmd__ = True
 
@@ -57,12 +72,18 @@ __rootcmd__ = True
 )
 @click.option("--recursive", "-R", default=False, is_flag=True,
               help="Bypass the children prompt, best used with --force (-f).")
+@click.option("--jobs", "-j", default=4, type=click.IntRange(min=1),
+              help="Number of jails that are stopped concurrently.")
+@click.option("--deferred", "-d", default=False, is_flag=True,
+              help="Move jails to the trash and free their space later.")
 @click.argument("filters", nargs=-1)
 def cli(
     ctx: IocClickContext,
     force: bool,
     dataset_type: typing.Optional[str],
     recursive: bool,
+    jobs: int,
+    deferred: bool,
     filters: typing.Tuple[str, ...]
 ) -> None:
     """
@@ -84,6 +105,9 @@ def cli(
         filters += ("template=yes",)
 
     release = (dataset_type == "release") is True
+    if (release is True) and (deferred is True):
+        logger.error("Releases can't be destroyed deferred")
+        exit(1)
 
     resources_class: typing.Union[
         typing.Type[libioc.Releases.ReleasesGenerator],
@@ -106,6 +130,8 @@ def cli(
         ))
     except libioc.errors.IocException:
         exit(1)
+    if release is False:
+        resources = list(exclude_pool_members(resources, filters))
 
     if len(resources) == 0:
         logger.error("No target matched your input")
@@ -120,18 +146,152 @@ def cli(
 
     failed_items = []
 
-    for item in resources:
+    if release is False:
+        failed_items = _destroy_jails(
+            resources,
+            ctx.parent.host,
+            logger,
+            force=force,
+            jobs=jobs,
+            deferred=deferred
+        )
+    else:
+        for item in resources:
+            old_mountpoint = item.dataset.mountpoint
+            try:
+                ctx.parent.print_events(item.destroy())
+                logger.screen(f"{old_mountpoint} destroyed")
+            except libioc.errors.IocException:
+                failed_items.append(item)
+
+    if len(failed_items) > 0:
+        exit(1)
+
+
+def _destroy_jails(
+    jails: typing.List[libioc.Jail.JailGenerator],
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger,
+    force: bool=False,
+    jobs: int=1,
+    deferred: bool=False
+) -> typing.List[libioc.Jail.JailGenerator]:
+    """
+    Stop and destroy many jails, returning those that failed.
+
+    Running jails are stopped concurrently through libioc, each with its
+    own ZFS handle and host, which tears down their network, mounts and
+    devfs rules. For a stopped jail, libioc's destroy only removes the
+    jail dataset recursively, so the datasets of all stopped jails of a
+    root dataset are instead moved into one trash batch that is destroyed
+    with a single recursive zfs destroy. Datasets that the batch could not
+    remove are moved back and destroyed by libioc one by one. Deferred
+    batches are left to a background ioc reap.
+    """
+    failed_jails = []
+    runtime = get_runtime(host)
+    running_jails = [x for x in jails if runtime.running(x)]
+    stopped_jails = [x for x in jails if x not in running_jails]
+
+    if force is False:
+        for jail in running_jails:
+            logger.error(f"{jail.humanreadable_name} is running")
+            failed_jails.append(jail)
+        running_jails = []
 
-        old_mountpoint = item.dataset.mountpoint
+    def _stop(jail: libioc.Jail.JailGenerator) -> None:
+        for _ in get_isolated_jail(jail, host, logger).stop(force=True):
+            pass
 
-        if (not release and force and item.running) is True:
-            ctx.parent.print_events(item.stop(force=True))
+    for result in run_parallel(running_jails, worker=_stop, jobs=jobs):
+        if result.failed is True:
+            logger.error(f"{result.item.humanreadable_name} failed to stop")
+            failed_jails.append(result.item)
+            continue
+        stopped_jails.append(result.item)
+    runtime.invalidate()
 
+    sources: typing.Dict[str, typing.List[libioc.Jail.JailGenerator]] = {}
+    for jail in stopped_jails:
+        sources.setdefault(jail.source, []).append(jail)
+
+    for source, source_jails in sources.items():
+        source_failed_jails, batch_name = _destroy_datasets(
+            source,
+            source_jails,
+            host,
+            logger,
+            deferred=deferred
+        )
+        failed_jails += source_failed_jails
+        if (deferred is True) and (batch_name is not None):
+            reap_in_background(source, [batch_name])
+
+    return failed_jails
+
+
+def _destroy_datasets(
+    source: str,
+    jails: typing.List[libioc.Jail.JailGenerator],
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger,
+    deferred: bool=False
+) -> typing.Tuple[
+    typing.List[libioc.Jail.JailGenerator],
+    typing.Optional[str]
+]:
+    datasets = {jail.dataset.name: jail for jail in jails}
+    mountpoints = {x: jail.dataset.mountpoint for x, jail in datasets.items()}
+    try:
+        root_dataset_name = get_root_dataset_name(host, source)
+        batch = move_to_trash(datasets.keys(), root_dataset_name)
+    except (KeyError, ZFSCommandError) as e:
+        logger.error(f"Cannot destroy the jails of {source}: {e}")
+        return jails, None
+
+    failed_datasets = list(batch.failed.keys())
+    for error in batch.failed.values():
+        logger.error(str(error))
+
+    if deferred is True:
+        # trashed datasets must not stay mounted at the jail paths
+        for dataset, error in unmount_batch(batch).items():
+            logger.error(str(error))
+            failed_datasets.append(dataset)
+            try:
+                restore(batch, dataset)
+            except ZFSCommandError as e:
+                logger.error(str(e))
+        for dataset in batch.moved.keys():
+            if dataset in failed_datasets:
+                continue
+            jail = datasets[dataset]
+            logger.screen(f"{mountpoints[dataset]} moved to the trash")
+            remove_jail(jail.name, jail.source, host)
+        return [datasets[x] for x in failed_datasets], batch.name
+
+    trashed_datasets = {v: k for k, v in batch.moved.items()}
+    for trashed_dataset, error in destroy_batch(batch.name).items():
+        logger.verbose(str(error))
+        if trashed_dataset not in trashed_datasets:
+            continue
+        dataset = trashed_datasets[trashed_dataset]
+        try:
+            restore(batch, dataset)
+        except ZFSCommandError as e:
+            logger.error(str(e))
+            failed_datasets.append(dataset)
+            continue
         try:
-            ctx.parent.print_events(item.destroy())
-            logger.screen(f"{old_mountpoint} destroyed")
+            for _ in datasets[dataset].destroy(force=True):
+                pass
         except libioc.errors.IocException:
-            failed_items.append(item)
+            failed_datasets.append(dataset)
 
-    if len(failed_items) > 0:
-        exit(1)
+    for dataset, jail in datasets.items():
+        if dataset in failed_datasets:
+            continue
+        logger.screen(f"{mountpoints[dataset]} destroyed")
+        remove_jail(jail.name, jail.source, host)
+
+    return [datasets[x] for x in failed_datasets], batch.name
@@ -31,6 +31,7 @@ import libioc.Jail
 import libioc.Logger
 
 from .shared.click import IocClickContext
+from .shared.runtime import get_runtime
 
 __rootcmd__ = True
 
@@ -98,7 +99,8 @@ def cli(
         logger.error(f"The jail {ioc_jail.humanreadable_name} does not exist")
         exit(1)
 
-    if (fork is False) and (ioc_jail.running is False):
+    running = get_runtime(ctx.parent.host).running(ioc_jail)
+    if (fork is False) and (running is False):
         logger.error(f"The jail {ioc_jail.humanreadable_name} is not running")
         exit(1)
 
@@ -25,6 +25,8 @@
 """Export a jail from the CLI."""
 import click
 import os.path
+import time
+import typing
 
 import libioc.errors
 import libioc.Filter
@@ -34,7 +36,11 @@ import libioc.Logger
 import libioc.Releases
 import libioc.Resource
 
+from .shared.archive import compress_directory, ArchiveError, CODECS
 from .shared.click import IocClickContext
+from .shared.replication import send
+from .shared.snapshots import create_snapshots, list_snapshots
+from .shared.zfs import run, ZFSCommandError
 
 __rootcmd__ = True
 
@@ -53,8 +59,37 @@ __rootcmd__ = True
     "--format",
     "_format",
     default="txz",
-    type=click.Choice(["txz", "directory"]),
-    help="Export the jail to a Tar Archive (compressed) or a new directory."
+    type=click.Choice(["txz", "directory", "zfs-stream"] + list(CODECS)),
+    help=(
+        "Export the jail to a Tar Archive (compressed), a new directory, "
+        "a ZFS replication stream or a multi-threaded compressed "
+        "tar.xz or tar.zst archive of the jail dataset."
+    )
+)
+@click.option(
+    "--threads",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Compression threads of tar.xz and tar.zst (default: all cores)."
+)
+@click.option(
+    "--level",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Compression level of tar.xz (0-9) and tar.zst (1-19)."
+)
+@click.option(
+    "--snapshot",
+    default=None,
+    help=(
+        "Snapshot sent as zfs-stream, created unless it exists "
+        "(default: export-<timestamp>)."
+    )
+)
+@click.option(
+    "--since",
+    default=None,
+    help="Send a zfs-stream incremental from this earlier snapshot."
 )
 # @click.option(
 #     "-r", "--recursive",
@@ -67,7 +102,11 @@ def cli(
     jail: str,
     destination: str,
     standalone: bool,
-    _format: str
+    _format: str,
+    threads: typing.Optional[int],
+    level: typing.Optional[int],
+    snapshot: typing.Optional[str],
+    since: typing.Optional[str]
 ) -> None:
     """
     Backup a jail.
@@ -94,6 +133,34 @@ def cli(
         logger.error(f"The destination {destination} already exists")
         exit(1)
 
+    compression_options = (threads is not None) or (level is not None)
+    if (_format not in CODECS) and (compression_options is True):
+        codec_names = " or ".join(CODECS)
+        logger.error(f"--threads and --level require --format {codec_names}")
+        exit(1)
+
+    if _format == "zfs-stream":
+        if standalone is True:
+            logger.error("--standalone can't be used with --format zfs-stream")
+            exit(1)
+        _export_stream(ioc_jail, destination, snapshot, since, logger)
+        return
+    elif (snapshot is not None) or (since is not None):
+        logger.error("--snapshot and --since require --format zfs-stream")
+        exit(1)
+
+    if _format in CODECS:
+        _export_archive(
+            ioc_jail,
+            destination,
+            _format,
+            standalone,
+            threads,
+            level,
+            logger
+        )
+        return
+
     try:
         print_events(ioc_jail.backup.export(
             destination,
@@ -103,3 +170,93 @@ def cli(
         ))
     except libioc.errors.IocException:
         exit(1)
+
+
+def _export_archive(
+    ioc_jail: libioc.Jail.JailGenerator,
+    destination: str,
+    _format: str,
+    standalone: bool,
+    threads: typing.Optional[int],
+    level: typing.Optional[int],
+    logger: libioc.Logger.Logger
+) -> None:
+    """
+    Compress the jail dataset into a tar archive.
+
+    The archive contains the complete jail root like a standalone txz
+    export, so that --standalone is required. Basejails are rejected
+    because their root lacks the release directories mounted at start.
+    """
+    if standalone is False:
+        logger.error(f"--format {_format} requires --standalone")
+        exit(1)
+    if ioc_jail.config["basejail"] is True:
+        logger.error(f"Basejails can not be exported as {_format}")
+        exit(1)
+    try:
+        compress_directory(
+            ioc_jail.dataset.mountpoint,
+            destination,
+            CODECS[_format],
+            threads=(0 if (threads is None) else threads),
+            level=level
+        )
+    except (ArchiveError, OSError) as e:
+        logger.error(str(e))
+        exit(1)
+    logger.log(f"{ioc_jail.name} exported to {destination}")
+
+
+def _export_stream(
+    ioc_jail: libioc.Jail.JailGenerator,
+    destination: str,
+    snapshot: typing.Optional[str],
+    since: typing.Optional[str],
+    logger: libioc.Logger.Logger
+) -> None:
+    """
+    Send the jail datasets to a file.
+
+    The stream includes the child datasets, properties and snapshots of
+    the jail. Incremental streams contain the changes since the base
+    snapshot, so that a chain of them can be applied with ioc import.
+    An existing snapshot is only sent when all child datasets have it.
+    """
+    if snapshot is None:
+        snapshot = time.strftime("export-%Y%m%d%H%M%S")
+    dataset = ioc_jail.dataset_name
+    try:
+        snapshots = list_snapshots([ioc_jail], recursive=True)
+        snapshot_names = set(x.name for x in snapshots if x.dataset == dataset)
+        if (since is not None) and (since not in snapshot_names):
+            logger.error(f"The snapshot {dataset}@{since} does not exist")
+            exit(1)
+        snapshot_datasets = set(
+            x.dataset for x in snapshots if x.name == snapshot
+        )
+        if len(snapshot_datasets) == 0:
+            create_snapshots([dataset], snapshot)
+        else:
+            missing_datasets = [
+                x for x in _list_datasets(dataset)
+                if x not in snapshot_datasets
+            ]
+            if len(missing_datasets) > 0:
+                names = ", ".join(f"{x}@{snapshot}" for x in missing_datasets)
+                logger.error(f"The snapshots {names} do not exist")
+                exit(1)
+        send(dataset, snapshot, destination, since=since)
+    except (ZFSCommandError, OSError) as e:
+        logger.error(str(e))
+        exit(1)
+    logger.log(f"{dataset}@{snapshot} exported to {destination}")
+
+
+def _list_datasets(dataset: str) -> typing.List[str]:
+    return run([
+        "list", "-H", "-r",
+        "-t", "filesystem,volume",
+        "-o", "name",
+        dataset
+    ]).splitlines()
@@ -24,14 +24,32 @@
 # POSSIBILITY OF SUCH DAMAGE.
 """Fetch releases and updates with the CLI."""
 import click
+import os
+import time
 import typing
 
 import libioc.Host
 import libioc.Prompts
 import libioc.Release
 import libioc.errors
+import libioc.Logger
 
+from .shared.cache import (
+    fetch_peer_manifest,
+    link_or_copy,
+    AssetCache,
+    CACHE_DIRECTORY
+)
 from .shared.click import IocClickContext
+from .shared.download import (
+    download_files,
+    fetch_text,
+    file_sha256,
+    parse_manifest,
+    DownloadError
+)
+from .shared.extract import extract_assets, Asset
+from .shared.zfs import get_properties, run, ZFSCommandError
 
 __rootcmd__ = True
 
@@ -78,6 +96,36 @@ __rootcmd__ = True
     default=False,
     help="Update basejail after changes"
 )
+@click.option(
+    "--stream/--no-stream",
+    default=False,
+    help=(
+        "Extract assets while they are downloaded instead of staging them "
+        "in resumable ranges for libioc to extract (default)."
+    )
+)
+@click.option(
+    "--jobs", "-j",
+    default=4,
+    type=click.IntRange(min=1),
+    help="Number of concurrent connections used to download assets."
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help=f"Look up and keep release assets in {CACHE_DIRECTORY}."
+)
+@click.option(
+    "--cache-only",
+    is_flag=True,
+    default=False,
+    help="Only use cached assets and never contact the release mirror."
+)
+@click.option(
+    "--cache-peer",
+    multiple=True,
+    help="URL of a host serving its asset cache with ioc cache serve."
+)
 @click.option(  # Compatibility
     "--files",
     multiple=True,
@@ -130,11 +178,43 @@ def cli(  # noqa: T484
         release.assets = list(kwargs["files"])
         url_or_files_selected = True
 
-    if (url_or_files_selected is False) and (release.available is False):
+    cache_only = bool(kwargs["cache_only"])
+    if (cache_only is True) and (kwargs["cache"] is False):
+        logger.error("--cache-only can't be used with --no-cache")
+        exit(1)
+    cache = AssetCache() if (kwargs["cache"] is True) else None
+    peers = list(kwargs["cache_peer"])
+
+    # the availability check queries the release mirror
+    if (url_or_files_selected is False) and (cache_only is False) \
+            and (release.available is False):
         logger.error(f"The release '{release.name}' is not available")
         exit(1)
 
-    fetch_updates = bool(kwargs["fetch_updates"])
+    if release.fetched is False:
+        fetch_assets = _stream_assets if (kwargs["stream"] is True) \
+            else _download_assets
+        try:
+            fetch_assets(
+                release,
+                kwargs["jobs"],
+                logger,
+                cache=cache,
+                peers=peers,
+                cache_only=cache_only
+            )
+        except (DownloadError, ZFSCommandError) as e:
+            logger.error(str(e))
+            exit(1)
+
+    fetch_updates = bool(kwargs["fetch_updates"]) and (cache_only is False)
+    update_files_directory = None
+    if (cache is not None) and (fetch_updates is True):
+        update_files_directory = _get_update_files_directory(release)
+    if update_files_directory is not None:
+        restored = cache.restore_updates(release.name, update_files_directory)
+        logger.verbose(f"{restored} update files restored from the cache")
+
     try:
         ctx.parent.print_events(release.fetch(
             update=kwargs["update"],
@@ -143,9 +223,277 @@ def cli(  # noqa: T484
     except libioc.errors.IocException:
         exit(1)
 
+    if update_files_directory is not None:
+        stored = cache.store_updates(release.name, update_files_directory)
+        logger.verbose(f"{stored} update files added to the cache")
+
     exit(0)
 
 
+def _get_update_files_directory(
+    release: libioc.Release.ReleaseGenerator
+) -> typing.Optional[str]:
+    # libioc runs freebsd-update with the updates dataset as work directory
+    dataset_name = f"{release.dataset_name}/updates"
+    try:
+        run(["create", "-p", dataset_name])
+        mountpoint = get_properties(
+            [dataset_name],
+            ["mountpoint"]
+        )[dataset_name]["mountpoint"]
+    except (ZFSCommandError, KeyError):
+        return None
+    if (mountpoint is None) or (mountpoint in ("none", "legacy",)):
+        return None
+    return os.path.join(mountpoint, "files")
+
+
+def _get_checksums(
+    release: libioc.Release.ReleaseGenerator,
+    remote_url: str,
+    logger: libioc.Logger.Logger,
+    cache: typing.Optional[AssetCache]=None,
+    peers: typing.Sequence[str]=(),
+    cache_only: bool=False
+) -> typing.Dict[str, str]:
+    text = _get_manifest(release, remote_url, logger, cache, peers, cache_only)
+    if text is None:
+        logger.verbose("No MANIFEST found - assets are not verified")
+        return {}
+    if cache_only is True:
+        _stage_manifest(release, text)
+    return parse_manifest(text)
+
+
+def _stage_manifest(
+    release: libioc.Release.ReleaseGenerator,
+    text: str
+) -> None:
+    # libioc reads the MANIFEST from the download directory when it is
+    # present instead of asking the mirror for it
+    download_directory = release.download_directory
+    os.makedirs(download_directory, exist_ok=True)
+    with open(os.path.join(download_directory, "MANIFEST"), "w") as f:
+        f.write(text)
+
+
+def _get_manifest(
+    release: libioc.Release.ReleaseGenerator,
+    remote_url: str,
+    logger: libioc.Logger.Logger,
+    cache: typing.Optional[AssetCache]=None,
+    peers: typing.Sequence[str]=(),
+    cache_only: bool=False
+) -> typing.Optional[str]:
+    if cache_only is False:
+        try:
+            text = fetch_text(f"{remote_url}/MANIFEST")
+            if cache is not None:
+                cache.put_manifest(release.name, text)
+            return text
+        except DownloadError:
+            pass
+
+    if cache is not None:
+        text = cache.get_manifest(release.name)
+        if text is not None:
+            return text
+
+    # manifests of peers are not verified, so they are used but not stored
+    for peer in peers:
+        text = fetch_peer_manifest(peer, release.name)
+        if text is None:
+            continue
+        checksums = parse_manifest(text)
+        missing_filenames = [
+            f"{x}.txz" for x in release.assets
+            if f"{x}.txz" not in checksums
+        ]
+        if len(missing_filenames) > 0:
+            logger.warn(f"The MANIFEST of {peer} is incomplete")
+            continue
+        logger.warn(f"Assets are verified against the MANIFEST of {peer}")
+        return text
+
+    if cache_only is True:
+        raise DownloadError(f"No MANIFEST of {release.name} in the cache")
+    return None
+
+
+def _get_cached_asset(
+    filename: str,
+    sha256: typing.Optional[str],
+    logger: libioc.Logger.Logger,
+    cache: typing.Optional[AssetCache]=None,
+    peers: typing.Sequence[str]=()
+) -> typing.Optional[str]:
+    if (cache is None) or (sha256 is None):
+        return None
+    path = cache.get(sha256)
+    if path is not None:
+        logger.verbose(f"{filename} found in the asset cache")
+        return path
+    for peer in peers:
+        path = cache.fetch_from_peer(peer, sha256)
+        if path is not None:
+            logger.verbose(f"{filename} fetched from the cache of {peer}")
+            return path
+    return None
+
+
+def _is_remote_url(url: str) -> bool:
+    return url.startswith(("http://", "https://",))
+
+
+def _stream_assets(
+    release: libioc.Release.ReleaseGenerator,
+    jobs: int,
+    logger: libioc.Logger.Logger,
+    cache: typing.Optional[AssetCache]=None,
+    peers: typing.Sequence[str]=(),
+    cache_only: bool=False
+) -> None:
+    """
+    Extract the release assets into the release root while downloading.
+
+    All assets are extracted concurrently and verified against the release
+    MANIFEST on the fly. When any asset fails, all extracted files are
+    removed again. Assets found in the cache are read from there. A copy of
+    every verified asset is kept in the download directory and the cache.
+    libioc recognizes the extracted release as fetched and continues with
+    its updates.
+    """
+    remote_url = str(release.remote_url).rstrip("/")
+    if (cache_only is False) and (_is_remote_url(remote_url) is False):
+        return
+
+    checksums = _get_checksums(
+        release, remote_url, logger, cache, peers, cache_only
+    )
+    download_directory = release.download_directory
+    os.makedirs(download_directory, exist_ok=True)
+    assets = []
+    missing_filenames = []
+    for asset_name in release.assets:
+        filename = f"{asset_name}.txz"
+        sha256 = checksums.get(filename, None)
+        local_file = os.path.join(download_directory, filename)
+        if (sha256 is not None) and os.path.isfile(local_file) \
+                and (file_sha256(local_file) == sha256):
+            assets.append(Asset(asset_name, local_file, sha256))
+            continue
+        cached_file = _get_cached_asset(filename, sha256, logger, cache, peers)
+        if cached_file is not None:
+            assets.append(Asset(asset_name, cached_file, sha256))
+        elif cache_only is True:
+            missing_filenames.append(filename)
+        else:
+            assets.append(Asset(
+                asset_name,
+                f"{remote_url}/{filename}",
+                sha256,
+                copy_to=local_file
+            ))
+    if len(missing_filenames) > 0:
+        raise DownloadError(
+            "Not in the asset cache: " + ", ".join(missing_filenames)
+        )
+
+    root_dataset_name = f"{release.dataset_name}/root"
+    run(["create", "-p", root_dataset_name])
+    root = get_properties(
+        [root_dataset_name],
+        ["mountpoint"]
+    )[root_dataset_name]["mountpoint"]
+    if root is None:
+        raise DownloadError(f"{root_dataset_name} is not mounted")
+
+    started_at = time.monotonic()
+    results = extract_assets(assets, root, jobs=jobs)
+    failed_assets = [x for x in results if x.error is not None]
+    for result in failed_assets:
+        logger.error(str(result.error))
+    if len(failed_assets) > 0:
+        failed_names = ", ".join(x.asset.name for x in failed_assets)
+        raise DownloadError(f"Failed to extract {failed_names}")
+    logger.verbose(
+        f"{len(assets)} assets extracted"
+        f" in {time.monotonic() - started_at:.1f}s"
+    )
+
+    if cache is not None:
+        for asset in assets:
+            local_file = asset.copy_to or asset.source
+            if (asset.sha256 is not None) and os.path.isfile(local_file):
+                cache.put(asset.sha256, local_file)
+
+
+def _download_assets(
+    release: libioc.Release.ReleaseGenerator,
+    jobs: int,
+    logger: libioc.Logger.Logger,
+    cache: typing.Optional[AssetCache]=None,
+    peers: typing.Sequence[str]=(),
+    cache_only: bool=False
+) -> None:
+    """
+    Stage the release assets in the download directory of the release.
+
+    Assets are taken from the cache when possible. All others are
+    downloaded in parallel ranges that are resumed after an interruption
+    and verified against the release MANIFEST while they arrive. libioc
+    finds the staged assets and skips their download.
+    """
+    remote_url = str(release.remote_url).rstrip("/")
+    if (cache_only is False) and (_is_remote_url(remote_url) is False):
+        return
+
+    checksums = _get_checksums(
+        release, remote_url, logger, cache, peers, cache_only
+    )
+    download_directory = release.download_directory
+    os.makedirs(download_directory, exist_ok=True)
+    filenames = []
+    for asset_name in release.assets:
+        filename = f"{asset_name}.txz"
+        sha256 = checksums.get(filename, None)
+        cached_file = _get_cached_asset(filename, sha256, logger, cache, peers)
+        if cached_file is not None:
+            link_or_copy(
+                cached_file,
+                os.path.join(download_directory, filename)
+            )
+        else:
+            filenames.append(filename)
+
+    if (cache_only is True) and (len(filenames) > 0):
+        raise DownloadError(
+            "Not in the asset cache: " + ", ".join(filenames)
+        )
+
+    failed_filenames = []
+    for filename, error in download_files(
+        remote_url,
+        filenames,
+        download_directory,
+        checksums,
+        jobs=jobs
+    ):
+        if error is not None:
+            logger.error(str(error))
+            failed_filenames.append(filename)
+            continue
+        logger.verbose(f"{filename} downloaded and verified")
+        sha256 = checksums.get(filename, None)
+        if (cache is not None) and (sha256 is not None):
+            cache.put(sha256, os.path.join(download_directory, filename))
+
+    if len(failed_filenames) > 0:
+        raise DownloadError(
+            "Failed to download " + ", ".join(failed_filenames)
+        )
+
+
 def _is_option_enabled(args: typing.Dict[str, typing.Any], name: str) -> bool:
     try:
         value = args[name]
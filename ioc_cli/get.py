@@ -27,7 +27,6 @@ import typing
 import click
 
 import libioc.errors
-import libioc.Host
 import libioc.Jail
 import libioc.Logger
 
@@ -59,7 +58,7 @@ def cli(
 ) -> None:
     """Get a list of jails and print the property."""
     logger = ctx.parent.logger
-    host = libioc.Host.Host(logger=logger)
+    host = ctx.parent.host
 
     _prop = None if len(prop) == 0 else prop[0]
 
@@ -24,13 +24,25 @@
 # POSSIBILITY OF SUCH DAMAGE.
 """Export a jail from the CLI."""
 import click
+import typing
 
 import libioc.errors
 import libioc.Jail
 import libioc.Host
+import libioc.Logger
 import libioc.ZFS
 
+from .shared.archive import (
+    ArchiveError,
+    CODECS,
+    extract_archive,
+    get_archive_format
+)
 from .shared.click import IocClickContext
+from .shared.inventory import update_jail
+from .shared.replication import is_zfs_stream, receive
+from .shared.runtime import get_runtime
+from .shared.zfs import ZFSCommandError, get_properties, run
 
 __rootcmd__ = True
 
@@ -38,13 +50,32 @@ __rootcmd__ = True
 @click.command(name="import", help="Import a jail from a backup archive")
 @click.pass_context
 @click.argument("jail", required=True)
-@click.argument("source", required=True)
+@click.argument("sources", nargs=-1, required=True)
+@click.option(
+    "--force", "-f",
+    default=False,
+    is_flag=True,
+    help=(
+        "Roll back ZFS streams applied to an existing jail, discarding "
+        "changes made after their base snapshot."
+    )
+)
 def cli(
     ctx: IocClickContext,
     jail: str,
-    source: str
+    sources: typing.Tuple[str, ...],
+    force: bool
 ) -> None:
-    """Restore a jail from a backup archive."""
+    """
+    Restore a jail from a backup archive.
+
+    ZFS send streams written by ioc export --format zfs-stream are applied
+    in the given order, so that a full stream can be followed by a chain
+    of incremental ones. Incremental streams are also applied to an
+    existing jail, which is only rolled back when forced. Archives that
+    libioc does not read, such as tar.zst exports, are extracted into new
+    jail datasets.
+    """
     logger = ctx.parent.logger
     zfs: libioc.ZFS.ZFS = ctx.parent.zfs
     host: libioc.Host.HostGenerator = ctx.parent.host
@@ -58,11 +89,124 @@ def cli(
         new=True
     )
 
+    streams = [x for x in sources if is_zfs_stream(x)]
+    if len(streams) > 0:
+        if len(streams) != len(sources):
+            logger.error("Backup archives can't be mixed with ZFS streams")
+            exit(1)
+        _import_streams(ioc_jail, streams, force, zfs, host, logger)
+        return
+    elif force is True:
+        logger.error("--force can only be used with ZFS streams")
+        exit(1)
+
+    if len(sources) > 1:
+        logger.error("Only ZFS streams can be imported as a chain")
+        exit(1)
+
     if ioc_jail.exists is True:
         logger.error(f"The jail {jail} already exists")
         exit(1)
 
+    archive_format = get_archive_format(sources[0])
+    if archive_format is not None:
+        _import_archive(
+            ioc_jail,
+            sources[0],
+            archive_format,
+            zfs,
+            host,
+            logger
+        )
+        return
+
     try:
-        print_events(ioc_jail.backup.restore(source))
+        print_events(ioc_jail.backup.restore(sources[0]))
     except libioc.errors.IocException:
         exit(1)
+
+
+def _import_archive(
+    ioc_jail: libioc.Jail.JailGenerator,
+    source: str,
+    archive_format: str,
+    zfs: libioc.ZFS.ZFS,
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger
+) -> None:
+    """
+    Extract a standalone archive into new jail datasets.
+
+    The archive contains the jail configuration and its root directory,
+    which is extracted into the root dataset. The datasets are destroyed
+    again when the archive can not be extracted.
+    """
+    dataset = ioc_jail.dataset_name
+    try:
+        run(["create", dataset])
+    except ZFSCommandError as e:
+        logger.error(str(e))
+        exit(1)
+
+    try:
+        run(["create", f"{dataset}/root"])
+        mountpoint = get_properties([dataset], ["mountpoint"])[dataset]
+        extract_archive(
+            source,
+            str(mountpoint["mountpoint"]),
+            CODECS[archive_format]
+        )
+        imported_jail = libioc.Jail.JailGenerator(
+            ioc_jail.name,
+            logger=logger,
+            zfs=zfs,
+            host=host
+        )
+    except (ZFSCommandError, ArchiveError, OSError) as e:
+        logger.error(str(e))
+        _destroy_dataset(dataset, logger)
+        exit(1)
+    except libioc.errors.IocException:
+        _destroy_dataset(dataset, logger)
+        exit(1)
+    update_jail(imported_jail, host)
+    logger.log(f"{source} imported to {dataset}")
+
+
+def _destroy_dataset(dataset: str, logger: libioc.Logger.Logger) -> None:
+    try:
+        run(["destroy", "-r", dataset])
+    except ZFSCommandError as e:
+        logger.error(str(e))
+
+
+def _import_streams(
+    ioc_jail: libioc.Jail.JailGenerator,
+    streams: typing.List[str],
+    force: bool,
+    zfs: libioc.ZFS.ZFS,
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger
+) -> None:
+    exists = ioc_jail.exists
+    if (exists is True) and get_runtime(host).running(ioc_jail):
+        logger.error(f"The jail {ioc_jail.name} needs to be stopped")
+        exit(1)
+
+    try:
+        receive(streams, ioc_jail.dataset_name, force=force)
+        imported_jail = libioc.Jail.JailGenerator(
+            ioc_jail.name,
+            logger=logger,
+            zfs=zfs,
+            host=host
+        )
+    except (ZFSCommandError, OSError) as e:
+        logger.error(str(e))
+        exit(1)
+    except libioc.errors.IocException:
+        exit(1)
+    update_jail(imported_jail, host)
+    logger.log(
+        f"{len(streams)} streams applied to {ioc_jail.dataset_name}"
+    )
@@ -25,6 +25,8 @@
 """List jails, releases and templates with the CLI."""
 import click
 import json
+import os
+import time
 import typing
 
 import libioc.errors
@@ -33,15 +35,104 @@ import libioc.Host
 import libioc.Datasets
 import libioc.Resource
 import libioc.ListableResource
+import libioc.Jail
 import libioc.Jails
 import libioc.Releases
 
-from .shared.output import print_table
+from .shared.inventory import list_jails
+from .shared.output import print_table_stream, TableScreen
 from .shared.click import IocClickContext
+from .shared.pool import exclude_pool_members
+from .shared.runtime import (
+    filter_running,
+    get_runtime,
+    pop_running_filter,
+    JailRuntime
+)
+from .shared.sorting import (
+    SortColumn,
+    paginate,
+    parse_sort_columns,
+    split_sort_columns
+)
+from .shared.zfs import get_properties, ZFSCommandError
 
 __rootcmd__ = True
 
-supported_output_formats = ['table', 'csv', 'list', 'json']
+supported_output_formats = ['table', 'csv', 'list', 'json', 'ndjson']
+
+# columns with this prefix are read from the jails ZFS dataset properties
+ZFS_COLUMN_PREFIX = "zfs."
+
+# columns that libioc reads from a ZFS property of a jail dataset or child
+DATASET_COLUMNS = {
+    "root_path": ("root", "mountpoint",),
+}
+
+# columns answered from a single jls snapshot
+RUNTIME_COLUMNS = ("running", "jid",)
+
+# columns that are evaluated again on every update in watch mode
+WATCH_VOLATILE_COLUMNS = RUNTIME_COLUMNS + ("ip4_addr", "ip6_addr",)
+
+# jail configuration files whose modification triggers a reload when watching
+JAIL_CONFIG_FILES = ("config.json", "config",)
+
+ZFSProperties = typing.Dict[str, typing.Dict[str, typing.Optional[str]]]
+
+# JSON serializable column values
+NativeValue = typing.Union[str, int, float, bool, None]
+
+
+class _PrefetchedValues:
+    """Column values that were looked up for all jails at once."""
+
+    def __init__(
+        self,
+        zfs_properties: typing.Optional[ZFSProperties]=None,
+        runtime: typing.Optional[JailRuntime]=None
+    ) -> None:
+        self.zfs_properties = zfs_properties
+        self.runtime = runtime
+
+    def covers(self, column: str) -> bool:
+        """Return True when the column can be answered without libioc."""
+        if _get_zfs_column(column) is not None:
+            return self.zfs_properties is not None
+        return (column in RUNTIME_COLUMNS) and (self.runtime is not None)
+
+    def get(self, resource: 'libioc.Resource.Resource', column: str) -> str:
+        """Return the string value of a covered column."""
+        value = self.get_native(resource, column)
+        if value is None:
+            return "-"
+        elif isinstance(value, bool):
+            return "yes" if value else "no"
+        return str(value)
+
+    def get_native(
+        self,
+        resource: 'libioc.Resource.Resource',
+        column: str
+    ) -> NativeValue:
+        """Return the value of a covered column in its native type."""
+        zfs_column = _get_zfs_column(column)
+        if zfs_column is not None:
+            child, property_name = zfs_column
+            dataset_name = resource.dataset_name
+            if child != "":
+                dataset_name = f"{dataset_name}/{child}"
+            zfs_properties = typing.cast(ZFSProperties, self.zfs_properties)
+            dataset_properties = zfs_properties.get(dataset_name, {})
+            value = dataset_properties.get(property_name)
+            if (value is not None) and value.isdigit():
+                return int(value)
+            return value
+
+        runtime = typing.cast(JailRuntime, self.runtime)
+        if column == "running":
+            return runtime.running(resource)
+        return runtime.jid(resource)
 
 
 @click.command(
@@ -62,12 +153,25 @@ supported_output_formats = ['table', 'csv', 'list', 'json']
 @click.option("--remote", "-R",
               is_flag=True, help="Show remote's available RELEASEs.")
 @click.option("--sort", "-s", "_sort", default=None, nargs=1,
-              help="Sorts the list by the given type")
-@click.option("--output", "-o", default=None)
+              help="Comma separated list of columns to sort by. Columns"
+                   " prefixed with - are sorted in descending order.")
+@click.option("--limit", "-n", default=None, type=click.IntRange(min=1),
+              help="List at most this number of resources.")
+@click.option("--offset", default=0, type=click.IntRange(min=0),
+              help="Skip this number of resources.")
+@click.option("--output", "-o", default=None,
+              help="Comma separated list of columns. Columns prefixed with"
+                   " zfs. show properties of the jail dataset (zfs.used).")
 @click.option("--output-format", "-f", default="table",
               type=click.Choice(supported_output_formats))
 @click.option("--header/--no-header", "-H/-NH", is_flag=True, default=True,
               help="Show or hide column name heading.")
+@click.option("--max-column-width", default=None, type=click.IntRange(min=1),
+              help="Truncate table cells longer than this width.")
+@click.option("--watch", "-w", is_flag=True, default=False,
+              help="Keep the jail table on screen and update changed rows.")
+@click.option("--interval", default=2.0, type=click.FloatRange(min=0.1),
+              help="Seconds between two updates in watch mode.")
 @click.argument("filters", nargs=-1)
 def cli(
     ctx: IocClickContext,
@@ -76,8 +180,13 @@ def cli(
     _long: bool,
     remote: bool,
     _sort: typing.Optional[str],
+    limit: typing.Optional[int],
+    offset: int,
     output: typing.Optional[str],
     output_format: str,
+    max_column_width: typing.Optional[int],
+    watch: bool,
+    interval: float,
     filters: typing.Tuple[str, ...]
 ) -> None:
     """List jails in various formats."""
@@ -89,16 +198,21 @@ def cli(
         logger.error("--output and --long can't be used together")
         exit(1)
 
-    if output_format != "table" and _sort is not None:
-        # Sorting destroys the ability to stream generators
-        # ToDo: Figure out if we need to sort other output formats as well
-        raise Exception("Sorting only allowed for tables")
+    is_jail_listing = (remote is False) \
+        and (dataset_type in (None, "template",))
+    if (watch is True) and ((output_format != "table") or not is_jail_listing):
+        logger.error("--watch is only supported for jail and template tables")
+        exit(1)
+
+    sort_columns = parse_sort_columns(_sort)
 
     # empty filters will match all jails
     if len(filters) == 0:
         filters += ("*",)
 
     columns: typing.List[str] = []
+    prefetched: typing.Optional[_PrefetchedValues] = None
+    running: typing.Optional[bool] = None
 
     try:
 
@@ -132,13 +246,18 @@ def cli(
                     in host.datasets.items()
                 ]
             else:
-                resource_kwargs["skip_invalid_config"] = True
-                resources_class = libioc.Jails.JailsGenerator
+                resources_class = None
                 columns = _list_output_comumns(output, _long)
+                filters, running = pop_running_filter(filters)
+                prefetched = _PrefetchedValues(
+                    zfs_properties=_prefetch_zfs_properties(host, columns),
+                    runtime=get_runtime(host)
+                )
                 if dataset_type == "template":
                     filters += ("template=yes",)
                 else:
                     filters += ("template=no,-",)
+                resources = _list_jails(filters, host, logger, zfs)
 
             if resources_class is not None:
                 resources = resources_class(
@@ -150,22 +269,306 @@ def cli(
                     **resource_kwargs
                 )
 
+            if prefetched is not None:
+                resources = filter_running(
+                    resources,
+                    typing.cast(JailRuntime, prefetched.runtime),
+                    running
+                )
+
     except libioc.errors.IocException:
         exit(1)
+    except ZFSCommandError as e:
+        logger.error(str(e))
+        exit(1)
+
+    # like before, columns that are not listed do not affect the order
+    sort_columns, unknown_sort_columns = split_sort_columns(
+        sort_columns,
+        columns
+    )
+    if len(unknown_sort_columns) > 0:
+        unknown_names = ", ".join(unknown_sort_columns)
+        logger.warn(f"Not sorting by unlisted columns: {unknown_names}")
+
+    if watch is True:
+        try:
+            _watch_jails(
+                list_jails=lambda: _list_jails(filters, host, logger, zfs),
+                load_jail=lambda name: libioc.Jail.JailGenerator(
+                    name,
+                    logger=logger,
+                    host=host,
+                    zfs=zfs
+                ),
+                host=host,
+                columns=columns,
+                show_header=header,
+                prefetched=typing.cast(_PrefetchedValues, prefetched),
+                running=running,
+                sort_columns=sort_columns,
+                limit=limit,
+                offset=offset,
+                interval=interval,
+                max_column_width=max_column_width
+            )
+        except libioc.errors.IocException:
+            exit(1)
+        except ZFSCommandError as e:
+            logger.error(str(e))
+            exit(1)
+        except KeyboardInterrupt:
+            pass
+        return
 
     try:
+        resources = _paginate_resources(
+            resources,
+            sort_columns,
+            limit,
+            offset,
+            prefetched
+        )
         if output_format == "list":
-            _print_list(resources, columns, header, "\t")
+            _print_list(resources, columns, header, "\t", prefetched)
         elif output_format == "csv":
-            _print_list(resources, columns, header, ";")
+            _print_list(resources, columns, header, ";", prefetched)
         elif output_format == "json":
-            _print_json(resources, columns)
+            _print_json(resources, columns, prefetched)
+        elif output_format == "ndjson":
+            _print_ndjson(resources, columns, prefetched)
         else:
-            _print_table(resources, columns, header, _sort)
+            _print_table(
+                resources,
+                columns,
+                header,
+                prefetched,
+                max_column_width,
+                buffered=(len(sort_columns) > 0)
+            )
     except libioc.errors.IocException:
         exit(1)
 
 
+def _list_jails(
+    filters: typing.Tuple[str, ...],
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger,
+    zfs: 'libioc.ZFS.ZFS'
+) -> typing.Generator['libioc.Jail.JailGenerator', None, None]:
+    """Yield the matching jails, except for the members of warm pools."""
+    yield from exclude_pool_members(
+        list_jails(filters, host, logger, zfs),
+        filters
+    )
+
+
+def _prefetch_zfs_properties(
+    host: libioc.Host.HostGenerator,
+    columns: typing.List[str]
+) -> typing.Optional[ZFSProperties]:
+    """
+    Get the ZFS-backed columns of all jails with one zfs get.
+
+    Both zfs.<property> columns and the columns in DATASET_COLUMNS are
+    read for the datasets below the jails dataset of every source, and the
+    datasets of jail children when a column needs them.
+    """
+    zfs_columns = [
+        x for x in (_get_zfs_column(column) for column in columns)
+        if x is not None
+    ]
+    if len(zfs_columns) == 0:
+        return None
+    properties = sorted(set(x[1] for x in zfs_columns))
+    depth = 2 if any((x[0] != "") for x in zfs_columns) else 1
+    return get_properties(
+        datasets=[x.jails.name for x in host.datasets.values()],
+        properties=properties,
+        depth=depth
+    )
+
+
+def _get_zfs_column(column: str) -> typing.Optional[typing.Tuple[str, str]]:
+    """Return the dataset child and ZFS property that answer a column."""
+    if column.startswith(ZFS_COLUMN_PREFIX):
+        return ("", column[len(ZFS_COLUMN_PREFIX):],)
+    return DATASET_COLUMNS.get(column, None)
+
+
+def _paginate_resources(
+    resources: typing.Iterable[typing.Any],
+    sort_columns: typing.List[SortColumn],
+    limit: typing.Optional[int]=None,
+    offset: int=0,
+    prefetched: typing.Optional[_PrefetchedValues]=None
+) -> typing.Iterator[typing.Any]:
+    """Sort and slice resources, comparing the native column values."""
+    return paginate(
+        resources,
+        sort_columns=sort_columns,
+        get_values=lambda resource, columns: _lookup_resource_values(
+            resource,
+            columns,
+            prefetched,
+            native=True
+        ),
+        limit=limit,
+        offset=offset
+    )
+
+
+class _WatchedJail:
+    """A jail that is kept between the updates of the watch mode."""
+
+    def __init__(self, jail: 'libioc.Jail.JailGenerator') -> None:
+        self.jail = jail
+        self.config_mtime = _get_config_mtime(jail)
+        self._values: typing.Dict[typing.Tuple[str, bool], NativeValue] = {}
+
+    def reload_if_changed(
+        self,
+        load_jail: typing.Callable[[str], 'libioc.Jail.JailGenerator']
+    ) -> bool:
+        """Read the jail again when its configuration file was modified."""
+        config_mtime = _get_config_mtime(self.jail)
+        if (config_mtime is None) or (config_mtime == self.config_mtime):
+            return False
+        self.jail = load_jail(self.jail.full_name)
+        self.config_mtime = config_mtime
+        self._values.clear()
+        return True
+
+    def values(
+        self,
+        columns: typing.List[str],
+        prefetched: _PrefetchedValues,
+        native: bool=False
+    ) -> typing.List[NativeValue]:
+        """Return the column values, reusing those of unchanged configs."""
+        values = []
+        for column in columns:
+            if (column in WATCH_VOLATILE_COLUMNS) \
+                    or prefetched.covers(column):
+                values.append(_lookup_resource_value(
+                    self.jail,
+                    column,
+                    prefetched,
+                    native
+                ))
+                continue
+            cache_key = (column, native,)
+            if cache_key not in self._values:
+                self._values[cache_key] = _lookup_resource_value(
+                    self.jail,
+                    column,
+                    prefetched,
+                    native
+                )
+            values.append(self._values[cache_key])
+        return values
+
+
+def _watch_jails(
+    list_jails: typing.Callable[
+        [],
+        typing.Iterable['libioc.Jail.JailGenerator']
+    ],
+    load_jail: typing.Callable[[str], 'libioc.Jail.JailGenerator'],
+    host: libioc.Host.HostGenerator,
+    columns: typing.List[str],
+    show_header: bool,
+    prefetched: _PrefetchedValues,
+    running: typing.Optional[bool]=None,
+    sort_columns: typing.Sequence[SortColumn]=(),
+    limit: typing.Optional[int]=None,
+    offset: int=0,
+    interval: float=2.0,
+    max_column_width: typing.Optional[int]=None
+) -> None:
+    """
+    Update a jail table until interrupted.
+
+    Jails are only enumerated again when a jails directory changed, and a
+    jail is only read again when its configuration file was modified. All
+    other updates take a new jls snapshot and evaluate the runtime columns.
+    """
+    runtime = typing.cast(JailRuntime, prefetched.runtime)
+    max_widths = None
+    if max_column_width is not None:
+        max_widths = dict((column, max_column_width) for column in columns)
+    screen = TableScreen(columns, show_header, max_widths)
+
+    watched: typing.Dict[str, _WatchedJail] = {}
+    jails_directories_mtime: typing.Optional[typing.List[float]] = None
+
+    while True:
+        directories_mtime = _get_jails_directories_mtime(host)
+        if directories_mtime != jails_directories_mtime:
+            jails_directories_mtime = directories_mtime
+            watched = dict(
+                (
+                    jail.full_name,
+                    watched[jail.full_name]
+                    if jail.full_name in watched else _WatchedJail(jail)
+                ) for jail in list_jails()
+            )
+        for watched_jail in watched.values():
+            watched_jail.reload_if_changed(load_jail)
+
+        runtime.invalidate()
+        if prefetched.zfs_properties is not None:
+            prefetched.zfs_properties = _prefetch_zfs_properties(host, columns)
+
+        selected = [
+            x for x in watched.values()
+            if (running is None) or (runtime.running(x.jail) is running)
+        ]
+        page = paginate(
+            selected,
+            sort_columns=sort_columns,
+            get_values=lambda x, sort_names: x.values(
+                sort_names,
+                prefetched,
+                native=True
+            ),
+            limit=limit,
+            offset=offset
+        )
+        screen.update(
+            [str(value) for value in x.values(columns, prefetched)]
+            for x in page
+        )
+        time.sleep(interval)
+
+
+def _get_config_mtime(
+    jail: 'libioc.Jail.JailGenerator'
+) -> typing.Optional[float]:
+    config_mtime = None
+    for filename in JAIL_CONFIG_FILES:
+        try:
+            mtime = os.stat(
+                os.path.join(jail.dataset.mountpoint, filename)
+            ).st_mtime
+        except OSError:
+            continue
+        config_mtime = max(mtime, config_mtime or mtime)
+    return config_mtime
+
+
+def _get_jails_directories_mtime(
+    host: libioc.Host.HostGenerator
+) -> typing.List[float]:
+    mtimes = []
+    for root_datasets in host.datasets.values():
+        try:
+            mtimes.append(os.stat(root_datasets.jails.mountpoint).st_mtime)
+        except OSError:
+            mtimes.append(0.0)
+    return mtimes
+
+
 def _print_table(
     resources: typing.Generator[
         typing.Union[
@@ -177,14 +580,34 @@ def _print_table(
     ],
     columns: list,
     show_header: bool,
-    sort_key: typing.Optional[str]=None
+    prefetched: typing.Optional[_PrefetchedValues]=None,
+    max_column_width: typing.Optional[int]=None,
+    buffered: bool=False
 ) -> None:
 
-    table_data = []
-    for resource in resources:
-        table_data.append(_lookup_resource_values(resource, columns))
+    table_data = (
+        _lookup_resource_values(resource, columns, prefetched)
+        for resource in resources
+    )
+
+    max_widths = None
+    if max_column_width is not None:
+        max_widths = dict((column, max_column_width) for column in columns)
+
+    if buffered is True:
+        # sorted rows are in memory already, so all of them size the columns
+        rows = list(table_data)
+        print_table_stream(
+            rows,
+            columns,
+            show_header,
+            max_widths,
+            sample_size=len(rows)
+        )
+        return
 
-    print_table(table_data, columns, show_header, sort_key)
+    # rows are printed while the resources are enumerated
+    print_table_stream(table_data, columns, show_header, max_widths)
 
 
 def _print_list(
@@ -198,14 +621,17 @@ def _print_list(
     ],
     columns: list,
     show_header: bool,
-    separator: str=";"
+    separator: str=";",
+    prefetched: typing.Optional[_PrefetchedValues]=None
 ) -> None:
 
     if show_header is True:
         print(separator.join(columns).upper())
 
     for resource in resources:
-        print(separator.join(_lookup_resource_values(resource, columns)))
+        print(separator.join(
+            _lookup_resource_values(resource, columns, prefetched)
+        ))
 
 
 def _print_json(
@@ -218,23 +644,53 @@ def _print_json(
         None
     ],
     columns: list,
+    prefetched: typing.Optional[_PrefetchedValues]=None,
     # json.dumps arguments
     indent: int=2,
     sort_keys: bool=True
 ) -> None:
-
-    output = []
+    """Print a JSON array whose items are written as they arrive."""
+    item_indent = " " * indent
+    separator = "["
     for resource in resources:
-        output.append(dict(zip(
-            columns,
-            _lookup_resource_values(resource, columns)
-        )))
-
-    print(json.dumps(
-        output,
-        indent=indent,
-        sort_keys=sort_keys
-    ))
+        item = json.dumps(
+            dict(zip(
+                columns,
+                _lookup_resource_values(resource, columns, prefetched, True)
+            )),
+            indent=indent,
+            sort_keys=sort_keys
+        )
+        print(separator)
+        print(item_indent + item.replace("\n", "\n" + item_indent), end="")
+        separator = ","
+
+    print("[]" if (separator == "[") else "\n]")
+
+
+def _print_ndjson(
+    resources: typing.Generator[
+        typing.Union[
+            libioc.ListableResource.ListableResource,
+            typing.List[typing.Dict[str, str]]
+        ],
+        None,
+        None
+    ],
+    columns: list,
+    prefetched: typing.Optional[_PrefetchedValues]=None,
+    sort_keys: bool=True
+) -> None:
+    """Print one compact JSON object per line and resource."""
+    for resource in resources:
+        print(json.dumps(
+            dict(zip(
+                columns,
+                _lookup_resource_values(resource, columns, prefetched, True)
+            )),
+            separators=(",", ":"),
+            sort_keys=sort_keys
+        ), flush=True)
 
 
 def _lookup_resource_values(
@@ -242,15 +698,27 @@ def _lookup_resource_values(
         'libioc.Resource.Resource',
         typing.Dict[str, str]
     ],
-    columns: typing.List[str]
-) -> typing.List[str]:
+    columns: typing.List[str],
+    prefetched: typing.Optional[_PrefetchedValues]=None,
+    native: bool=False
+) -> typing.List[typing.Any]:
     is_resorce = isinstance(resource, libioc.Resource.Resource)
 
     try:
         if is_resorce and ("getstring" in resource.__dir__()):
             _resource = resource  # type: libioc.Resource.Resource
             return list(map(
-                lambda column: str(_resource.getstring(column)),
+                lambda column: _lookup_resource_value(
+                    _resource,
+                    column,
+                    prefetched,
+                    native
+                ),
+                columns
+            ))
+        elif native is True:
+            return list(map(
+                lambda column: _to_native_value(resource[column]),
                 columns
             ))
         else:
@@ -262,6 +730,37 @@ def _lookup_resource_values(
         exit(1)
 
 
+def _lookup_resource_value(
+    resource: 'libioc.Resource.Resource',
+    column: str,
+    prefetched: typing.Optional[_PrefetchedValues]=None,
+    native: bool=False
+) -> NativeValue:
+    if (prefetched is not None) and prefetched.covers(column):
+        if native is True:
+            return prefetched.get_native(resource, column)
+        return prefetched.get(resource, column)
+
+    if native is True:
+        get_method = getattr(resource, "get", None)
+        if get_method is not None:
+            value = get_method(column)
+            if _is_native_value(value):
+                return typing.cast(NativeValue, value)
+
+    return str(resource.getstring(column))
+
+
+def _is_native_value(value: typing.Any) -> bool:
+    return (value is None) or isinstance(value, (str, int, float, bool,))
+
+
+def _to_native_value(value: typing.Any) -> NativeValue:
+    if _is_native_value(value):
+        return typing.cast(NativeValue, value)
+    return str(value)
+
+
 def _list_output_comumns(
     user_input: typing.Optional[str]="",
     long_mode: bool=False
@@ -0,0 +1,313 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Manage warm pools of pre-cloned jails from the CLI."""
+import typing
+import click
+
+import libioc.errors
+import libioc.Host
+import libioc.Jail
+import libioc.Logger
+import libioc.Release
+import libioc.ZFS
+
+from .shared.click import IocClickContext
+from .shared.inventory import remove_jail
+from .shared.jail import get_isolated_host, get_isolated_resource
+from .shared.output import print_table_stream
+from .shared.parallel import run_parallel
+from .shared.pool import get_pool, new_member_name, PoolKey, WarmPool
+
+__rootcmd__ = True
+
+
+def _get_pool_keys(
+    pool: WarmPool,
+    release: typing.Optional[str],
+    template: typing.Optional[str],
+    basejail: bool
+) -> typing.List[PoolKey]:
+    if release is not None:
+        return [PoolKey("release", release, basejail)]
+    elif template is not None:
+        return [PoolKey("template", template, basejail)]
+    return [key for key, target, ready in pool.status()]
+
+
+@click.command(name="fill", help="Create members until pools are full.")
+@click.pass_context
+@click.option("--release", "-r", default=None,
+              help="Fill the pool of clones of this RELEASE.")
+@click.option("--template", "-t", default=None,
+              help="Fill the pool of clones of this template.")
+@click.option("--basejail/--no-basejail", "-b/-nb", is_flag=True,
+              default=True, help="Pool basejails (default) or full clones.")
+@click.option("--size", "-s", default=None, type=click.IntRange(min=0),
+              help="Set the number of members the pool is kept at.")
+@click.option("--jobs", "-j", default=1, type=click.IntRange(min=1),
+              help="Number of members that are created concurrently.")
+@click.option("--source", default=None,
+              help="Root dataset of the pool (default: first one).")
+def cli_fill(
+    ctx: IocClickContext,
+    release: typing.Optional[str],
+    template: typing.Optional[str],
+    basejail: bool,
+    size: typing.Optional[int],
+    jobs: int,
+    source: typing.Optional[str]
+) -> None:
+    """Fill one or all warm pools up to their size."""
+    logger = ctx.parent.logger
+    host = ctx.parent.host
+    zfs = ctx.parent.zfs
+
+    if (release is not None) and (template is not None):
+        logger.error("--release and --template can't be used together")
+        exit(1)
+
+    try:
+        pool = get_pool(host, source)
+    except KeyError:
+        logger.error(f"Root dataset '{source}' not found")
+        exit(1)
+
+    keys = _get_pool_keys(pool, release, template, basejail)
+    if size is not None:
+        if len(keys) != 1:
+            logger.error("--size requires --release or --template")
+            exit(1)
+        pool.configure(keys[0], size)
+
+    try:
+        with pool.fill_lock():
+            failed = False
+            for key in keys:
+                failed = (_fill(pool, key, zfs, host, logger, jobs) is False) \
+                    or failed
+    except BlockingIOError:
+        logger.log("The pools are already being filled")
+        return
+
+    if failed is True:
+        exit(1)
+
+
+def _fill(
+    pool: WarmPool,
+    key: PoolKey,
+    zfs: 'libioc.ZFS.ZFS',
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger,
+    jobs: int=1
+) -> bool:
+    missing = pool.missing(key)
+    if missing == 0:
+        logger.verbose(f"Pool {key} is full")
+        return True
+
+    resource: typing.Union[
+        libioc.Release.ReleaseGenerator,
+        libioc.Jail.JailGenerator
+    ]
+    try:
+        if key.kind == "release":
+            resource = libioc.Release.ReleaseGenerator(
+                name=key.name,
+                root_datasets_name=pool.source,
+                logger=logger,
+                host=host,
+                zfs=zfs
+            )
+            if resource.fetched is False:
+                logger.error(f"The release '{key.name}' is not fetched")
+                return False
+        else:
+            resource = libioc.Jail.JailGenerator(
+                key.name,
+                root_datasets_name=pool.source,
+                logger=logger,
+                host=host,
+                zfs=zfs
+            )
+    except libioc.errors.IocException:
+        return False
+
+    def _create(name: str) -> None:
+        isolated_zfs = libioc.ZFS.get_zfs(logger=logger)
+        isolated_host = get_isolated_host(host, logger, zfs=isolated_zfs)
+        member = libioc.Jail.JailGenerator(
+            dict(name=name, boot=False, basejail=key.basejail),
+            root_datasets_name=pool.source,
+            logger=logger,
+            host=isolated_host,
+            zfs=isolated_zfs,
+            new=True
+        )
+        member.create(get_isolated_resource(
+            resource,
+            pool.source,
+            isolated_host,
+            logger,
+            isolated_zfs
+        ))
+
+    logger.log(f"Creating {missing} members of pool {key}")
+    names = [new_member_name() for _ in range(missing)]
+    pool.reserve(key, names)
+
+    # the first member is created alone, so that the snapshot of the
+    # resource exists before the others are cloned from it concurrently,
+    # each with its own ZFS handle and host
+    failed = False
+    for phase, phase_jobs in ((names[:1], 1,), (names[1:], jobs,)):
+        for result in run_parallel(phase, worker=_create, jobs=phase_jobs):
+            if result.failed is True:
+                logger.error(f"Pool member {result.item} failed to create")
+                pool.discard(key, result.item)
+                failed = True
+                continue
+            pool.add_member(key, result.item)
+    return (failed is False)
+
+
+@click.command(name="status", help="Show the size of the warm pools.")
+@click.pass_context
+@click.option("--source", default=None,
+              help="Root dataset of the pools (default: first one).")
+def cli_status(
+    ctx: IocClickContext,
+    source: typing.Optional[str]
+) -> None:
+    """List all warm pools with their ready members."""
+    try:
+        pool = get_pool(ctx.parent.host, source)
+    except KeyError:
+        ctx.parent.logger.error(f"Root dataset '{source}' not found")
+        exit(1)
+
+    print_table_stream(
+        (
+            [str(key), str(target), str(ready)]
+            for key, target, ready in pool.status()
+        ),
+        ["pool", "target", "ready"]
+    )
+
+
+@click.command(name="drain", help="Destroy the members of warm pools.")
+@click.pass_context
+@click.option("--release", "-r", default=None,
+              help="Drain the pool of clones of this RELEASE.")
+@click.option("--template", "-t", default=None,
+              help="Drain the pool of clones of this template.")
+@click.option("--basejail/--no-basejail", "-b/-nb", is_flag=True,
+              default=True, help="Drain the pool of basejails or clones.")
+@click.option("--source", default=None,
+              help="Root dataset of the pool (default: first one).")
+def cli_drain(
+    ctx: IocClickContext,
+    release: typing.Optional[str],
+    template: typing.Optional[str],
+    basejail: bool,
+    source: typing.Optional[str]
+) -> None:
+    """Remove one or all warm pools and destroy their members."""
+    logger = ctx.parent.logger
+    host = ctx.parent.host
+
+    try:
+        pool = get_pool(host, source)
+    except KeyError:
+        logger.error(f"Root dataset '{source}' not found")
+        exit(1)
+
+    failed_members = []
+    for key in _get_pool_keys(pool, release, template, basejail):
+        for name in pool.remove(key):
+            try:
+                member = libioc.Jail.JailGenerator(
+                    name,
+                    root_datasets_name=pool.source,
+                    logger=logger,
+                    host=host,
+                    zfs=ctx.parent.zfs
+                )
+                ctx.parent.print_events(member.destroy())
+                remove_jail(name, pool.source, host)
+            except libioc.errors.IocException:
+                failed_members.append(name)
+        logger.log(f"Pool {key} drained")
+
+    if len(failed_members) > 0:
+        logger.error("Failed to destroy: " + ", ".join(failed_members))
+        exit(1)
+
+
+class PoolCli(click.MultiCommand):
+    """Python Click pool subcommand boilerplate."""
+
+    def list_commands(self, ctx: click.core.Context) -> list:
+        """Mock subcommands for Python Click."""
+        return [
+            "fill",
+            "status",
+            "drain"
+        ]
+
+    def get_command(
+        self,
+        ctx: click.core.Context,
+        cmd_name: str
+    ) -> click.core.Command:
+        """Wrap subcommand for Python Click."""
+        command: typing.Optional[click.core.Command] = None
+
+        if cmd_name == "fill":
+            command = cli_fill
+        elif cmd_name == "status":
+            command = cli_status
+        elif cmd_name == "drain":
+            command = cli_drain
+
+        if command is None:
+            raise NotImplementedError("action does not exist")
+
+        return command
+
+
+@click.group(
+    name="pool",
+    cls=PoolCli
+)
+@click.pass_context
+def cli(
+    ctx: IocClickContext
+) -> None:
+    """Keep pre-cloned jails ready for instant creation."""
+    ctx.logger = ctx.parent.logger
+    ctx.host = ctx.parent.host
+    ctx.zfs = ctx.parent.zfs
+    ctx.print_events = ctx.parent.print_events
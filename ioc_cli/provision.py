@@ -32,6 +32,7 @@ import libioc.Logger
 
 from .shared.click import IocClickContext
 from .shared.jail import set_properties
+from .shared.pool import exclude_pool_members
 
 __rootcmd__ = True
 
@@ -79,12 +80,12 @@ def _provision(
     ]
 ) -> bool:
 
-    jails = libioc.Jails.JailsGenerator(
+    jails = exclude_pool_members(libioc.Jails.JailsGenerator(
         logger=logger,
         zfs=zfs,
         host=host,
         filters=filters
-    )
+    ), filters)
 
     changed_jails = []
     failed_jails = []
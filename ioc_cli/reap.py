@@ -0,0 +1,112 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Free the datasets of deferred destroys from the CLI."""
+import typing
+import click
+
+import libioc.Logger
+
+from .shared.click import IocClickContext
+from .shared.inventory import file_lock
+from .shared.trash import get_reap_lock_file, get_root_dataset_name, reap
+
+__rootcmd__ = True
+
+
+@click.command(name="reap", help="Destroy datasets left in the trash.")
+@click.pass_context
+@click.option("--source", default=None,
+              help="Reap the trash of this root dataset (default: all).")
+@click.option("--delay", "-d", default=0.0, type=click.FloatRange(min=0),
+              help="Seconds to wait between destroying two datasets.")
+@click.option("--limit", "-n", default=None, type=click.IntRange(min=1),
+              help="Maximum number of datasets destroyed per root dataset.")
+@click.option("--batch", "batches", multiple=True,
+              help="Trash batch of a finished destroy, removed once empty.")
+def cli(
+    ctx: IocClickContext,
+    source: typing.Optional[str],
+    delay: float,
+    limit: typing.Optional[int],
+    batches: typing.Tuple[str, ...]
+) -> None:
+    """
+    Destroy trashed datasets of deferred destroys.
+
+    A single reaper runs per root dataset. When another reaper is active,
+    the root dataset is skipped, unless batches were given, in which case
+    the reaper waits for the other one so that the batches are removed.
+    """
+    logger = ctx.parent.logger
+    host = ctx.parent.host
+
+    sources = [name for name, _ in host.datasets.items()]
+    if source is not None:
+        if source not in sources:
+            logger.error(f"Root dataset '{source}' not found")
+            exit(1)
+        sources = [source]
+
+    failed = False
+    for _source in sources:
+        try:
+            with file_lock(
+                get_reap_lock_file(host, _source),
+                blocking=(len(batches) > 0)
+            ):
+                failed = (_reap(
+                    get_root_dataset_name(host, _source),
+                    logger,
+                    delay=delay,
+                    limit=limit,
+                    complete_batches=batches
+                ) is False) or failed
+        except BlockingIOError:
+            logger.verbose(f"The trash of {_source} is already being reaped")
+
+    if failed is True:
+        exit(1)
+
+
+def _reap(
+    root_dataset_name: str,
+    logger: libioc.Logger.Logger,
+    delay: float=0,
+    limit: typing.Optional[int]=None,
+    complete_batches: typing.Iterable[str]=()
+) -> bool:
+    failed = False
+    for dataset, error in reap(
+        root_dataset_name,
+        delay=delay,
+        limit=limit,
+        complete_batches=complete_batches
+    ):
+        if error is not None:
+            logger.error(str(error))
+            failed = True
+            continue
+        logger.verbose(f"{dataset} destroyed")
+    return (failed is False)
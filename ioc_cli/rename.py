@@ -28,6 +28,7 @@ import click
 import libioc.Jail
 
 from .shared.click import IocClickContext
+from .shared.inventory import remove_jail, update_jail
 
 __rootcmd__ = True
 
@@ -44,16 +45,20 @@ def cli(
     """Rename a stopped jail."""
     logger = ctx.parent.logger
     print_function = ctx.parent.print_events
+    host = ctx.parent.host
 
     try:
         ioc_jail = libioc.Jail.Jail(
             jail,
             logger=logger,
             zfs=ctx.parent.zfs,
-            host=ctx.parent.host,
+            host=host,
             skip_invalid_config=True
         )
+        previous_name = ioc_jail.name
         print_function(ioc_jail.rename(name))
+        remove_jail(previous_name, ioc_jail.source, host)
+        update_jail(ioc_jail, host)
     except libioc.errors.IocException:
         exit(1)
 
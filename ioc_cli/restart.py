@@ -32,6 +32,7 @@ import libioc.Jails
 import libioc.Logger
 
 from .shared.click import IocClickContext
+from .shared.pool import exclude_pool_members
 
 __rootcmd__ = True
 
@@ -72,12 +73,12 @@ def cli(
         exit(1)
 
     try:
-        ioc_jails = libioc.Jails.JailsGenerator(
+        ioc_jails = exclude_pool_members(libioc.Jails.JailsGenerator(
             host=ctx.parent.host,
             zfs=ctx.parent.zfs,
             logger=logger,
             filters=jails
-        )
+        ), jails)
     except libioc.errors.IocException:
         exit(1)
 
@@ -30,8 +30,9 @@ import libioc.errors
 import libioc.Logger
 import libioc.helpers
 import libioc.Resource
-import libioc.Jails
 
+from .shared.inventory import list_jails, update_jail
+from .shared.pool import exclude_pool_members
 from .shared.jail import set_properties
 
 __rootcmd__ = True
@@ -73,15 +74,10 @@ def cli(
 
     filters = (f"name={jail}",)
 
-    try:
-        ioc_jails = libioc.Jails.JailsGenerator(
-            filters,
-            host=host,
-            logger=logger,
-            skip_invalid_config=True
-        )
-    except libioc.errors.IocException:
-        exit(1)
+    ioc_jails = exclude_pool_members(
+        list_jails(filters, host=host, logger=logger),
+        filters
+    )
 
     updated_jail_count = 0
 
@@ -92,6 +88,8 @@ def cli(
                 properties=props,
                 target=ioc_jail
             )
+            if len(updated_properties) > 0:
+                update_jail(ioc_jail, host)
         except libioc.errors.IocException:
             exit(1)
 
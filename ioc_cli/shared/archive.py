@@ -0,0 +1,152 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Write and read compressed tar archives of jails with external codecs."""
+import os
+import subprocess  # nosec: B404
+import tempfile
+import typing
+
+from .extract import TAR_COMMAND
+
+
+class ArchiveError(Exception):
+    """Raised when an archive could not be written or extracted."""
+
+
+class Codec(typing.NamedTuple):
+    """A compressor that reads a tar stream from stdin."""
+
+    command: str
+    min_level: int
+    max_level: int
+    magic: typing.Optional[bytes] = None
+
+    def get_args(
+        self,
+        threads: int=0,
+        level: typing.Optional[int]=None
+    ) -> typing.List[str]:
+        """Return the compressor command line."""
+        args = [self.command, "-c", f"-T{threads}"]
+        if level is not None:
+            if not (self.min_level <= level <= self.max_level):
+                raise ArchiveError(
+                    f"{os.path.basename(self.command)} supports levels "
+                    f"{self.min_level} to {self.max_level}"
+                )
+            args.append(f"-{level}")
+        return args
+
+
+# export formats with their compressor, both use all cores with -T0
+CODECS = {
+    # xz archives share their format with txz exports restored by libioc
+    "tar.xz": Codec("/usr/bin/xz", 0, 9),
+    "tar.zst": Codec("/usr/bin/zstd", 1, 19, magic=b"\x28\xb5\x2f\xfd"),
+}
+
+
+def get_archive_format(path: str) -> typing.Optional[str]:
+    """Return the format of archives that ioc extracts itself."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(max(len(x.magic or b"") for x in CODECS.values()))
+    except OSError:
+        return None
+    for name, codec in CODECS.items():
+        if (codec.magic is not None) and header.startswith(codec.magic):
+            return name
+    return None
+
+
+def compress_directory(
+    directory: str,
+    destination: str,
+    codec: Codec,
+    threads: int=0,
+    level: typing.Optional[int]=None
+) -> None:
+    """
+    Write a compressed tar archive of a directory.
+
+    tar streams the directory into the compressor, which writes the
+    destination file, so that nothing is staged on disk. The destination
+    must not exist and is removed when the archive is incomplete.
+    """
+    compressor_args = codec.get_args(threads=threads, level=level)
+    with open(destination, "xb") as f:
+        try:
+            _pipe(
+                [TAR_COMMAND, "-cf", "-", "-C", directory, "."],
+                compressor_args,
+                f
+            )
+        except (ArchiveError, OSError):
+            os.remove(destination)
+            raise
+
+
+def extract_archive(source: str, directory: str, codec: Codec) -> None:
+    """Decompress a tar archive into a directory, preserving permissions."""
+    _pipe(
+        [codec.command, "-dc", source],
+        [TAR_COMMAND, "-xpf", "-", "-C", directory]
+    )
+
+
+def _pipe(
+    producer_args: typing.List[str],
+    consumer_args: typing.List[str],
+    output: typing.Optional[typing.IO[bytes]]=None
+) -> None:
+    with tempfile.TemporaryFile() as producer_stderr:
+        producer = subprocess.Popen(  # nosec: B603
+            producer_args,
+            stdout=subprocess.PIPE,
+            stderr=producer_stderr
+        )
+        try:
+            consumer = subprocess.run(  # nosec: B603
+                consumer_args,
+                stdin=producer.stdout,
+                stdout=output,
+                stderr=subprocess.PIPE,
+                check=False
+            )
+        finally:
+            typing.cast(typing.IO[bytes], producer.stdout).close()
+            producer.wait()
+        producer_stderr.seek(0)
+        producer_errors = producer_stderr.read().decode("UTF-8")
+
+    if producer.returncode != 0:
+        raise ArchiveError(
+            f"{producer_args[0]} failed: {producer_errors.strip()}"
+        )
+    if consumer.returncode != 0:
+        consumer_errors = consumer.stderr.decode("UTF-8")
+        raise ArchiveError(
+            f"{consumer_args[0]} failed: {consumer_errors.strip()}"
+        )
@@ -0,0 +1,319 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Keep release assets in a content-addressed local cache."""
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import typing
+import urllib.parse
+
+from .download import download_file, fetch_text, DownloadError, PART_SUFFIX
+
+CACHE_DIRECTORY = "/var/cache/ioc"
+
+# least recently used assets are removed above this total size
+CACHE_MAX_SIZE = 8 * 1024 * 1024 * 1024
+
+ASSETS_DIRECTORY = "assets"
+MANIFESTS_DIRECTORY = "manifests"
+UPDATES_DIRECTORY = "updates"
+
+# freebsd-update names its files by the SHA256 of their gunzipped content
+UPDATE_FILENAME_PATTERN = re.compile(r"^([0-9a-f]{64})\.gz$")
+
+
+class CacheEntry(typing.NamedTuple):
+    """An asset or update file in the cache."""
+
+    sha256: str
+    size: int
+    last_used: float
+    path: str
+
+
+class AssetCache:
+    """
+    Release assets stored by their SHA256 checksum.
+
+    Assets are looked up by the checksum the release MANIFEST lists for
+    them, so that equal files are stored once, regardless of the release or
+    mirror they were fetched from. The MANIFEST of every release is kept as
+    well, so that hosts without internet access can resolve checksums. The
+    files freebsd-update downloaded for a release are kept per release. The
+    modification time of a file records its last use.
+    """
+
+    def __init__(
+        self,
+        directory: str=CACHE_DIRECTORY,
+        max_size: int=CACHE_MAX_SIZE
+    ) -> None:
+        self.directory = directory
+        self.max_size = max_size
+
+    @property
+    def assets_directory(self) -> str:
+        """Return the directory that holds the assets."""
+        return os.path.join(self.directory, ASSETS_DIRECTORY)
+
+    @property
+    def manifests_directory(self) -> str:
+        """Return the directory that holds the release manifests."""
+        return os.path.join(self.directory, MANIFESTS_DIRECTORY)
+
+    @property
+    def updates_directory(self) -> str:
+        """Return the directory that holds the release update files."""
+        return os.path.join(self.directory, UPDATES_DIRECTORY)
+
+    def get(self, sha256: str) -> typing.Optional[str]:
+        """Return the path of a cached asset and mark it as used."""
+        path = os.path.join(self.assets_directory, sha256.lower())
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, sha256: str, source: str) -> str:
+        """Add a verified file to the cache and return its cached path."""
+        os.makedirs(self.assets_directory, exist_ok=True)
+        path = os.path.join(self.assets_directory, sha256.lower())
+        if os.path.isfile(path):
+            os.utime(path)
+            return path
+        link_or_copy(source, path)
+        self.prune()
+        return path
+
+    def fetch_from_peer(
+        self,
+        peer_url: str,
+        sha256: str
+    ) -> typing.Optional[str]:
+        """Download an asset from the cache of a peer host."""
+        os.makedirs(self.assets_directory, exist_ok=True)
+        path = os.path.join(self.assets_directory, sha256.lower())
+        url = _join_url(peer_url, ASSETS_DIRECTORY, sha256.lower())
+        try:
+            download_file(url, path, sha256=sha256)
+        except (DownloadError, OSError):
+            return None
+        self.prune()
+        return path
+
+    def get_manifest(self, release_name: str) -> typing.Optional[str]:
+        """Return the cached MANIFEST of a release."""
+        try:
+            with open(self._get_manifest_path(release_name), "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_manifest(self, release_name: str, text: str) -> None:
+        """Store the MANIFEST of a release."""
+        os.makedirs(self.manifests_directory, exist_ok=True)
+        path = self._get_manifest_path(release_name)
+        temporary_file = f"{path}.{os.getpid()}"
+        with open(temporary_file, "w") as f:
+            f.write(text)
+        os.rename(temporary_file, path)
+
+    def restore_updates(self, release_name: str, files_directory: str) -> int:
+        """
+        Place the cached update files of a release in a files directory.
+
+        freebsd-update does not download files that already exist in its
+        files directory. Returns the number of files that were restored.
+        """
+        directory = self._get_updates_path(release_name)
+        count = 0
+        for filename in _list_update_files(directory):
+            destination = os.path.join(files_directory, filename)
+            if os.path.exists(destination):
+                continue
+            os.makedirs(files_directory, exist_ok=True)
+            source = os.path.join(directory, filename)
+            os.utime(source)
+            link_or_copy(source, destination)
+            count += 1
+        return count
+
+    def store_updates(self, release_name: str, files_directory: str) -> int:
+        """
+        Add the files freebsd-update downloaded for a release to the cache.
+
+        Files are verified against the checksum in their name. Returns the
+        number of files that were added.
+        """
+        directory = self._get_updates_path(release_name)
+        count = 0
+        for filename in _list_update_files(files_directory):
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                continue
+            source = os.path.join(files_directory, filename)
+            if get_update_checksum(source) != filename[:-len(".gz")]:
+                continue
+            os.makedirs(directory, exist_ok=True)
+            link_or_copy(source, path)
+            count += 1
+        if count > 0:
+            self.prune()
+        return count
+
+    def entries(self) -> typing.List[CacheEntry]:
+        """Return all cached files, least recently used first."""
+        entries = []
+        files = [
+            (x, os.path.join(self.assets_directory, x),)
+            for x in _list_directory(self.assets_directory)
+            if (len(x) == 64) and (x.endswith(PART_SUFFIX) is False)
+        ]
+        for release_directory in _list_directory(self.updates_directory):
+            directory = os.path.join(self.updates_directory, release_directory)
+            files += [
+                (x[:-len(".gz")], os.path.join(directory, x),)
+                for x in _list_update_files(directory)
+            ]
+        for sha256, path in files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append(
+                CacheEntry(sha256, stat.st_size, stat.st_mtime, path)
+            )
+        return sorted(entries, key=lambda x: x.last_used)
+
+    def prune(
+        self,
+        max_size: typing.Optional[int]=None
+    ) -> typing.List[CacheEntry]:
+        """Remove least recently used assets above the size limit."""
+        limit = self.max_size if (max_size is None) else max_size
+        entries = self.entries()
+        total_size = sum(x.size for x in entries)
+        removed = []
+        for entry in entries:
+            if total_size <= limit:
+                break
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            total_size -= entry.size
+            removed.append(entry)
+        return removed
+
+    def _get_manifest_path(self, release_name: str) -> str:
+        return os.path.join(
+            self.manifests_directory,
+            _get_manifest_filename(release_name)
+        )
+
+    def _get_updates_path(self, release_name: str) -> str:
+        return os.path.join(
+            self.updates_directory,
+            _get_manifest_filename(release_name)
+        )
+
+
+def parse_size(value: str) -> int:
+    """Parse a size in bytes with an optional K, M, G or T suffix."""
+    units = "KMGT"
+    text = value.strip().upper().rstrip("B")
+    exponent = 0
+    if (len(text) > 0) and (text[-1] in units):
+        exponent = units.index(text[-1]) + 1
+        text = text[:-1]
+    try:
+        return int(float(text) * (1024 ** exponent))
+    except ValueError:
+        raise ValueError(f"Invalid size: {value}")
+
+
+def get_update_checksum(path: str) -> typing.Optional[str]:
+    """Return the SHA256 of the gunzipped content of an update file."""
+    checksum = hashlib.sha256()
+    try:
+        with gzip.open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                checksum.update(chunk)
+    except (OSError, EOFError):
+        return None
+    return checksum.hexdigest()
+
+
+def link_or_copy(source: str, destination: str) -> None:
+    """Atomically place a hard link or a copy of a file at a destination."""
+    temporary_file = f"{destination}.{os.getpid()}"
+    try:
+        os.link(source, temporary_file)
+    except OSError:
+        shutil.copyfile(source, temporary_file)
+    os.rename(temporary_file, destination)
+
+
+def fetch_peer_manifest(
+    peer_url: str,
+    release_name: str
+) -> typing.Optional[str]:
+    """Download the MANIFEST of a release from the cache of a peer host."""
+    url = _join_url(
+        peer_url,
+        MANIFESTS_DIRECTORY,
+        _get_manifest_filename(release_name)
+    )
+    try:
+        return fetch_text(url)
+    except DownloadError:
+        return None
+
+
+def _list_directory(directory: str) -> typing.List[str]:
+    try:
+        return os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+
+def _list_update_files(directory: str) -> typing.List[str]:
+    return [
+        x for x in _list_directory(directory)
+        if UPDATE_FILENAME_PATTERN.match(x) is not None
+    ]
+
+
+def _join_url(base_url: str, *parts: str) -> str:
+    return "/".join(
+        [base_url.rstrip("/")] + [urllib.parse.quote(x) for x in parts]
+    )
+
+
+def _get_manifest_filename(release_name: str) -> str:
+    return release_name.replace("/", "_")
@@ -30,12 +30,15 @@ import libioc.events
 import libioc.Logger
 import libioc.Host
 
+from .host import HostCapabilities
+
 
 class IocClickContext(click.core.Context):
     """ioc ctx for Click CLI."""
 
     logger: libioc.Logger.Logger
     host: libioc.Host.Host
+    capabilities: HostCapabilities
     parent: 'IocClickContext'
     print_events: typing.Callable[
         [typing.Generator[libioc.events.IocEvent, None, None]],
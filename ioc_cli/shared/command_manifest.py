@@ -0,0 +1,193 @@
+# This file is generated by `make manifest` - do not edit.
+"""Static manifest of the ioc subcommands."""
+import typing
+
+COMMANDS: typing.Dict[str, typing.Dict[str, typing.Any]] = {
+    "activate": {
+        "help": "Set a zpool active for iocage usage.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "apply": {
+        "help": "Create and configure jails described in a manifest.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "cache": {
+        "help": "Manage the content-addressed cache of release assets.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "clone": {
+        "help": "Clone and promote jails.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "console": {
+        "help": "Login to a jail.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "create": {
+        "help": "Create a jail.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "daemon": {
+        "help": "Serve read-only commands from a warm process.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "deactivate": {
+        "help": "Disable a ZFS pool for libioc.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "destroy": {
+        "help": "Destroy specified resource",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "exec": {
+        "help": (
+            "Run the given command inside the specified jail.\n\nWhen "
+            "executing commands with own options or flags the end of "
+            "ioc options\ncan be marked with a double-dash or the "
+            "full command can be quoted:\n\n    ioc exec myjail -- ps "
+            "-aux"
+        ),
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "export": {
+        "help": "Export a jail to a backup destination",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "fetch": {
+        "help": "Fetch and update a Release to create Jails from them.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "fstab": {
+        "help": "View and manipulate a jails fstab file.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "get": {
+        "help": (
+            "Gets the specified property.\n\n    Specify an individual "
+            "jail by its name or use `defaults` to get the "
+            "host's\n    defaults from the main source dataset.\n    "
+        ),
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": False
+    },
+    "import": {
+        "help": "Import a jail from a backup archive",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "list": {
+        "help": (
+            "List a specified dataset type, by default lists all "
+            "jails."
+        ),
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "migrate": {
+        "help": "Migrate jails to the latest format.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "pkg": {
+        "help": "Manage packages in a jail.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": False
+    },
+    "pool": {
+        "help": "Keep pre-cloned jails ready for instant creation.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "promote": {
+        "help": "Clone and promote jails.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "provision": {
+        "help": "Trigger provisioning of jails.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "reap": {
+        "help": "Destroy datasets left in the trash.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "rename": {
+        "help": "Rename a stopped jail.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "restart": {
+        "help": "Restarts the specified jails.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "set": {
+        "help": "Sets the specified property.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "snapshot": {
+        "help": "Take and manage resource snapshots.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "start": {
+        "help": "Starts the specified jails or ALL.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "stop": {
+        "help": "Stops the specified jails or ALL.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    },
+    "update": {
+        "help": "Update a jail to a new release or patchlevel.",
+        "short_help": None,
+        "hidden": False,
+        "rootcmd": True
+    }
+}
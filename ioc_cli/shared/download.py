@@ -0,0 +1,517 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Download release assets in parallel ranges that can be resumed."""
+import concurrent.futures
+import hashlib
+import http.server
+import json
+import os
+import re
+import shutil
+import socketserver
+import sys
+import typing
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import click
+
+# bytes of an asset that are requested at once
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# bytes read from a response or file at a time
+READ_SIZE = 64 * 1024
+
+# seconds until a stalled connection is given up
+TIMEOUT = 60
+
+PART_SUFFIX = ".part"
+JOURNAL_SUFFIX = ".journal"
+
+_CONTENT_RANGE_PATTERN = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+_RANGE_PATTERN = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+class DownloadError(Exception):
+    """Raised when a file cannot be downloaded."""
+
+
+class ChecksumMismatch(DownloadError):
+    """Raised when a downloaded file does not match its checksum."""
+
+    def __init__(self, url: str, expected: str, actual: str) -> None:
+        self.expected = expected
+        self.actual = actual
+        super().__init__(
+            f"Checksum mismatch of {url}: expected {expected}, got {actual}"
+        )
+
+
+class RemoteFile(typing.NamedTuple):
+    """Size and range support of a file on an HTTP server."""
+
+    size: typing.Optional[int]
+    ranges: bool
+    etag: typing.Optional[str]
+
+
+def parse_manifest(text: str) -> typing.Dict[str, str]:
+    """Return the SHA256 checksums of a FreeBSD release MANIFEST."""
+    checksums = {}
+    for line in text.splitlines():
+        fields = line.split("\t")
+        if len(fields) >= 2:
+            checksums[fields[0]] = fields[1].lower()
+    return checksums
+
+
+def fetch_manifest(url: str, timeout: int=TIMEOUT) -> typing.Dict[str, str]:
+    """Download and parse a release MANIFEST."""
+    return parse_manifest(fetch_text(url, timeout=timeout))
+
+
+def fetch_text(url: str, timeout: int=TIMEOUT) -> str:
+    """Download a small text file such as a release MANIFEST."""
+    try:
+        with open_url(url, timeout=timeout) as response:
+            return str(response.read().decode("UTF-8"))
+    except (OSError, urllib.error.URLError) as e:
+        raise DownloadError(f"Cannot fetch {url}: {e}")
+
+
+def probe(url: str, timeout: int=TIMEOUT) -> RemoteFile:
+    """Request the first byte of a file to learn about range support."""
+    try:
+        with open_url(url, start=0, end=0, timeout=timeout) as response:
+            etag = response.headers.get("ETag", None)
+            match = _CONTENT_RANGE_PATTERN.match(
+                response.headers.get("Content-Range", "")
+            )
+            if (response.status == 206) and (match is not None):
+                return RemoteFile(int(match.group(3)), True, etag)
+            length = response.headers.get("Content-Length", None)
+            size = None if (length is None) else int(length)
+            return RemoteFile(size, False, etag)
+    except (OSError, urllib.error.URLError) as e:
+        raise DownloadError(f"Cannot fetch {url}: {e}")
+
+
+def download_file(
+    url: str,
+    destination: str,
+    sha256: typing.Optional[str]=None,
+    jobs: int=4,
+    chunk_size: int=CHUNK_SIZE,
+    timeout: int=TIMEOUT
+) -> str:
+    """
+    Download a file and return its SHA256 checksum.
+
+    Servers that support range requests are asked for chunks of the file
+    concurrently. Completed chunks are recorded in a journal next to the
+    partial file, so that an interrupted download continues where it
+    stopped. The checksum is computed while chunks arrive, following the
+    contiguous prefix of the file, and is verified before the partial file
+    is moved to its destination. Servers without range support are read
+    in a single stream.
+    """
+    part_file = destination + PART_SUFFIX
+    journal_file = part_file + JOURNAL_SUFFIX
+
+    remote = probe(url, timeout=timeout)
+    if (remote.ranges is False) or (remote.size is None):
+        digest = _download_stream(url, part_file, timeout)
+    else:
+        digest = _download_ranges(
+            url,
+            part_file,
+            journal_file,
+            remote,
+            jobs=jobs,
+            chunk_size=chunk_size,
+            timeout=timeout
+        )
+
+    if (sha256 is not None) and (digest != sha256.lower()):
+        os.remove(part_file)
+        _remove(journal_file)
+        raise ChecksumMismatch(url, sha256.lower(), digest)
+
+    os.rename(part_file, destination)
+    _remove(journal_file)
+    return digest
+
+
+def download_files(
+    base_url: str,
+    filenames: typing.List[str],
+    directory: str,
+    checksums: typing.Optional[typing.Dict[str, str]]=None,
+    jobs: int=4,
+    chunk_size: int=CHUNK_SIZE,
+    timeout: int=TIMEOUT
+) -> typing.Iterator[typing.Tuple[str, typing.Optional[Exception]]]:
+    """
+    Download many files of a directory concurrently.
+
+    The jobs are shared between the files and the chunks of each file.
+    Files that exist and match their checksum are not downloaded again.
+    Yields the filename and the error, if any, of each finished download.
+    """
+    checksums = checksums or {}
+    os.makedirs(directory, exist_ok=True)
+    pending = []
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        expected = checksums.get(filename, None)
+        if (expected is not None) and os.path.isfile(path) \
+                and (file_sha256(path) == expected.lower()):
+            yield filename, None
+            continue
+        pending.append(filename)
+
+    if len(pending) == 0:
+        return
+
+    file_jobs = min(jobs, len(pending))
+    chunk_jobs = max(1, jobs // file_jobs)
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=file_jobs
+    ) as executor:
+        futures = {
+            executor.submit(
+                download_file,
+                base_url.rstrip("/") + "/" + filename,
+                os.path.join(directory, filename),
+                checksums.get(filename, None),
+                chunk_jobs,
+                chunk_size,
+                timeout
+            ): filename
+            for filename in pending
+        }
+        for future in concurrent.futures.as_completed(futures):
+            error = future.exception()
+            yield futures[future], typing.cast(Exception, error)
+
+
+def file_sha256(path: str) -> str:
+    """Return the SHA256 checksum of a local file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def open_url(
+    url: str,
+    start: typing.Optional[int]=None,
+    end: typing.Optional[int]=None,
+    timeout: int=TIMEOUT
+) -> typing.Any:
+    """Open a URL, optionally asking for a range of bytes."""
+    request = urllib.request.Request(url)
+    if start is not None:
+        _end = "" if (end is None) else str(end)
+        request.add_header("Range", f"bytes={start}-{_end}")
+    return urllib.request.urlopen(request, timeout=timeout)  # nosec: B310
+
+
+def _download_stream(url: str, part_file: str, timeout: int) -> str:
+    digest = hashlib.sha256()
+    try:
+        with open_url(url, timeout=timeout) as response, \
+                open(part_file, "wb") as f:
+            for data in iter(lambda: response.read(READ_SIZE), b""):
+                f.write(data)
+                digest.update(data)
+    except (OSError, urllib.error.URLError) as e:
+        raise DownloadError(f"Cannot fetch {url}: {e}")
+    return digest.hexdigest()
+
+
+def _download_ranges(
+    url: str,
+    part_file: str,
+    journal_file: str,
+    remote: RemoteFile,
+    jobs: int,
+    chunk_size: int,
+    timeout: int
+) -> str:
+    size = typing.cast(int, remote.size)
+    journal = dict(url=url, size=size, etag=remote.etag, chunk_size=chunk_size)
+    completed = _read_journal(journal_file, journal)
+    if (len(completed) == 0) or not os.path.isfile(part_file):
+        completed = set()
+        with open(part_file, "wb") as f:
+            f.truncate(size)
+
+    chunks = [
+        (offset, min(offset + chunk_size, size) - 1,)
+        for offset in range(0, size, chunk_size)
+    ]
+    digest = hashlib.sha256()
+    hashed_chunks = 0
+
+    fd = os.open(part_file, os.O_RDWR)
+    try:
+        def _hash_completed_prefix() -> int:
+            index = hashed_chunks
+            while (index < len(chunks)) and (index in completed):
+                start, end = chunks[index]
+                offset = start
+                while offset <= end:
+                    length = min(READ_SIZE, end + 1 - offset)
+                    data = os.pread(fd, length, offset)
+                    if len(data) == 0:
+                        raise DownloadError(f"Truncated partial file of {url}")
+                    digest.update(data)
+                    offset += len(data)
+                index += 1
+            return index
+
+        hashed_chunks = _hash_completed_prefix()
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, jobs)
+        ) as executor:
+            futures = {
+                executor.submit(_download_range, url, fd, start, end, timeout):
+                index
+                for index, (start, end) in enumerate(chunks)
+                if index not in completed
+            }
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+                    completed.add(futures[future])
+                    _write_journal(journal_file, journal, completed)
+                    hashed_chunks = _hash_completed_prefix()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        os.close(fd)
+
+    return digest.hexdigest()
+
+
+def _download_range(
+    url: str,
+    fd: int,
+    start: int,
+    end: int,
+    timeout: int
+) -> None:
+    try:
+        with open_url(url, start=start, end=end, timeout=timeout) as response:
+            if response.status != 206:
+                raise DownloadError(f"{url} does not support range requests")
+            offset = start
+            for data in iter(lambda: response.read(READ_SIZE), b""):
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+    except (OSError, urllib.error.URLError) as e:
+        raise DownloadError(f"Cannot fetch {url}: {e}")
+    if offset != (end + 1):
+        raise DownloadError(f"Incomplete range {start}-{end} of {url}")
+
+
+def _read_journal(
+    journal_file: str,
+    journal: typing.Dict[str, typing.Any]
+) -> typing.Set[int]:
+    try:
+        with open(journal_file, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    # a journal of another remote file version cannot be resumed
+    if any(data.get(key) != value for key, value in journal.items()):
+        return set()
+    return set(int(x) for x in data.get("completed", []))
+
+
+def _write_journal(
+    journal_file: str,
+    journal: typing.Dict[str, typing.Any],
+    completed: typing.Set[int]
+) -> None:
+    temporary_file = f"{journal_file}.{os.getpid()}"
+    with open(temporary_file, "w") as f:
+        json.dump(dict(journal, completed=sorted(completed)), f)
+    os.rename(temporary_file, journal_file)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve files of a directory with support for single range requests."""
+
+    def __init__(self, *args: typing.Any, root: str=".") -> None:
+        self.root = os.path.abspath(root)
+        super().__init__(*args)
+
+    def translate_path(self, path: str) -> str:
+        """Map a request path to a file below the served directory."""
+        path = urllib.parse.unquote(urllib.parse.urlsplit(path).path)
+        parts = [x for x in path.split("/") if x not in ("", ".", "..",)]
+        return os.path.join(self.root, *parts)
+
+    def send_head(self) -> typing.Any:
+        """Answer a GET or HEAD request, partially when a range is given."""
+        match = _RANGE_PATTERN.match(self.headers.get("Range", ""))
+        path = self.translate_path(self.path)
+        if (match is None) or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        start = int(match.group(1))
+        end = min(int(match.group(2) or (size - 1)), size - 1)
+        if start > end:
+            self.send_error(416)
+            return None
+
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return _LimitedFile(f, end + 1 - start)
+
+    def copyfile(self, source: typing.Any, outputfile: typing.Any) -> None:
+        """Copy at most the requested range to the client."""
+        shutil.copyfileobj(source, outputfile, READ_SIZE)
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        """Do not log every request to stderr."""
+        pass
+
+
+class _LimitedFile:
+
+    def __init__(self, f: typing.BinaryIO, length: int) -> None:
+        self.f = f
+        self.remaining = length
+
+    def read(self, size: int=-1) -> bytes:
+        if (size < 0) or (size > self.remaining):
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP server that answers every request on its own thread."""
+
+    daemon_threads = True
+
+    def handle_error(self, request: typing.Any, client_address: str) -> None:
+        """Ignore clients that disconnect before a response is complete."""
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def serve_directory(directory: str, address: str, port: int) -> None:
+    """Serve the files of a directory over HTTP until interrupted."""
+    def handler(*args: typing.Any) -> RangeRequestHandler:
+        return RangeRequestHandler(*args, root=directory)
+
+    with ThreadingHTTPServer((address, port), handler) as server:
+        server.serve_forever()
+
+
+@click.group(name="download")
+def _test_cli() -> None:
+    r"""
+    Exercise the downloader without libioc.
+
+    A directory of fake release assets can be served with range support by
+    one process and downloaded by another one:
+
+        python3 -m ioc_cli.shared.download serve --directory ./assets
+        python3 -m ioc_cli.shared.download get --directory ./out \
+            http://127.0.0.1:8080 base.txz lib32.txz
+    """
+    pass
+
+
+@_test_cli.command(name="serve")
+@click.option("--directory", default=".", help="Directory to serve.")
+@click.option("--address", default="127.0.0.1", help="Address to bind.")
+@click.option("--port", default=8080, type=int, help="Port to listen on.")
+def _test_serve(directory: str, address: str, port: int) -> None:
+    serve_directory(directory, address, port)
+
+
+@_test_cli.command(name="get")
+@click.option("--directory", default=".", help="Download directory.")
+@click.option("--jobs", "-j", default=4, type=click.IntRange(min=1))
+@click.option("--chunk-size", default=CHUNK_SIZE, type=click.IntRange(min=1))
+@click.argument("url")
+@click.argument("filenames", nargs=-1)
+def _test_get(
+    directory: str,
+    jobs: int,
+    chunk_size: int,
+    url: str,
+    filenames: typing.Tuple[str, ...]
+) -> None:
+    try:
+        checksums = fetch_manifest(url.rstrip("/") + "/MANIFEST")
+    except DownloadError:
+        checksums = {}
+    failed = False
+    for filename, error in download_files(
+        url,
+        list(filenames),
+        directory,
+        checksums,
+        jobs=jobs,
+        chunk_size=chunk_size
+    ):
+        print(f"{filename}: {error or 'ok'}")
+        failed = failed or (error is not None)
+    sys.exit(int(failed))
+
+
+if __name__ == "__main__":
+    _test_cli()
@@ -0,0 +1,260 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Extract release assets while they are downloaded."""
+import collections
+import concurrent.futures
+import hashlib
+import os
+import queue
+import subprocess  # nosec: B404
+import threading
+import typing
+import urllib.error
+
+from .download import (
+    ChecksumMismatch,
+    DownloadError,
+    PART_SUFFIX,
+    READ_SIZE,
+    TIMEOUT,
+    open_url
+)
+
+TAR_COMMAND = "/usr/bin/tar"
+
+# blocks of READ_SIZE buffered between the download and tar
+QUEUE_SIZE = 64
+
+
+class ExtractionError(DownloadError):
+    """Raised when an asset could not be extracted."""
+
+
+class Asset(typing.NamedTuple):
+    """An archive that is extracted from a URL or a local file."""
+
+    name: str
+    source: str
+    sha256: typing.Optional[str] = None
+    copy_to: typing.Optional[str] = None
+
+
+class ExtractionResult(typing.NamedTuple):
+    """Outcome of the extraction of one asset."""
+
+    asset: Asset
+    paths: typing.List[str]
+    error: typing.Optional[Exception]
+
+
+def stream_extract(
+    asset: Asset,
+    root: str,
+    paths: typing.List[str],
+    timeout: int=TIMEOUT
+) -> None:
+    """
+    Unpack an xz compressed asset into a directory while it is read.
+
+    A reader thread fills a bounded queue, so that the download and the
+    extraction overlap without buffering more than QUEUE_SIZE blocks. The
+    checksum is updated with every block, and an optional copy of the
+    archive is written next to it. The extracted paths, as listed by tar,
+    are appended to paths, so that they can be rolled back by the caller.
+    """
+    blocks: 'queue.Queue[typing.Optional[bytes]]' = queue.Queue(QUEUE_SIZE)
+    reader_errors: typing.List[BaseException] = []
+    stop_reading = threading.Event()
+
+    def _read() -> None:
+        try:
+            for data in _read_source(asset.source, timeout):
+                if stop_reading.is_set():
+                    return
+                blocks.put(data)
+        except BaseException as e:
+            reader_errors.append(e)
+        finally:
+            blocks.put(None)
+
+    process = subprocess.Popen(  # nosec: B603
+        [TAR_COMMAND, "-xpvJf", "-", "-C", root],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT
+    )
+    output_lines: typing.Deque[str] = collections.deque(maxlen=3)
+    listing = threading.Thread(
+        target=_read_listing,
+        args=(process.stdout, paths, output_lines),
+        daemon=True
+    )
+    listing.start()
+    reader = threading.Thread(target=_read, daemon=True)
+    reader.start()
+
+    digest = hashlib.sha256()
+    copy_file = None
+    if asset.copy_to is not None:
+        copy_file = open(asset.copy_to + PART_SUFFIX, "wb")
+    try:
+        while True:
+            data = blocks.get()
+            if data is None:
+                break
+            digest.update(data)
+            if copy_file is not None:
+                copy_file.write(data)
+            typing.cast(typing.BinaryIO, process.stdin).write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        stop_reading.set()
+        # unblock the reader when it waits for a free slot
+        while reader.is_alive():
+            try:
+                blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if copy_file is not None:
+            copy_file.close()
+        try:
+            typing.cast(typing.BinaryIO, process.stdin).close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+        listing.join()
+
+    if len(reader_errors) > 0:
+        _remove_copy(asset)
+        raise ExtractionError(
+            f"Cannot read {asset.source}: {reader_errors[0]}"
+        )
+    if returncode != 0:
+        _remove_copy(asset)
+        raise ExtractionError(
+            f"Extracting {asset.name} failed: " + "".join(output_lines)
+        )
+    actual = digest.hexdigest()
+    if (asset.sha256 is not None) and (actual != asset.sha256.lower()):
+        _remove_copy(asset)
+        raise ChecksumMismatch(asset.source, asset.sha256.lower(), actual)
+    if asset.copy_to is not None:
+        os.rename(asset.copy_to + PART_SUFFIX, asset.copy_to)
+
+
+def extract_assets(
+    assets: typing.List[Asset],
+    root: str,
+    jobs: int=4,
+    timeout: int=TIMEOUT
+) -> typing.List[ExtractionResult]:
+    """
+    Extract assets into the same directory concurrently.
+
+    When any asset fails, the files extracted from all assets are removed
+    again, so that the directory is left as it was.
+    """
+    results = []
+
+    def _extract(asset: Asset) -> ExtractionResult:
+        paths: typing.List[str] = []
+        try:
+            stream_extract(asset, root, paths, timeout=timeout)
+        except (DownloadError, OSError) as e:
+            return ExtractionResult(asset, paths, e)
+        return ExtractionResult(asset, paths, None)
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(jobs, len(assets)))
+    ) as executor:
+        for result in executor.map(_extract, assets):
+            results.append(result)
+
+    if any(x.error is not None for x in results):
+        rollback(root, [path for x in results for path in x.paths])
+    return results
+
+
+def rollback(root: str, paths: typing.List[str]) -> None:
+    """Remove extracted files and the directories they leave empty."""
+    root = os.path.realpath(root)
+    directories = []
+    for path in paths:
+        absolute_path = os.path.normpath(os.path.join(root, path))
+        if not absolute_path.startswith(root + "/"):
+            continue
+        try:
+            if os.path.isdir(absolute_path) \
+                    and not os.path.islink(absolute_path):
+                directories.append(absolute_path)
+            else:
+                os.unlink(absolute_path)
+        except OSError:
+            continue
+    for directory in sorted(directories, key=len, reverse=True):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+
+def _read_source(
+    source: str,
+    timeout: int
+) -> typing.Iterator[bytes]:
+    if source.startswith(("http://", "https://",)):
+        try:
+            with open_url(source, timeout=timeout) as response:
+                yield from iter(lambda: response.read(READ_SIZE), b"")
+        except (OSError, urllib.error.URLError) as e:
+            raise DownloadError(f"Cannot fetch {source}: {e}")
+        return
+    with open(source, "rb") as f:
+        yield from iter(lambda: f.read(READ_SIZE), b"")
+
+
+def _read_listing(
+    stream: typing.BinaryIO,
+    paths: typing.List[str],
+    output_lines: typing.Deque[str]
+) -> None:
+    for raw_line in stream:
+        line = raw_line.decode("UTF-8", errors="replace")
+        output_lines.append(line)
+        # bsdtar lists extracted entries as `x path`
+        path = line.rstrip("\n")
+        if path.startswith("x "):
+            path = path[2:]
+        paths.append(path)
+
+
+def _remove_copy(asset: Asset) -> None:
+    if asset.copy_to is None:
+        return
+    try:
+        os.remove(asset.copy_to + PART_SUFFIX)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,484 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+A fake libioc that serves jails from a plain directory.
+
+It implements the small part of the libioc API that the read-only
+commands served by iocd use, so that the daemon and the real command code
+can be exercised on hosts without ZFS or jails. install() registers the
+fake modules, which must happen before any ioc_cli module imports libioc.
+"""
+import fnmatch
+import json
+import os
+import sys
+import types
+import typing
+
+SOURCE_NAME = "fake"
+CONFIG_FILENAME = "config.json"
+
+# properties of jails that do not set them
+DEFAULTS = dict(
+    boot="no",
+    template="no",
+    priority="0",
+    release="-",
+    tags="",
+    ip4_addr="-",
+    ip6_addr="-",
+)
+
+_root_directory: typing.Optional[str] = None
+
+
+class IocException(Exception):
+    """Base of the fake libioc errors, logged when they are raised."""
+
+    def __init__(
+        self,
+        message: str="",
+        logger: typing.Optional['Logger']=None,
+        **kwargs: typing.Any
+    ) -> None:
+        super().__init__(message)
+        if (logger is not None) and (message != ""):
+            logger.error(message)
+
+
+class InvalidLogLevel(IocException):
+    """Raised for unknown log levels."""
+
+
+class IocageNotActivated(IocException):
+    """Raised when no root dataset is activated."""
+
+
+class ZFSSourceMountpoint(IocException):
+    """Raised when a root dataset is not mounted."""
+
+
+class JailNotFound(IocException):
+    """Raised when a jail does not exist."""
+
+    def __init__(
+        self,
+        text: str="",
+        logger: typing.Optional['Logger']=None,
+        **kwargs: typing.Any
+    ) -> None:
+        super().__init__(f"Jail '{text}' not found", logger=logger)
+
+
+class UnknownConfigProperty(IocException):
+    """Raised when a property is not known."""
+
+    def __init__(
+        self,
+        key: str="",
+        logger: typing.Optional['Logger']=None,
+        **kwargs: typing.Any
+    ) -> None:
+        super().__init__(f"The config property '{key}' is unknown", logger)
+
+
+class Logger:
+    """Write log messages to the current stdout and stderr."""
+
+    LOG_LEVELS = ("critical", "error", "warn", "info", "verbose", "debug",)
+
+    def __init__(self) -> None:
+        self._print_level = "info"
+
+    @property
+    def print_level(self) -> str:
+        """Return the level up to which messages are printed."""
+        return self._print_level
+
+    @print_level.setter
+    def print_level(self, value: str) -> None:
+        """Set the level up to which messages are printed."""
+        if value not in self.LOG_LEVELS:
+            raise InvalidLogLevel(f"Invalid log level {value}", logger=self)
+        self._print_level = value
+
+    def _print(self, level: str, message: str) -> None:
+        print_index = self.LOG_LEVELS.index(self._print_level)
+        if self.LOG_LEVELS.index(level) > print_index:
+            return
+        # the streams are looked up when printing, so that they follow
+        # the redirection of each daemon request
+        if level in ("critical", "error",):
+            print(message, file=sys.stderr)
+        else:
+            print(message, file=sys.stdout)
+
+    def error(self, message: str) -> None:
+        """Print an error."""
+        self._print("error", message)
+
+    def warn(self, message: str) -> None:
+        """Print a warning."""
+        self._print("warn", message)
+
+    def log(self, message: str) -> None:
+        """Print an information."""
+        self._print("info", message)
+
+    def verbose(self, message: str) -> None:
+        """Print a verbose message."""
+        self._print("verbose", message)
+
+    def debug(self, message: str) -> None:
+        """Print a debug message."""
+        self._print("debug", message)
+
+    def screen(self, message: str, indent: int=0) -> None:
+        """Print a message regardless of the log level."""
+        print("  " * indent + message)
+
+
+class IocEvent:
+    """Event type referenced by the CLI type annotations."""
+
+
+class ZFS:
+    """Handle that is passed around, but never used by the fake."""
+
+
+def get_zfs(logger: typing.Optional[Logger]=None) -> ZFS:
+    """Return a new fake ZFS handle."""
+    return ZFS()
+
+
+class Dataset:
+    """A dataset of a root dataset, backed by a directory."""
+
+    def __init__(self, name: str, mountpoint: str) -> None:
+        self.name = name
+        self.mountpoint = mountpoint
+
+
+class RootDatasets:
+    """The root and jails dataset of a fake source."""
+
+    def __init__(self, directory: str) -> None:
+        self.root = Dataset(f"{SOURCE_NAME}/ioc", directory)
+        self.jails = Dataset(
+            f"{SOURCE_NAME}/ioc/jails",
+            os.path.join(directory, "jails")
+        )
+
+
+class Datasets(dict):
+    """The single fake source in the directory given to install()."""
+
+    def __init__(self, **kwargs: typing.Any) -> None:
+        super().__init__()
+        if _root_directory is None:
+            raise IocageNotActivated("The fake libioc is not installed")
+        self[SOURCE_NAME] = RootDatasets(_root_directory)
+
+
+def to_string(value: typing.Any) -> str:
+    """Format a property value like libioc."""
+    if isinstance(value, bool):
+        return "yes" if (value is True) else "no"
+    elif value is None:
+        return "-"
+    elif isinstance(value, (list, tuple,)):
+        return ",".join(str(x) for x in value)
+    return str(value)
+
+
+class Config(dict):
+    """Jail properties with the defaults applied."""
+
+    @property
+    def all_properties(self) -> typing.List[str]:
+        """Return the names of all properties."""
+        return sorted(self.keys())
+
+    def get_string(self, key: str) -> str:
+        """Return a property formatted as string."""
+        return to_string(self[key])
+
+
+class Defaults:
+    """The defaults resource of the fake host."""
+
+    def __init__(self) -> None:
+        self.config = Config(DEFAULTS)
+
+    def read_config(self) -> None:
+        """Read nothing, because the defaults are fixed."""
+
+
+class Resource:
+    """Base class of fake resources."""
+
+
+class ListableResource(Resource):
+    """Base class of fake resources that are listed."""
+
+
+class HostGenerator:
+    """A host with the fake source."""
+
+    def __init__(
+        self,
+        datasets: typing.Optional[Datasets]=None,
+        logger: typing.Optional[Logger]=None,
+        zfs: typing.Optional[ZFS]=None
+    ) -> None:
+        self.datasets = datasets if (datasets is not None) else Datasets()
+        self.logger = logger
+        self.zfs = zfs
+        self.defaults = Defaults()
+
+
+class JailGenerator(ListableResource):
+    """A jail whose configuration is read from its directory."""
+
+    def __init__(
+        self,
+        data: typing.Union[str, typing.Dict[str, typing.Any]],
+        root_datasets_name: typing.Optional[str]=None,
+        logger: typing.Optional[Logger]=None,
+        host: typing.Optional[HostGenerator]=None,
+        zfs: typing.Optional[ZFS]=None,
+        new: bool=False,
+        skip_invalid_config: bool=False,
+        **kwargs: typing.Any
+    ) -> None:
+        if isinstance(data, str):
+            data = dict(id=data)
+        name = str(data.get("id", data.get("name")))
+        if "/" in name:
+            root_datasets_name, name = name.split("/", maxsplit=1)
+        self.name = name
+        self.source = root_datasets_name or SOURCE_NAME
+        self.logger = logger
+        self.host = host if (host is not None) else HostGenerator()
+        self.zfs = zfs
+        root_datasets = self.host.datasets[self.source]
+        self.dataset = Dataset(
+            f"{root_datasets.jails.name}/{name}",
+            os.path.join(root_datasets.jails.mountpoint, name)
+        )
+        config_file = os.path.join(self.dataset.mountpoint, CONFIG_FILENAME)
+        try:
+            with open(config_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            raise JailNotFound(name, logger=logger)
+        self.config = Config(self.host.defaults.config)
+        self.config.update((str(x), y) for x, y in data.items())
+
+    @property
+    def full_name(self) -> str:
+        """Return the name with the source."""
+        return f"{self.source}/{self.name}"
+
+    @property
+    def identifier(self) -> str:
+        """Return the name of the jail in jls."""
+        return f"ioc-{self.name}"
+
+    @property
+    def humanreadable_name(self) -> str:
+        """Return the jail name."""
+        return self.name
+
+    @property
+    def dataset_name(self) -> str:
+        """Return the name of the jail dataset."""
+        return self.dataset.name
+
+    @property
+    def root_path(self) -> str:
+        """Return the path of the jail root."""
+        return os.path.join(self.dataset.mountpoint, "root")
+
+    @property
+    def running(self) -> bool:
+        """Return False, fake jails never run."""
+        return False
+
+    @property
+    def jid(self) -> None:
+        """Return None, fake jails never run."""
+        return None
+
+    def get(self, key: str) -> typing.Any:
+        """Return a property value."""
+        if key in ("name", "full_name", "running", "jid",):
+            return getattr(self, key)
+        if key not in self.config:
+            raise UnknownConfigProperty(key, logger=self.logger)
+        return self.config[key]
+
+    def getstring(self, key: str) -> str:
+        """Return a property value formatted as string."""
+        return to_string(self.get(key))
+
+
+class Jail(JailGenerator):
+    """Synchronous variant of the fake jail."""
+
+
+class JailsGenerator:
+    """Iterate the jails of all sources that match the filters."""
+
+    jail_class: typing.Type[JailGenerator] = JailGenerator
+
+    def __init__(
+        self,
+        filters: typing.Iterable[str]=(),
+        host: typing.Optional[HostGenerator]=None,
+        logger: typing.Optional[Logger]=None,
+        zfs: typing.Optional[ZFS]=None,
+        skip_invalid_config: bool=False,
+        **kwargs: typing.Any
+    ) -> None:
+        self.filters = list(filters)
+        self.host = host if (host is not None) else HostGenerator()
+        self.logger = logger
+        self.zfs = zfs
+
+    def __iter__(self) -> typing.Iterator[JailGenerator]:
+        """Yield the matching jails."""
+        for source, root_datasets in self.host.datasets.items():
+            try:
+                names = sorted(os.listdir(root_datasets.jails.mountpoint))
+            except OSError:
+                continue
+            for name in names:
+                jail = self.jail_class(
+                    name,
+                    root_datasets_name=source,
+                    logger=self.logger,
+                    host=self.host,
+                    zfs=self.zfs
+                )
+                if all(_matches(jail, x) for x in self.filters):
+                    yield jail
+
+
+class Jails(JailsGenerator):
+    """Synchronous variant of the fake jails."""
+
+    jail_class = Jail
+
+
+class ReleasesGenerator:
+    """The fake host has no releases."""
+
+    def __init__(self, **kwargs: typing.Any) -> None:
+        pass
+
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        """Yield nothing."""
+        return iter([])
+
+
+def _matches(jail: JailGenerator, _filter: str) -> bool:
+    if "=" in _filter:
+        key, patterns = _filter.split("=", maxsplit=1)
+        values = [jail.getstring(key)]
+    else:
+        patterns = _filter
+        values = [jail.name, jail.full_name]
+    return any(
+        fnmatch.fnmatchcase(value, pattern)
+        for value in values
+        for pattern in patterns.split(",")
+    )
+
+
+def _get_version() -> str:
+    return "fake"
+
+
+# members of the fake modules, by module name below libioc
+MODULES: typing.Dict[str, typing.Dict[str, typing.Any]] = {
+    "errors": dict(
+        IocException=IocException,
+        InvalidLogLevel=InvalidLogLevel,
+        IocageNotActivated=IocageNotActivated,
+        ZFSSourceMountpoint=ZFSSourceMountpoint,
+        JailNotFound=JailNotFound,
+        UnknownConfigProperty=UnknownConfigProperty
+    ),
+    "events": dict(IocEvent=IocEvent),
+    "Logger": dict(Logger=Logger),
+    "ZFS": dict(ZFS=ZFS, get_zfs=get_zfs),
+    "Datasets": dict(Datasets=Datasets),
+    "Host": dict(Host=HostGenerator, HostGenerator=HostGenerator),
+    "helpers": dict(to_string=to_string),
+    "Resource": dict(Resource=Resource),
+    "ListableResource": dict(ListableResource=ListableResource),
+    "Jail": dict(Jail=Jail, JailGenerator=JailGenerator),
+    "Jails": dict(Jails=Jails, JailsGenerator=JailsGenerator),
+    "Releases": dict(ReleasesGenerator=ReleasesGenerator),
+}
+
+
+def install(root_directory: str) -> None:
+    """
+    Register the fake libioc modules with jails in a directory.
+
+    Every jail is a directory below <root_directory>/jails that contains
+    a config.json with its properties. The real libioc must not have been
+    imported before.
+    """
+    global _root_directory
+    current = sys.modules.get("libioc", None)
+    if (current is not None) and (getattr(current, "FAKE", False) is False):
+        raise RuntimeError("libioc was imported before the fake")
+    _root_directory = root_directory
+
+    package = types.ModuleType("libioc")
+    setattr(package, "FAKE", True)
+    setattr(package, "_get_version", _get_version)
+    sys.modules["libioc"] = package
+    for name, members in MODULES.items():
+        module = types.ModuleType(f"libioc.{name}")
+        for member_name, member in members.items():
+            setattr(module, member_name, member)
+        sys.modules[module.__name__] = module
+        setattr(package, name, module)
+
+
+def create_jails(
+    root_directory: str,
+    jails: typing.Dict[str, typing.Dict[str, typing.Any]]
+) -> None:
+    """Write the configuration of fake jails to a directory."""
+    for name, config in jails.items():
+        jail_directory = os.path.join(root_directory, "jails", name)
+        os.makedirs(os.path.join(jail_directory, "root"), exist_ok=True)
+        with open(os.path.join(jail_directory, CONFIG_FILENAME), "w") as f:
+            json.dump(config, f)
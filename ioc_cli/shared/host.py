@@ -0,0 +1,194 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Cache host capabilities that do not change until the next boot.
+
+The ZFS kernel module presence, the host release version and the hostid
+are probed once per boot and stored under /var/run, so that ioc commands
+do not need to fork sysctl or freebsd-version on every invocation. The
+cache is keyed on the kernel boot time and the modification time of
+freebsd-version, which freebsd-update replaces when it installs a new
+userland. It is transparently probed again when it is missing, unreadable,
+outdated or lacks ZFS, because the module can be loaded without a reboot.
+"""
+import ctypes
+import ctypes.util
+import json
+import os
+import re
+import subprocess  # nosec: B404
+import typing
+
+CACHE_FILE = "/var/run/ioc-host.json"
+HOSTID_FILE = "/etc/hostid"
+FREEBSD_VERSION_FILE = "/bin/freebsd-version"
+
+
+class HostCapabilities(typing.NamedTuple):
+    """Capabilities of the jail host at the time of the probe."""
+
+    boot_time: typing.Optional[int]
+    zfs: bool
+    userland_version: str
+    hostid: typing.Optional[str]
+    userland_mtime: typing.Optional[float] = None
+
+    @property
+    def release_version(self) -> str:
+        """Return the host release without its patch level."""
+        return re.sub(r"-p\d+$", "", self.userland_version)
+
+
+def get_host_capabilities(
+    refresh: bool=False,
+    cache_file: str=CACHE_FILE
+) -> HostCapabilities:
+    """Return the cached host capabilities or probe them."""
+    boot_time = _get_boot_time()
+    userland_mtime = _get_userland_mtime()
+
+    if (refresh is False) and (boot_time is not None):
+        cached = _read_cache(cache_file)
+        if (cached is not None) and (cached.boot_time == boot_time) \
+                and (cached.userland_mtime == userland_mtime) \
+                and (cached.zfs is True):
+            return cached
+
+    capabilities = HostCapabilities(
+        boot_time=boot_time,
+        zfs=_has_zfs(),
+        userland_version=_get_userland_version(),
+        hostid=_get_hostid(),
+        userland_mtime=userland_mtime
+    )
+    if boot_time is not None:
+        _write_cache(cache_file, capabilities)
+    return capabilities
+
+
+def _read_cache(cache_file: str) -> typing.Optional[HostCapabilities]:
+    try:
+        with open(cache_file, "r", encoding="UTF-8") as f:
+            data = json.load(f)
+        return HostCapabilities(
+            boot_time=int(data["boot_time"]),
+            zfs=(data["zfs"] is True),
+            userland_version=str(data["userland_version"]),
+            hostid=data["hostid"],
+            userland_mtime=data.get("userland_mtime", None)
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_cache(cache_file: str, capabilities: HostCapabilities) -> None:
+    temporary_file = f"{cache_file}.{os.getpid()}"
+    try:
+        with open(temporary_file, "w", encoding="UTF-8") as f:
+            json.dump(capabilities._asdict(), f)
+        os.replace(temporary_file, cache_file)
+    except OSError:
+        # unprivileged users cannot write the cache
+        try:
+            os.unlink(temporary_file)
+        except OSError:
+            pass
+
+
+def _get_libc() -> typing.Optional[ctypes.CDLL]:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+    if hasattr(libc, "sysctlbyname") is False:
+        return None
+    return libc
+
+
+def _get_boot_time() -> typing.Optional[int]:
+    libc = _get_libc()
+    if libc is None:
+        return None
+    # struct timeval
+    boot_time = (ctypes.c_long * 2)()
+    size = ctypes.c_size_t(ctypes.sizeof(boot_time))
+    result = libc.sysctlbyname(
+        b"kern.boottime",
+        ctypes.byref(boot_time),
+        ctypes.byref(size),
+        None,
+        ctypes.c_size_t(0)
+    )
+    if result != 0:
+        return None
+    return int(boot_time[0])
+
+
+def _has_zfs() -> bool:
+    libc = _get_libc()
+    if libc is not None:
+        size = ctypes.c_size_t(0)
+        result = libc.sysctlbyname(
+            b"vfs.zfs.version.spa",
+            None,
+            ctypes.byref(size),
+            None,
+            ctypes.c_size_t(0)
+        )
+        return (result == 0)
+    try:
+        subprocess.check_call(  # nosec
+            ["/sbin/sysctl", "vfs.zfs.version.spa"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        return True
+    except (subprocess.CalledProcessError, OSError):
+        return False
+
+
+def _get_userland_mtime() -> typing.Optional[float]:
+    try:
+        return os.stat(FREEBSD_VERSION_FILE).st_mtime
+    except OSError:
+        return None
+
+
+def _get_userland_version() -> str:
+    try:
+        return subprocess.check_output(  # nosec
+            [FREEBSD_VERSION_FILE, "-u"],
+            stderr=subprocess.PIPE
+        ).decode("UTF-8").strip()
+    except (subprocess.CalledProcessError, OSError):
+        return str(os.uname().release)
+
+
+def _get_hostid() -> typing.Optional[str]:
+    try:
+        with open(HOSTID_FILE, "r", encoding="UTF-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
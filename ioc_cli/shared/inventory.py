@@ -0,0 +1,617 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Evaluate jail filters against a persistent inventory index."""
+import contextlib
+import fcntl
+import fnmatch
+import json
+import os
+import sys
+import typing
+
+import libioc.errors
+import libioc.Host
+import libioc.Jail
+import libioc.Jails
+import libioc.Logger
+import libioc.ZFS
+
+# the index of each root dataset is stored in its mountpoint
+INVENTORY_FILENAME = ".ioc-inventory.json"
+INVENTORY_VERSION = 1
+
+# names of jails that are being created, stored next to the index
+RESERVATIONS_FILENAME = ".ioc-reservations.json"
+RESERVATIONS_LOCK_FILENAME = ".ioc-reservations.lock"
+
+# jail configuration files that invalidate an index entry when modified
+CONFIG_FILENAMES = ("config.json", "config",)
+
+# defaults of root datasets, whose changes invalidate all index entries
+DEFAULTS_FILENAMES = ("defaults.json", "defaults",)
+
+# jail properties that are stored in the index
+INDEXED_PROPERTIES = ("template", "boot", "priority", "release", "tags",)
+
+# filters on other properties require all jails to be loaded
+INDEXED_FILTER_KEYS = ("name",) + INDEXED_PROPERTIES
+
+Entry = typing.Dict[str, typing.Any]
+FilterTerm = typing.Tuple[str, typing.List[str]]
+FileState = typing.Tuple[int, int]
+
+# index files kept in memory by long-lived processes, see keep_warm()
+_warm_entries: typing.Optional[
+    typing.Dict[str, typing.Tuple[FileState, typing.Dict[str, Entry]]]
+] = None
+
+
+class NameReservationError(Exception):
+    """Raised when jail names are already in use or reserved."""
+
+    def __init__(self, names: typing.List[str]) -> None:
+        self.names = names
+        super().__init__("Jail names are not available: " + ", ".join(names))
+
+
+class Inventory:
+    """
+    Index of the jails of one root dataset.
+
+    Each entry stores the effective values of the indexed properties, the
+    modification time of the jail configuration and the latest modification
+    time of the defaults they were read from. Entries are validated with a
+    stat of the configuration file before they are used, so that jails are
+    only loaded again when they or the defaults were changed by other means
+    than this CLI.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        root_mountpoint: str,
+        jails_mountpoint: str,
+        defaults_mtime: typing.Optional[float]=None
+    ) -> None:
+        self.source = source
+        self.file = os.path.join(root_mountpoint, INVENTORY_FILENAME)
+        self.jails_mountpoint = jails_mountpoint
+        self.defaults_mtime = defaults_mtime
+        self._entries: typing.Optional[typing.Dict[str, Entry]] = None
+        self._changed = False
+
+    @property
+    def entries(self) -> typing.Dict[str, Entry]:
+        """Return the stored entries indexed by jail name."""
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    def list_names(self) -> typing.List[str]:
+        """Return the names of all jails in this root dataset."""
+        try:
+            return sorted(
+                x for x in os.listdir(self.jails_mountpoint)
+                if not x.startswith(".")
+            )
+        except OSError:
+            return []
+
+    def get(self, name: str) -> typing.Optional[Entry]:
+        """Return the entry of a jail or None when it must be loaded."""
+        config_mtime = get_config_mtime(
+            os.path.join(self.jails_mountpoint, name)
+        )
+        entry = self.entries.get(name, None)
+        if (entry is None) or (config_mtime is None):
+            return None
+        if entry["mtime"] != config_mtime:
+            return None
+        if entry.get("defaults_mtime", None) != self.defaults_mtime:
+            return None
+        return entry
+
+    def update(
+        self,
+        jail: 'libioc.Jail.JailGenerator',
+        config_mtime: typing.Optional[float]=None
+    ) -> Entry:
+        """Store the indexed properties of a jail."""
+        if config_mtime is None:
+            config_mtime = get_config_mtime(jail.dataset.mountpoint)
+        entry: Entry = dict(
+            (key, jail.getstring(key)) for key in INDEXED_PROPERTIES
+        )
+        entry["mtime"] = config_mtime
+        entry["defaults_mtime"] = self.defaults_mtime
+        self.entries[jail.name] = entry
+        self._changed = True
+        return entry
+
+    def remove(self, name: str) -> None:
+        """Drop the entry of a jail that no longer exists."""
+        if name in self.entries:
+            del self.entries[name]
+            self._changed = True
+
+    def save(self) -> None:
+        """Write changed entries to the index file."""
+        if self._changed is False:
+            return
+        data = dict(version=INVENTORY_VERSION, jails=self.entries)
+        temporary_file = f"{self.file}.{os.getpid()}"
+        try:
+            with open(temporary_file, "w") as f:
+                json.dump(data, f, sort_keys=True)
+            os.rename(temporary_file, self.file)
+        except OSError:
+            # the index is an optimization and may be read-only
+            return
+        self._changed = False
+        _store_warm_entries(self.file, self.entries)
+
+    @contextlib.contextmanager
+    def reserve(self, names: typing.List[str]) -> typing.Iterator[None]:
+        """
+        Reserve jail names while the jails are being created.
+
+        Names are checked and reserved while holding an exclusive lock, so
+        that concurrent invocations cannot allocate the same name. Stale
+        reservations of processes that no longer run are ignored.
+        """
+        directory = os.path.dirname(self.file)
+        reservations_file = os.path.join(directory, RESERVATIONS_FILENAME)
+        lock_file = os.path.join(directory, RESERVATIONS_LOCK_FILENAME)
+
+        with file_lock(lock_file):
+            reservations = _read_reservations(reservations_file)
+            unavailable = [
+                x for x in names
+                if (x in reservations) or (x in self.list_names())
+            ]
+            if len(unavailable) > 0:
+                raise NameReservationError(unavailable)
+            pid = os.getpid()
+            reservations.update((x, pid,) for x in names)
+            _write_reservations(reservations_file, reservations)
+
+        try:
+            yield
+        finally:
+            with file_lock(lock_file):
+                reservations = _read_reservations(reservations_file)
+                for name in names:
+                    reservations.pop(name, None)
+                _write_reservations(reservations_file, reservations)
+
+    def _read(self) -> typing.Dict[str, Entry]:
+        entries = _get_warm_entries(self.file)
+        if entries is not None:
+            return entries
+        try:
+            with open(self.file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) \
+                or (data.get("version") != INVENTORY_VERSION):
+            return {}
+        entries = dict(data.get("jails", {}))
+        _store_warm_entries(self.file, entries)
+        return entries
+
+
+def keep_warm() -> None:
+    """
+    Keep index files in memory for the lifetime of the process.
+
+    Cached entries are used while the size and modification time of their
+    index file are unchanged, so that a daemon does not parse the index on
+    every request.
+    """
+    global _warm_entries
+    if _warm_entries is None:
+        _warm_entries = {}
+
+
+def _get_file_state(filename: str) -> typing.Optional[FileState]:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size,)
+
+
+def _get_warm_entries(
+    filename: str
+) -> typing.Optional[typing.Dict[str, Entry]]:
+    if _warm_entries is None or (filename not in _warm_entries):
+        return None
+    state, entries = _warm_entries[filename]
+    if state != _get_file_state(filename):
+        return None
+    return dict(entries)
+
+
+def _store_warm_entries(
+    filename: str,
+    entries: typing.Dict[str, Entry]
+) -> None:
+    if _warm_entries is None:
+        return
+    state = _get_file_state(filename)
+    if state is not None:
+        _warm_entries[filename] = (state, dict(entries),)
+
+
+@contextlib.contextmanager
+def file_lock(
+    lock_file: str,
+    blocking: bool=True
+) -> typing.Iterator[None]:
+    """
+    Hold an exclusive lock on a file.
+
+    Raises BlockingIOError when the lock is held by another process and
+    blocking is disabled.
+    """
+    with open(lock_file, "a") as f:
+        flags = fcntl.LOCK_EX if blocking else (fcntl.LOCK_EX | fcntl.LOCK_NB)
+        fcntl.flock(f.fileno(), flags)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _read_reservations(reservations_file: str) -> typing.Dict[str, int]:
+    try:
+        with open(reservations_file, "r") as f:
+            reservations = dict(json.load(f))
+    except (OSError, ValueError, TypeError):
+        return {}
+    return dict(
+        (name, pid,) for name, pid in reservations.items()
+        if _is_running(pid)
+    )
+
+
+def _write_reservations(
+    reservations_file: str,
+    reservations: typing.Dict[str, int]
+) -> None:
+    temporary_file = f"{reservations_file}.{os.getpid()}"
+    with open(temporary_file, "w") as f:
+        json.dump(reservations, f, sort_keys=True)
+    os.rename(temporary_file, reservations_file)
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def get_config_mtime(jail_mountpoint: str) -> typing.Optional[float]:
+    """Return the modification time of a jail configuration file."""
+    for filename in CONFIG_FILENAMES:
+        try:
+            return os.stat(os.path.join(jail_mountpoint, filename)).st_mtime
+        except OSError:
+            continue
+    return None
+
+
+def parse_filters(
+    filters: typing.Iterable[str]
+) -> typing.Optional[typing.List[FilterTerm]]:
+    """
+    Parse jail filters that can be answered by the inventory.
+
+    Returns None when a filter refers to a property that is not indexed.
+    Terms without a key match the jail name, or like in libioc the full
+    name of the jail with its root dataset (<source>/<name>).
+    """
+    terms: typing.List[FilterTerm] = []
+    for _filter in filters:
+        if "=" in _filter:
+            key, value = _filter.split("=", maxsplit=1)
+        else:
+            key, value = "name", _filter
+        if key not in INDEXED_FILTER_KEYS:
+            return None
+        terms.append((key, value.split(","),))
+    return terms
+
+
+def match_filters(
+    name: str,
+    entry: Entry,
+    terms: typing.List[FilterTerm],
+    source: typing.Optional[str]=None
+) -> bool:
+    """Return True when an entry matches all filter terms."""
+    for key, patterns in terms:
+        if key == "name":
+            values = _get_names(name, source)
+        elif key == "tags":
+            values = entry[key].split(",")
+        else:
+            values = [entry[key]]
+        if not _match_any(values, patterns):
+            return False
+    return True
+
+
+def _match_any(values: typing.List[str], patterns: typing.List[str]) -> bool:
+    return any(
+        fnmatch.fnmatchcase(str(value), pattern)
+        for value in values
+        for pattern in patterns
+    )
+
+
+def _get_names(name: str, source: typing.Optional[str]) -> typing.List[str]:
+    return [name] if (source is None) else [name, f"{source}/{name}"]
+
+
+def _match_names(
+    names: typing.List[str],
+    terms: typing.List[FilterTerm],
+    source: typing.Optional[str]=None
+) -> typing.List[str]:
+    for key, patterns in terms:
+        if key == "name":
+            names = [
+                x for x in names
+                if _match_any(_get_names(x, source), patterns)
+            ]
+    return names
+
+
+def get_defaults_mtime(
+    root_mountpoints: typing.Iterable[str]
+) -> typing.Optional[float]:
+    """Return the latest modification time of root dataset defaults."""
+    mtimes = []
+    for root_mountpoint in root_mountpoints:
+        for filename in DEFAULTS_FILENAMES:
+            try:
+                mtimes.append(
+                    os.stat(os.path.join(root_mountpoint, filename)).st_mtime
+                )
+            except OSError:
+                continue
+    return max(mtimes) if (len(mtimes) > 0) else None
+
+
+def get_inventories(
+    host: 'libioc.Host.HostGenerator'
+) -> typing.List[Inventory]:
+    """Return the inventories of all root datasets of the host."""
+    root_datasets_items = list(host.datasets.items())
+    defaults_mtime = get_defaults_mtime(
+        root_datasets.root.mountpoint
+        for _, root_datasets in root_datasets_items
+    )
+    return [
+        Inventory(
+            source=source,
+            root_mountpoint=root_datasets.root.mountpoint,
+            jails_mountpoint=root_datasets.jails.mountpoint,
+            defaults_mtime=defaults_mtime
+        )
+        for source, root_datasets in root_datasets_items
+    ]
+
+
+def list_jails(
+    filters: typing.Tuple[str, ...],
+    host: 'libioc.Host.HostGenerator',
+    logger: 'libioc.Logger.Logger',
+    zfs: typing.Optional['libioc.ZFS.ZFS']=None,
+    jail_class: typing.Type[
+        'libioc.Jail.JailGenerator'
+    ]=libioc.Jail.JailGenerator,
+    skip_invalid_config: bool=True
+) -> typing.Iterator['libioc.Jail.JailGenerator']:
+    """
+    Yield the jails matching the filters.
+
+    Filters on indexed properties are evaluated against the inventory, so
+    that only matching jails are loaded. Other filters fall back to the
+    JailsGenerator, which loads every jail.
+    """
+    terms = parse_filters(filters)
+    if terms is None:
+        jails_class = libioc.Jails.JailsGenerator
+        if jail_class is not libioc.Jail.JailGenerator:
+            jails_class = libioc.Jails.Jails
+        yield from jails_class(
+            filters=filters,
+            host=host,
+            logger=logger,
+            zfs=zfs,
+            skip_invalid_config=skip_invalid_config
+        )
+        return
+
+    # jails loaded to refresh their entry are not loaded again
+    loaded_jails: typing.Dict[
+        typing.Tuple[str, str],
+        'libioc.Jail.JailGenerator'
+    ] = {}
+
+    def load_jail(source: str, name: str) -> 'libioc.Jail.JailGenerator':
+        if (source, name,) not in loaded_jails:
+            loaded_jails[(source, name,)] = jail_class(
+                dict(id=name),
+                root_datasets_name=source,
+                logger=logger,
+                host=host,
+                zfs=zfs
+            )
+        return loaded_jails[(source, name,)]
+
+    for inventory in get_inventories(host):
+        matches = []
+        names = _match_names(inventory.list_names(), terms, inventory.source)
+        for name in names:
+            entry = inventory.get(name)
+            if entry is None:
+                try:
+                    entry = inventory.update(load_jail(inventory.source, name))
+                except libioc.errors.IocException:
+                    inventory.remove(name)
+                    if skip_invalid_config is False:
+                        inventory.save()
+                        raise
+                    continue
+            if match_filters(name, entry, terms, inventory.source):
+                matches.append(name)
+        inventory.save()
+
+        for name in matches:
+            try:
+                yield load_jail(inventory.source, name)
+            except libioc.errors.IocException:
+                if skip_invalid_config is False:
+                    raise
+
+
+def get_inventory(
+    host: 'libioc.Host.HostGenerator',
+    source: typing.Optional[str]=None
+) -> Inventory:
+    """Return the inventory of a root dataset, by default the first one."""
+    inventories = get_inventories(host)
+    for inventory in inventories:
+        if (source is None) or (inventory.source == source):
+            return inventory
+    raise KeyError(source)
+
+
+def update_jail(
+    jail: 'libioc.Jail.JailGenerator',
+    host: 'libioc.Host.HostGenerator'
+) -> None:
+    """Refresh the inventory entry of a created or modified jail."""
+    for inventory in get_inventories(host):
+        if inventory.source == jail.source:
+            inventory.update(jail)
+            inventory.save()
+
+
+def remove_jail(
+    name: str,
+    source: str,
+    host: 'libioc.Host.HostGenerator'
+) -> None:
+    """Drop the inventory entry of a renamed or destroyed jail."""
+    for inventory in get_inventories(host):
+        if inventory.source == source:
+            inventory.remove(name)
+            inventory.save()
+
+
+def check(
+    host: 'libioc.Host.HostGenerator',
+    logger: 'libioc.Logger.Logger',
+    zfs: typing.Optional['libioc.ZFS.ZFS']=None,
+    filters: typing.Optional[typing.List[typing.Tuple[str, ...]]]=None
+) -> typing.List[str]:
+    """
+    Compare the jails selected by the inventory and by libioc.
+
+    Without filters, a set of filters on all indexed properties, bare and
+    full jail names is checked. Returns a description of every filter for
+    which the selected jails differ.
+    """
+    if filters is None:
+        filters = [
+            ("*",),
+            ("boot=yes",),
+            ("template=no,-",),
+            ("boot=yes", "template=no,-",),
+            ("tags=*",),
+        ]
+        for inventory in get_inventories(host):
+            filters.append((f"{inventory.source}/*",))
+            for name in inventory.list_names()[:1]:
+                filters.append((name,))
+                filters.append((f"{inventory.source}/{name}",))
+
+    differences = []
+    for _filters in filters:
+        selected = set(
+            (x.source, x.name,)
+            for x in list_jails(_filters, host=host, logger=logger, zfs=zfs)
+        )
+        expected = set(
+            (x.source, x.name,)
+            for x in libioc.Jails.JailsGenerator(
+                filters=_filters,
+                host=host,
+                logger=logger,
+                zfs=zfs,
+                skip_invalid_config=True
+            )
+        )
+        if selected != expected:
+            only_inventory = sorted(f"{x}/{y}" for x, y in selected - expected)
+            only_libioc = sorted(f"{x}/{y}" for x, y in expected - selected)
+            differences.append(
+                f"{' '.join(_filters)}: inventory only {only_inventory}, "
+                f"libioc only {only_libioc}"
+            )
+    return differences
+
+
+def main() -> int:
+    """Check the inventory against libioc on this host with --check."""
+    if "--check" not in sys.argv[1:]:
+        print(f"usage: {sys.argv[0]} --check [FILTER ...]")
+        return 2
+    args = [x for x in sys.argv[1:] if x != "--check"]
+    logger = libioc.Logger.Logger()
+    zfs = libioc.ZFS.get_zfs(logger=logger)
+    host = libioc.Host.HostGenerator(logger=logger, zfs=zfs)
+    differences = check(
+        host,
+        logger,
+        zfs=zfs,
+        filters=([tuple(args)] if (len(args) > 0) else None)
+    )
+    for difference in differences:
+        print(difference)
+    return 1 if (len(differences) > 0) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
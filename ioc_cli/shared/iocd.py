@@ -0,0 +1,465 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Serve ioc commands from a long-lived process over a Unix socket.
+
+The client side of this module only depends on the standard library, so
+that delegating a command to a running daemon does not need to import
+libioc. Each request is a single line of JSON holding the command line
+arguments. The daemon answers with one line of JSON per chunk of output,
+sent while the command is running, followed by a line with the exit code.
+"""
+import io
+import json
+import os
+import shutil
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import typing
+
+import click
+
+PROTOCOL_VERSION = 2
+DEFAULT_SOCKET_PATH = "/var/run/iocd.sock"
+SOCKET_PATH = os.environ.get("IOCD_SOCKET", DEFAULT_SOCKET_PATH)
+
+# read-only commands that benefit from warm host and dataset state
+DELEGATED_COMMANDS = ("get", "list",)
+
+# global options of the ioc command that consume a value
+_GLOBAL_VALUE_OPTIONS = ("--log-level", "-d", "--source",)
+
+# options of ioc list that consume a value
+_LIST_VALUE_OPTIONS = (
+    "--sort", "-s",
+    "--limit", "-n",
+    "--offset",
+    "--output", "-o",
+    "--output-format", "-f",
+    "--max-column-width",
+    "--interval",
+)
+
+_CONNECT_TIMEOUT = 1.0
+
+Handler = typing.Callable[
+    [typing.List[str], typing.TextIO, typing.TextIO],
+    int
+]
+
+
+def get_subcommand(argv: typing.Sequence[str]) -> typing.Optional[str]:
+    """Return the name of the ioc subcommand in the arguments."""
+    index = _get_subcommand_index(argv)
+    return None if (index is None) else argv[index]
+
+
+def is_allowed(argv: typing.Sequence[str]) -> bool:
+    """Return True when the daemon may execute the command."""
+    if ("--help" in argv) or ("--version" in argv):
+        return False
+    index = _get_subcommand_index(argv)
+    if (index is None) or (argv[index] not in DELEGATED_COMMANDS):
+        return False
+    if argv[index] == "list":
+        # endless or line by line output is not relayed through the daemon
+        return _is_continuous_list(argv[index + 1:]) is False
+    return True
+
+
+def _get_subcommand_index(argv: typing.Sequence[str]) -> typing.Optional[int]:
+    skip_next = False
+    for index, arg in enumerate(argv):
+        if skip_next is True:
+            skip_next = False
+            continue
+        if arg in _GLOBAL_VALUE_OPTIONS:
+            skip_next = True
+            continue
+        if arg.startswith("-"):
+            continue
+        return index
+    return None
+
+
+def _is_continuous_list(args: typing.Sequence[str]) -> bool:
+    """Return True when ioc list arguments enable --watch or ndjson."""
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        index += 1
+        if arg == "--":
+            break
+        if arg.startswith("--"):
+            name, has_value, value = arg.partition("=")
+            if name == "--watch":
+                return True
+            if (name in _LIST_VALUE_OPTIONS) and (has_value == ""):
+                value = args[index] if (index < len(args)) else ""
+                index += 1
+            if (name == "--output-format") and (value == "ndjson"):
+                return True
+            continue
+        if (arg == "-") or (arg.startswith("-") is False) or (arg == "-NH"):
+            continue
+        # clustered short options like -Hw or -fndjson
+        for position, letter in enumerate(arg[1:], start=2):
+            if letter == "w":
+                return True
+            if f"-{letter}" in _LIST_VALUE_OPTIONS:
+                value = arg[position:]
+                if value == "":
+                    value = args[index] if (index < len(args)) else ""
+                    index += 1
+                if (letter == "f") and (value == "ndjson"):
+                    return True
+                break
+    return False
+
+
+def is_delegable(argv: typing.Sequence[str]) -> bool:
+    """Return True when the command can be served by the daemon."""
+    if SOCKET_PATH == "":
+        return False
+    if is_allowed(argv) is False:
+        return False
+    try:
+        return stat.S_ISSOCK(os.stat(SOCKET_PATH).st_mode)
+    except OSError:
+        return False
+
+
+def request(
+    argv: typing.Sequence[str],
+    socket_path: typing.Optional[str]=None,
+    stdout: typing.Optional[typing.TextIO]=None,
+    stderr: typing.Optional[typing.TextIO]=None
+) -> typing.Optional[int]:
+    """
+    Execute a command on the daemon and return its exit code.
+
+    Output is written to stdout and stderr as it arrives. None is returned
+    when no daemon could be reached before any output was received, in
+    which case the caller runs the command in-process.
+    """
+    streams = dict(
+        stdout=stdout or sys.stdout,
+        stderr=stderr or sys.stderr
+    )
+    payload = json.dumps(dict(version=PROTOCOL_VERSION, argv=list(argv)))
+    received = False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(_CONNECT_TIMEOUT)
+            sock.connect(socket_path or SOCKET_PATH)
+            sock.settimeout(None)
+            sock.sendall(payload.encode("UTF-8") + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            with sock.makefile("rb") as f:
+                for line in f:
+                    message = json.loads(line.decode("UTF-8"))
+                    if "version" in message:
+                        if message["version"] != PROTOCOL_VERSION:
+                            raise ValueError("iocd protocol version mismatch")
+                        return int(message["exit"])
+                    for name, stream in streams.items():
+                        if name in message:
+                            received = True
+                            stream.write(str(message[name]))
+                            stream.flush()
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    if received is False:
+        return None
+    # the output was partially written and cannot be repeated
+    streams["stderr"].write("iocd: connection to the daemon was lost\n")
+    return 1
+
+
+class OutputStream(io.TextIOBase):
+    """Text stream that forwards every write to the client."""
+
+    def __init__(self, wfile: typing.BinaryIO, name: str) -> None:
+        self.wfile = wfile
+        self.name = name
+        self.disconnected = False
+
+    def writable(self) -> bool:
+        """Return True because output is always accepted."""
+        return True
+
+    def write(self, text: str) -> int:
+        """Send a chunk of output to the client."""
+        if isinstance(text, bytes):
+            # click writes usage errors as bytes to streams it does not know
+            text = text.decode("UTF-8", errors="replace")
+        if (len(text) > 0) and (self.disconnected is False):
+            try:
+                _send(self.wfile, {self.name: text})
+            except OSError:
+                # keep the command running but discard its output
+                self.disconnected = True
+        return len(text)
+
+
+def _send(
+    wfile: typing.BinaryIO,
+    message: typing.Dict[str, typing.Any]
+) -> None:
+    wfile.write(json.dumps(message).encode("UTF-8") + b"\n")
+    wfile.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    server: 'Server'
+
+    def handle(self) -> None:
+        stdout = OutputStream(self.wfile, "stdout")
+        stderr = OutputStream(self.wfile, "stderr")
+        try:
+            data = json.loads(self.rfile.readline().decode("UTF-8"))
+            if data.get("version") != PROTOCOL_VERSION:
+                raise ValueError("protocol version mismatch")
+            argv = [str(x) for x in data["argv"]]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            stderr.write(f"iocd: {e}\n")
+            exit_code = 2
+        else:
+            if is_allowed(argv) is False:
+                # the daemon runs as root and must not execute other commands
+                stderr.write("iocd: command is not served by the daemon\n")
+                exit_code = 2
+            else:
+                exit_code = self.server.handler(argv, stdout, stderr)
+        try:
+            _send(self.wfile, dict(version=PROTOCOL_VERSION, exit=exit_code))
+        except OSError:
+            pass
+
+
+class Server(socketserver.UnixStreamServer):
+    """Unix socket server that answers requests one after another."""
+
+    def __init__(
+        self,
+        socket_path: str,
+        handler: Handler
+    ) -> None:
+        self.handler = handler
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # only the owner (root) may talk to the daemon
+        previous_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(previous_umask)
+
+    def server_close(self) -> None:
+        """Close the server and remove its socket."""
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def serve(socket_path: str, handler: Handler) -> None:
+    """Serve requests until the process is interrupted or terminated."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with Server(socket_path, handler) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+# jails of the fake libioc that the test mode serves
+TEST_JAILS = dict(
+    web1=dict(release="13.0-RELEASE", boot="yes", ip4_addr="lo1|10.0.0.2"),
+    db1=dict(release="13.0-RELEASE", boot="no", tags="db"),
+)
+
+
+def serve_fake(
+    root_directory: str,
+    jails: typing.Dict[str, typing.Dict[str, typing.Any]]
+) -> Handler:
+    """
+    Prepare the daemon command handler with a fake libioc backend.
+
+    The fake libioc serves the given jails from a directory, while the
+    commands run through the same dispatch as in the daemon. It must be
+    called before anything imports libioc.
+    """
+    from . import fakeioc
+    fakeioc.install(root_directory)
+    fakeioc.create_jails(root_directory, jails)
+
+    from . import inventory
+    from . import main
+    from .host import HostCapabilities
+    from .runtime import JailRuntime
+    from .. import daemon
+
+    logger = main.logger
+    zfs = fakeioc.get_zfs(logger=logger)
+    capabilities = HostCapabilities(
+        boot_time=None,
+        zfs=True,
+        userland_version="13.0-RELEASE",
+        hostid=None
+    )
+    host = fakeioc.HostGenerator(logger=logger, zfs=zfs)
+    host.runtime = JailRuntime(capabilities)  # type: ignore
+    main.warm_state.update(capabilities=capabilities, zfs=zfs, host=host)
+    inventory.keep_warm()
+    return typing.cast(Handler, daemon.run_command)
+
+
+def check() -> typing.List[str]:
+    """
+    Run get and list commands through a daemon with a fake libioc.
+
+    Return a list of failures, which is empty when the client and the
+    daemon agree on delegation, output capture, exit codes, argument
+    parsing, rejection and fallback.
+    """
+    failures = []
+    directory = tempfile.mkdtemp()
+    socket_path = os.path.join(directory, "iocd.sock")
+
+    def expect(
+        argv: typing.List[str],
+        exit_code: typing.Optional[int],
+        stdout: str="",
+        stderr: str=""
+    ) -> None:
+        """Compare the output, or only its start with a trailing ..."""
+        stdout_stream = io.StringIO()
+        stderr_stream = io.StringIO()
+        result = (
+            request(argv, socket_path, stdout_stream, stderr_stream),
+            stdout_stream.getvalue(),
+            stderr_stream.getvalue(),
+        )
+        expected = (exit_code, stdout, stderr,)
+        matches = (result[0] == exit_code) and all(
+            actual.startswith(value[:-3]) if value.endswith("...") else (
+                actual == value
+            )
+            for actual, value in zip(result[1:], expected[1:])
+        )
+        if matches is False:
+            failures.append(f"{' '.join(argv)}: {result} != {expected}")
+
+    try:
+        expect(["list"], None)
+        server = Server(
+            socket_path,
+            serve_fake(os.path.join(directory, "root"), TEST_JAILS)
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            expect(["get", "release", "web1"], 0, "13.0-RELEASE\n")
+            expect(["get", "boot", "missing"], 1, "", "Jail 'missing'...")
+            expect(["get", "unknown", "db1"], 1, "", "The config property...")
+            expect(["get"], 2, "", "Usage: ioc get...")
+            list_argv = ["list", "-o", "name,boot", "-f", "list", "-NH"]
+            if os.geteuid() == 0:
+                expect(list_argv, 0, "db1\tno\nweb1\tyes\n")
+                expect(list_argv + ["boot=yes"], 0, "web1\tyes\n")
+                expect(list_argv + ["fake/d*"], 0, "db1\tno\n")
+            else:
+                expect(list_argv, 1, "", "You need to have root...")
+            expect(["destroy", "-f", "web1"], 2, "", (
+                "iocd: command is not served by the daemon\n"
+            ))
+            for argv in (
+                ["list", "--help"],
+                ["list", "--watch"],
+                ["list", "-Hw"],
+                ["list", "-f", "ndjson"],
+                ["list", "-fndjson"],
+                ["list", "--output-format=ndjson"],
+            ):
+                expect(argv, 2, "", (
+                    "iocd: command is not served by the daemon\n"
+                ))
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        shutil.rmtree(directory)
+    return failures
+
+
+@click.command(name="iocd")
+@click.option("--socket", "socket_path", default=SOCKET_PATH,
+              help="Path of the Unix socket to listen on.")
+@click.option("--jails", type=click.File("r"), default=None,
+              help="JSON file mapping jail names to their properties.")
+@click.option("--check", "run_check", is_flag=True, default=False,
+              help="Test the daemon with a fake libioc and exit.")
+def _test_server(
+    socket_path: str,
+    jails: typing.Optional[typing.TextIO],
+    run_check: bool
+) -> None:
+    """
+    Serve ioc commands from a fake libioc.
+
+    This test mode allows to exercise the daemon and the client fallback
+    on hosts without ZFS or jails. The get and list commands run like in
+    the daemon, but read jails from a temporary directory, by default the
+    jails in TEST_JAILS.
+    """
+    if run_check is True:
+        failures = check()
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        sys.exit(1 if (len(failures) > 0) else 0)
+    directory = tempfile.mkdtemp()
+    try:
+        handler = serve_fake(
+            directory,
+            TEST_JAILS if (jails is None) else json.load(jails)
+        )
+        serve(socket_path, handler)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    sys.exit(_test_server())
@@ -25,11 +25,16 @@
 """Get a specific jails with this CLI helper function."""
 import typing
 
+import libioc.Datasets
 import libioc.errors
+import libioc.Host
 import libioc.Jail
 import libioc.Logger
+import libioc.Release
+import libioc.ZFS
 
 from .click import IocClickContext
+from .runtime import JailRuntime
 
 
 def get_jail(
@@ -49,6 +54,86 @@ def get_jail(
         exit(1)
 
 
+def get_isolated_host(
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger,
+    zfs: typing.Optional[libioc.ZFS.ZFS]=None
+) -> libioc.Host.HostGenerator:
+    """
+    Return a new host with the root datasets of an existing one.
+
+    libioc and py-libzfs handles are not thread-safe, so jobs that run
+    concurrently must each use their own ZFS handle and host.
+    """
+    if zfs is None:
+        zfs = libioc.ZFS.get_zfs(logger=logger)
+    sources = dict(
+        (name, root_datasets.root.name,)
+        for name, root_datasets in host.datasets.items()
+    )
+    isolated_host = libioc.Host.HostGenerator(
+        datasets=libioc.Datasets.Datasets(
+            sources=sources,
+            zfs=zfs,
+            logger=logger
+        ),
+        logger=logger,
+        zfs=zfs
+    )
+    isolated_host.runtime = JailRuntime(host.runtime.capabilities)
+    return isolated_host
+
+
+def get_isolated_jail(
+    jail: libioc.Jail.JailGenerator,
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger,
+    jail_class: typing.Type[
+        libioc.Jail.JailGenerator
+    ]=libioc.Jail.JailGenerator
+) -> libioc.Jail.JailGenerator:
+    """Load a jail again with its own ZFS handle and host for a thread."""
+    zfs = libioc.ZFS.get_zfs(logger=logger)
+    return jail_class(
+        dict(id=jail.name),
+        root_datasets_name=jail.source,
+        host=get_isolated_host(host, logger, zfs=zfs),
+        zfs=zfs,
+        logger=logger
+    )
+
+
+def get_isolated_resource(
+    resource: typing.Union[
+        libioc.Jail.JailGenerator,
+        libioc.Release.ReleaseGenerator
+    ],
+    root_datasets_name: typing.Optional[str],
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger,
+    zfs: libioc.ZFS.ZFS
+) -> typing.Union[
+    libioc.Jail.JailGenerator,
+    libioc.Release.ReleaseGenerator
+]:
+    """Load the release or template jails are cloned from for a thread."""
+    if isinstance(resource, libioc.Release.ReleaseGenerator):
+        return libioc.Release.ReleaseGenerator(
+            name=resource.name,
+            root_datasets_name=root_datasets_name,
+            logger=logger,
+            host=host,
+            zfs=zfs
+        )
+    return libioc.Jail.JailGenerator(
+        resource.name,
+        root_datasets_name=root_datasets_name,
+        logger=logger,
+        host=host,
+        zfs=zfs
+    )
+
+
 def set_properties(
     properties: typing.Iterable[str],
     target: 'libioc.LaunchableResource.LaunchableResource',
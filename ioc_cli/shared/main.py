@@ -0,0 +1,298 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""The ioc command group that dispatches to the subcommand modules."""
+import typing
+import locale
+import os
+import signal
+import sys
+
+import click
+
+import libioc.Logger
+import libioc.events
+from libioc.errors import (
+    InvalidLogLevel,
+    IocageNotActivated,
+    ZFSSourceMountpoint
+)
+from libioc.ZFS import get_zfs
+from libioc.Datasets import Datasets
+from libioc.Host import HostGenerator
+
+from .command_manifest import COMMANDS
+from .host import get_host_capabilities
+from .runtime import JailRuntime
+
+logger = libioc.Logger.Logger()
+
+click.core._verify_python3_env = lambda: None  # type: ignore
+user_locale = os.environ.get("LANG", "en_US.UTF-8")
+locale.setlocale(locale.LC_ALL, user_locale)
+
+IOCAGE_CMD_FOLDER = os.path.abspath(os.path.join(
+    os.path.dirname(__file__),
+    ".."
+))
+
+# ZFS handle and host state that a long-lived process (iocd) keeps warm
+warm_state: typing.Dict[str, typing.Any] = {}
+
+# @formatter:off
+# Sometimes SIGINT won't be installed.
+# http://stackoverflow.com/questions/40775054/capturing-sigint-using-keyboardinterrupt-exception-works-in-terminal-not-in-scr/40785230#40785230
+signal.signal(signal.SIGINT, signal.default_int_handler)
+# If a utility decides to cut off the pipe, we don't care (IE: head)
+signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+# @formatter:on
+
+
+def set_to_dict(data: typing.Set[str]) -> typing.Dict[str, str]:
+    """Convert a set of values to a dictionary."""
+    keys, values = zip(*[x.split("=", maxsplit=1) for x in data])
+    return dict(zip(keys, values))
+
+
+def print_events(
+    generator: typing.Generator[
+        typing.Union[libioc.events.IocEvent, bool],
+        None,
+        None
+    ]
+) -> typing.Optional[bool]:
+    """Print the events of a generator and return its final result."""
+    lines: typing.Dict[str, str] = {}
+    for event in generator:
+
+        if isinstance(event, bool):
+            # a boolean terminates the event stream
+            return event
+
+        if event.identifier is None:
+            identifier = "generic"
+        else:
+            identifier = event.identifier
+
+        if event.type not in lines:
+            lines[event.type] = {}
+
+        # output fragments
+        running_indicator = "+" if (event.done or event.skipped) else "-"
+        name = event.type
+        if event.identifier is not None:
+            name += f"@{event.identifier}"
+
+        output = f"[{running_indicator}] {name}: "
+
+        if event.message is not None:
+            output += event.message
+        else:
+            output += event.get_state_string(
+                done="OK",
+                error="FAILED",
+                skipped="SKIPPED",
+                pending="..."
+            )
+
+        if event.duration is not None:
+            output += " [" + str(round(event.duration, 3)) + "s]"
+
+        # new line or update of previous
+        if identifier not in lines[event.type]:
+            # Indent if previous task is not finished
+            lines[event.type][identifier] = logger.screen(
+                output,
+                indent=event.parent_count
+            )
+        else:
+            lines[event.type][identifier].edit(
+                output,
+                indent=event.parent_count
+            )
+
+
+class LazyCommand:
+    """
+    Stand-in for a subcommand that imports its module on first use.
+
+    Name, help and visibility are answered from the command manifest, so that
+    listing commands in the help text or shell completion does not import
+    the command modules. Any other attribute is looked up on the imported
+    click command.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        short_help: typing.Optional[str]=None,
+        hidden: bool=False,
+        rootcmd: bool=False
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.short_help = short_help
+        self.hidden = hidden
+        self.rootcmd = rootcmd
+        self._command: typing.Optional[click.core.Command] = None
+
+    def get_short_help_str(self, limit: int=45) -> str:
+        """Return the short help without importing the command."""
+        if self.short_help is not None:
+            return self.short_help
+        return str(click.utils.make_default_short_help(self.help, limit))
+
+    def load(self) -> click.core.Command:
+        """Import the command module and return its click command."""
+        if self._command is None:
+            self._command = _import_command(self.name)
+        return self._command
+
+    def __getattr__(self, attr: str) -> typing.Any:
+        """Look up attributes missing in the manifest on the command."""
+        return getattr(self.load(), attr)
+
+
+class IOCageCLI(click.MultiCommand):
+    """Dispatch to the command modules listed in the command manifest."""
+
+    def list_commands(self, ctx: click.core.Context):
+        """Return the names of all commands in the manifest."""
+        return sorted(COMMANDS.keys())
+
+    def get_command(self, ctx, name):
+        """Return a command that is imported when it is used."""
+        ctx.print_events = print_events
+
+        if name in COMMANDS:
+            command = LazyCommand(name, **COMMANDS[name])
+        elif os.path.isfile(os.path.join(IOCAGE_CMD_FOLDER, f"{name}.py")):
+            # command modules missing in an outdated manifest
+            mod = __import__(f"ioc_cli.{name}", None, None, ["ioc"])
+            command = LazyCommand(
+                name,
+                help=(mod.cli.help or ""),
+                rootcmd=(getattr(mod, "__rootcmd__", False) is True)
+            )
+        else:
+            return None
+
+        if command.rootcmd and "--help" not in sys.argv[1:]:
+            if len(sys.argv) != 1:
+                if os.geteuid() != 0:
+                    logger.error(
+                        "You need to have root privileges"
+                        f" to run {name}"
+                    )
+                    exit(1)
+        return command
+
+
+def _import_command(name: str) -> click.core.Command:
+    mod = __import__(f"ioc_cli.{name}", None, None, ["ioc"])
+    return mod.cli
+
+
+@click.option(
+    "--log-level",
+    "-d",
+    default=None,
+    help=(
+        f"Set the CLI log level {libioc.Logger.Logger.LOG_LEVELS}"
+    )
+)
+@click.option(
+    "--source",
+    multiple=True,
+    type=str,
+    help="Globally override the activated iocage dataset(s)"
+)
+@click.option(
+    "--refresh-host-cache",
+    is_flag=True,
+    default=False,
+    help="Probe the host capabilities again instead of using the cache"
+)
+@click.command(cls=IOCageCLI)
+@click.version_option(
+    version="0.8.2 2019/08/10",
+    prog_name="ioc",
+    message="\n".join((
+        "%(prog)s, version %(version)s",
+        f"libioc, version {libioc._get_version()}"
+    ))
+)
+@click.pass_context
+def cli(
+    ctx,
+    log_level: str,
+    source: set,
+    refresh_host_cache: bool
+) -> None:
+    """A jail manager."""  # noqa: D401
+    if log_level is not None:
+        try:
+            logger.print_level = log_level
+        except InvalidLogLevel:
+            exit(1)
+    ctx.logger = logger
+
+    ctx.user_sources = None if (len(source) == 0) else set_to_dict(source)
+
+    if ("host" in warm_state) and (ctx.user_sources is None):
+        ctx.capabilities = warm_state["capabilities"]
+        ctx.zfs = warm_state["zfs"]
+        ctx.host = warm_state["host"]
+        ctx.host.runtime.invalidate()
+        return
+
+    ctx.capabilities = get_host_capabilities(refresh=refresh_host_cache)
+    if ctx.capabilities.zfs is False:
+        logger.error(
+            "ZFS is required to use libioc.\n"
+            "Try calling 'kldload zfs' as root."
+        )
+        exit(1)
+
+    ctx.zfs = get_zfs(logger=ctx.logger)
+
+    if ctx.invoked_subcommand in ["activate", "deactivate"]:
+        return
+
+    try:
+        datasets = Datasets(
+            sources=ctx.user_sources,
+            zfs=ctx.zfs,
+            logger=ctx.logger
+        )
+        ctx.host = HostGenerator(
+            datasets=datasets,
+            logger=ctx.logger,
+            zfs=ctx.zfs
+        )
+        ctx.host.runtime = JailRuntime(ctx.capabilities)
+    except (IocageNotActivated, ZFSSourceMountpoint):
+        exit(1)
+
@@ -0,0 +1,180 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Generate the static manifest of the ioc subcommands.
+
+The manifest holds the name, help text and root privilege requirement of
+every command module, so that the command group can render its help,
+complete command names and check privileges without importing the
+command modules and their libioc dependencies. The command modules are
+parsed, not imported, so that the manifest can be generated on any host:
+
+    python3 -m ioc_cli.shared.manifest
+"""
+import ast
+import os
+import re
+import sys
+import typing
+
+COMMAND_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MANIFEST_FILE = os.path.join(os.path.dirname(__file__), "command_manifest.py")
+
+_HEADER = '''\
+# This file is generated by `make manifest` - do not edit.
+"""Static manifest of the ioc subcommands."""
+import typing
+
+COMMANDS: typing.Dict[str, typing.Dict[str, typing.Any]] = {
+'''
+_CHUNK_LENGTH = 56
+
+
+def read_command(
+    filename: str
+) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    """Return the manifest entry of a command module."""
+    with open(filename, "r", encoding="UTF-8") as f:
+        tree = ast.parse(f.read(), filename=filename)
+
+    rootcmd = False
+    command: typing.Optional[typing.Dict[str, typing.Any]] = None
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets = [x.id for x in node.targets if isinstance(x, ast.Name)]
+            if "__rootcmd__" in targets:
+                rootcmd = (ast.literal_eval(node.value) is True)
+        elif isinstance(node, ast.FunctionDef) and (node.name == "cli"):
+            command = _read_command_decorator(node)
+
+    if command is None:
+        return None
+
+    command["rootcmd"] = rootcmd
+    return command
+
+
+def _read_command_decorator(
+    node: ast.FunctionDef
+) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    for decorator in node.decorator_list:
+        if not isinstance(decorator, ast.Call):
+            continue
+        func = decorator.func
+        if not isinstance(func, ast.Attribute):
+            continue
+        if func.attr not in ("command", "group"):
+            continue
+
+        keywords = {
+            x.arg: ast.literal_eval(x.value)
+            for x in decorator.keywords
+            if x.arg in ("help", "short_help", "hidden")
+        }
+        # Click falls back to the docstring of the callback
+        help_text = keywords.get("help", None)
+        if help_text is None:
+            help_text = ast.get_docstring(node, clean=True) or ""
+
+        return dict(
+            help=help_text,
+            short_help=keywords.get("short_help", None),
+            hidden=(keywords.get("hidden", False) is True)
+        )
+    return None
+
+
+def generate(
+    folder: str=COMMAND_FOLDER
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """Read all command modules in the folder."""
+    commands = {}
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith(".py") or filename.startswith("__init__"):
+            continue
+        command = read_command(os.path.join(folder, filename))
+        if command is not None:
+            commands[re.sub(r"\.py$", "", filename)] = command
+    return commands
+
+
+def render(commands: typing.Dict[str, typing.Dict[str, typing.Any]]) -> str:
+    """Render the manifest as Python source."""
+    lines = [_HEADER.rstrip("\n")]
+    for name, command in commands.items():
+        lines.append(f"    \"{name}\": {{")
+        lines.append("        \"help\": " + _render_string(command["help"]))
+        lines.append(
+            "        \"short_help\": " + _render_string(command["short_help"])
+        )
+        lines.append(f"        \"hidden\": {command['hidden']},")
+        lines.append(f"        \"rootcmd\": {command['rootcmd']}")
+        lines.append("    },")
+    lines[-1] = "    }"
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def _render_string(value: typing.Optional[str]) -> str:
+    if value is None:
+        return "None,"
+    chunks = [""]
+    for token in re.findall(r"\S+\s*|\s+", value):
+        if len(chunks[-1]) + len(token) > _CHUNK_LENGTH:
+            chunks.append("")
+        chunks[-1] += token
+    rendered = [
+        _quote(chunk) for chunk in chunks
+    ]
+    if len(rendered) == 1:
+        return rendered[0] + ","
+    indent = "            "
+    return "(\n" + "\n".join(indent + x for x in rendered) + "\n        ),"
+
+
+def _quote(value: str) -> str:
+    """Return a double quoted Python string literal."""
+    return "\"" + value.encode("unicode_escape").decode("ASCII").replace(
+        "\"", "\\\""
+    ) + "\""
+
+
+def main() -> int:
+    """Write the manifest or check that it is up to date with --check."""
+    source = render(generate())
+    if "--check" in sys.argv[1:]:
+        with open(MANIFEST_FILE, "r", encoding="UTF-8") as f:
+            if f.read() == source:
+                return 0
+        print(f"{MANIFEST_FILE} is outdated - run `make manifest`")
+        return 1
+
+    with open(MANIFEST_FILE, "w", encoding="UTF-8") as f:
+        f.write(source)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,9 +23,25 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """Use CLI helper functions for console output."""
+import itertools
+import sys
 import typing
 import texttable
 
+# rows read ahead to determine the column widths of streamed tables
+TABLE_SAMPLE_SIZE = 100
+
+
+def format_size(size: int) -> str:
+    """Format a size in bytes with a binary unit suffix."""
+    value = float(size)
+    for unit in ("", "K", "M", "G"):
+        if value < 1024:
+            return f"{value:.0f}{unit}" if (unit == "") \
+                else f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}T"
+
 
 def print_table(
     data: typing.List[typing.List[str]],
@@ -57,3 +73,184 @@ def print_table(
         table.add_rows(table_data, header=False)
 
     print(table.draw())
+
+
+def print_table_stream(
+    data: typing.Iterable[typing.List[str]],
+    columns: typing.List[str],
+    show_header: bool=True,
+    max_widths: typing.Optional[typing.Dict[str, int]]=None,
+    sample_size: int=TABLE_SAMPLE_SIZE
+) -> None:
+    """
+    Print a table to stdout while its rows are produced.
+
+    The column widths are determined from the first rows (sample) and are
+    capped by the optional maximum widths per column. Later values that do
+    not fit into their column are truncated. The table looks like the one
+    drawn by print_table, which needs all rows before it can print.
+    """
+    rows = iter(data)
+    sample = [
+        [_single_line(value) for value in row]
+        for row in itertools.islice(rows, sample_size)
+    ]
+
+    widths = _column_widths(sample, columns, show_header, max_widths)
+    border = _border(widths)
+    print(border)
+    if show_header is True:
+        print(_format_row([x.upper() for x in columns], widths, center=True))
+        if len(sample) == 0:
+            print(border.replace("-", "=") + "\n" + border)
+            return
+        print(border.replace("-", "="))
+
+    for row in itertools.chain(sample, rows):
+        print(_format_row([_single_line(x) for x in row], widths))
+        print(border)
+        sys.stdout.flush()
+
+
+class TableScreen:
+    """
+    Keep a table on a terminal up to date.
+
+    The first update draws the whole table. Later updates rewrite only the
+    lines of rows whose values changed, using ANSI cursor movements. When
+    the number of rows or the column widths change, or when the output is
+    not a terminal, the whole table is drawn again.
+    """
+
+    def __init__(
+        self,
+        columns: typing.List[str],
+        show_header: bool=True,
+        max_widths: typing.Optional[typing.Dict[str, int]]=None,
+        stream: typing.Optional[typing.TextIO]=None
+    ) -> None:
+        self.columns = columns
+        self.show_header = show_header
+        self.max_widths = max_widths
+        self.stream = sys.stdout if (stream is None) else stream
+        self.interactive = self.stream.isatty()
+        self._rows: typing.Optional[typing.List[typing.List[str]]] = None
+        self._widths: typing.List[int] = []
+        self._line_count = 0
+
+    def update(self, data: typing.Iterable[typing.List[str]]) -> int:
+        """Show the rows and return the number of lines that were drawn."""
+        rows = [[_single_line(value) for value in row] for row in data]
+        widths = _column_widths(
+            rows,
+            self.columns,
+            self.show_header,
+            self.max_widths
+        )
+
+        previous_rows = self._rows
+        if (previous_rows is None) or (self.interactive is False) \
+                or (len(previous_rows) != len(rows)) \
+                or (widths != self._widths):
+            if rows == previous_rows:
+                return 0
+            return self._redraw(rows, widths)
+
+        header_lines = 3 if (self.show_header is True) else 1
+        drawn = 0
+        for index, row in enumerate(rows):
+            if row == previous_rows[index]:
+                continue
+            # lines between the cursor below the table and the row
+            distance = self._line_count - (header_lines + 2 * index)
+            move_down = f"\033[{distance}B" if (distance > 0) else ""
+            self.stream.write("".join([
+                f"\033[{distance}A\r\033[2K",
+                _format_row(row, widths),
+                "\r",
+                move_down
+            ]))
+            drawn += 1
+        self.stream.flush()
+        self._rows = rows
+        return drawn
+
+    def _redraw(
+        self,
+        rows: typing.List[typing.List[str]],
+        widths: typing.List[int]
+    ) -> int:
+        lines: typing.List[str] = []
+        border = _border(widths)
+        lines.append(border)
+        if self.show_header is True:
+            lines.append(_format_row(
+                [x.upper() for x in self.columns],
+                widths,
+                center=True
+            ))
+            lines.append(border.replace("-", "="))
+            if len(rows) == 0:
+                lines.append(border)
+        for row in rows:
+            lines.append(_format_row(row, widths))
+            lines.append(border)
+
+        if (self.interactive is True) and (self._line_count > 0):
+            # move to the first line of the previous table and clear below
+            self.stream.write(f"\033[{self._line_count}A\r\033[J")
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+
+        self._rows = rows
+        self._widths = widths
+        self._line_count = len(lines)
+        return len(lines)
+
+
+def _column_widths(
+    rows: typing.List[typing.List[str]],
+    columns: typing.List[str],
+    show_header: bool=True,
+    max_widths: typing.Optional[typing.Dict[str, int]]=None
+) -> typing.List[int]:
+    widths = [len(column) if show_header else 1 for column in columns]
+    for row in rows:
+        widths = [max(width, len(value)) for width, value in zip(widths, row)]
+    if max_widths is not None:
+        widths = [
+            min(width, max(max_widths.get(column, width), len(column)))
+            for width, column in zip(widths, columns)
+        ]
+    return widths
+
+
+def _border(widths: typing.List[int]) -> str:
+    return "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+
+
+def _format_row(
+    values: typing.List[str],
+    widths: typing.List[int],
+    center: bool=False
+) -> str:
+    cells = []
+    for value, width in zip(values, widths):
+        value = _truncate(value, width)
+        if center is True:
+            # like texttable, odd padding goes to the right
+            value = " " * ((width - len(value)) // 2) + value
+        cells.append(value.ljust(width))
+    return "| " + " | ".join(cells) + " |"
+
+
+def _truncate(value: str, width: int) -> str:
+    if len(value) <= width:
+        return value
+    if width <= 3:
+        return value[:width]
+    return value[:width - 3] + "..."
+
+
+def _single_line(value: str) -> str:
+    return " ".join(str(value).splitlines())
@@ -0,0 +1,167 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Run jail operations concurrently on a bounded worker pool."""
+import itertools
+import queue
+import threading
+import time
+import typing
+
+T = typing.TypeVar("T")
+
+# seconds between deadline checks while tasks are pending
+_POLL_INTERVAL = 0.5
+
+
+class TaskResult(typing.Generic[T]):
+    """Outcome of a single task that ran on the worker pool."""
+
+    def __init__(
+        self,
+        item: T,
+        error: typing.Optional[BaseException],
+        duration: float,
+        escalated: bool=False
+    ) -> None:
+        self.item = item
+        self.error = error
+        self.duration = duration
+        self.escalated = escalated
+
+    @property
+    def failed(self) -> bool:
+        """Return True when the task raised an exception."""
+        return self.error is not None
+
+
+def group_tiers(
+    items: typing.Iterable[T],
+    key: typing.Callable[[T], typing.Any],
+    reverse: bool=False
+) -> typing.List[typing.Tuple[typing.Any, typing.List[T]]]:
+    """Group items into tiers of equal key, ordered by that key."""
+    ordered = sorted(items, key=key, reverse=reverse)
+    return [
+        (tier_key, list(tier_items))
+        for tier_key, tier_items
+        in itertools.groupby(ordered, key=key)
+    ]
+
+
+def run_parallel(
+    items: typing.Iterable[T],
+    worker: typing.Callable[[T], typing.Any],
+    jobs: int=1,
+    timeout: typing.Optional[float]=None,
+    escalate: typing.Optional[typing.Callable[[T], typing.Any]]=None
+) -> typing.Generator[TaskResult[T], None, None]:
+    """
+    Run worker for each item with at most `jobs` tasks at a time.
+
+    Results are yielded in the order the tasks finish, so that the caller
+    can report progress from a single thread. When a timeout is given, the
+    escalate function is called once for every task that is still running
+    after this many seconds. From then on the task is abandoned: its
+    result is the outcome of the escalation, which fails when it does not
+    finish within another timeout. Tasks and escalations run on daemon
+    threads, so that hanging tasks neither block the caller nor the exit
+    of the process.
+
+    The escalation runs while the abandoned task may still be running, so
+    that both must be safe to run concurrently for the same item.
+    """
+    _items = list(items)
+    events: queue.Queue = queue.Queue()
+    started_at: typing.Dict[int, float] = {}
+    escalated_at: typing.Dict[int, float] = {}
+    running: typing.Set[int] = set()
+    next_index = 0
+
+    watch_deadlines = (timeout is not None) and (escalate is not None)
+    poll_interval = _POLL_INTERVAL if watch_deadlines else None
+
+    while (next_index < len(_items)) or (len(running) > 0):
+        while (len(running) < max(1, jobs)) and (next_index < len(_items)):
+            started_at[next_index] = time.monotonic()
+            running.add(next_index)
+            _start_thread(_run_task, worker, next_index, _items, events)
+            next_index += 1
+
+        try:
+            index, error, from_escalation = events.get(timeout=poll_interval)
+        except queue.Empty:
+            index = None
+
+        now = time.monotonic()
+        if (index in running) and \
+                (from_escalation is (index in escalated_at)):
+            running.remove(index)
+            yield TaskResult(
+                item=_items[index],
+                error=error,
+                duration=now - started_at[index],
+                escalated=(index in escalated_at)
+            )
+
+        if watch_deadlines is False:
+            continue
+
+        _timeout = typing.cast(float, timeout)
+        for index in list(running):
+            if index in escalated_at:
+                if (now - escalated_at[index]) < _timeout:
+                    continue
+                running.remove(index)
+                yield TaskResult(
+                    item=_items[index],
+                    error=TimeoutError("the escalation did not finish"),
+                    duration=now - started_at[index],
+                    escalated=True
+                )
+            elif (now - started_at[index]) >= _timeout:
+                escalated_at[index] = now
+                _start_thread(_run_task, escalate, index, _items, events, True)
+
+
+def _start_thread(
+    target: typing.Callable[..., None],
+    *args: typing.Any
+) -> None:
+    threading.Thread(target=target, args=args, daemon=True).start()
+
+
+def _run_task(
+    function: typing.Callable[[T], typing.Any],
+    index: int,
+    items: typing.List[T],
+    events: queue.Queue,
+    from_escalation: bool=False
+) -> None:
+    error: typing.Optional[BaseException] = None
+    try:
+        function(items[index])
+    except BaseException as e:
+        error = e
+    events.put((index, error, from_escalation,))
@@ -0,0 +1,304 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Keep pre-cloned jails ready to be claimed by ioc create."""
+import json
+import os
+import subprocess  # nosec: B404
+import sys
+import typing
+import uuid
+
+import libioc.Host
+import libioc.Jail
+
+from .inventory import file_lock
+
+# pool members are unnamed jails with this name prefix, but only the
+# members recorded in the state file are treated as such
+POOL_MEMBER_PREFIX = "warm-"
+
+# the state of all pools is stored in the root dataset mountpoint
+POOL_STATE_FILENAME = ".ioc-pool.json"
+POOL_LOCK_FILENAME = ".ioc-pool.lock"
+POOL_FILL_LOCK_FILENAME = ".ioc-pool-fill.lock"
+
+PoolState = typing.Dict[str, typing.Dict[str, typing.Any]]
+JailType = typing.TypeVar("JailType", bound='libioc.Jail.JailGenerator')
+
+
+class PoolKey(typing.NamedTuple):
+    """The release or template that the members of a pool are cloned from."""
+
+    kind: str
+    name: str
+    basejail: bool
+
+    def __str__(self) -> str:
+        """Return the key as it is stored in the state file."""
+        suffix = ":basejail" if (self.basejail is True) else ""
+        return f"{self.kind}:{self.name}{suffix}"
+
+    @classmethod
+    def parse(cls, value: str) -> 'PoolKey':
+        """Read a key from the state file."""
+        kind, name, *flags = value.split(":")
+        return cls(kind, name, ("basejail" in flags))
+
+
+class WarmPool:
+    """
+    Warm clone pools of one root dataset.
+
+    The state file lists the target size, the ready members and the
+    members being created of every pool. It is only modified while holding
+    the pool lock, so that every member is claimed by at most one ioc
+    create. Ready members whose jail no longer exists, for example because
+    it was destroyed by other means than ioc pool, are dropped whenever
+    the state is read.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        root_mountpoint: str,
+        jails_mountpoint: str
+    ) -> None:
+        self.source = source
+        self.jails_mountpoint = jails_mountpoint
+        self.file = os.path.join(root_mountpoint, POOL_STATE_FILENAME)
+        self.lock_file = os.path.join(root_mountpoint, POOL_LOCK_FILENAME)
+        self.fill_lock_file = os.path.join(
+            root_mountpoint,
+            POOL_FILL_LOCK_FILENAME
+        )
+
+    def fill_lock(self) -> typing.ContextManager[None]:
+        """Return a lock that is only held by one filling process."""
+        return file_lock(self.fill_lock_file, blocking=False)
+
+    def status(self) -> typing.List[typing.Tuple[PoolKey, int, int]]:
+        """Return the key, target size and ready members of each pool."""
+        state = self._read()
+        return [
+            (PoolKey.parse(key), pool["target"], len(pool["members"]),)
+            for key, pool in sorted(state.items())
+        ]
+
+    def configure(self, key: PoolKey, target: int) -> None:
+        """Set the number of members a pool is filled up to."""
+        with file_lock(self.lock_file):
+            state = self._read()
+            pool = state.setdefault(str(key), _new_pool_state())
+            pool["target"] = target
+            self._write(state)
+
+    def missing(self, key: PoolKey) -> int:
+        """Return the number of members that a pool lacks."""
+        pool = self._read().get(str(key), None)
+        if pool is None:
+            return 0
+        return max(0, pool["target"] - len(pool["members"]))
+
+    def members(self) -> typing.Set[str]:
+        """Return the names of the ready and the creating members."""
+        names: typing.Set[str] = set()
+        for pool in self._read().values():
+            names.update(pool["members"])
+            names.update(pool["creating"])
+        return names
+
+    def reserve(self, key: PoolKey, names: typing.Iterable[str]) -> None:
+        """Record members before they are created."""
+        with file_lock(self.lock_file):
+            state = self._read()
+            pool = state.setdefault(str(key), _new_pool_state())
+            pool["creating"] += list(names)
+            self._write(state)
+
+    def add_member(self, key: PoolKey, name: str) -> None:
+        """Add a created member to a pool."""
+        with file_lock(self.lock_file):
+            state = self._read()
+            pool = state.setdefault(str(key), _new_pool_state())
+            pool["creating"] = [x for x in pool["creating"] if x != name]
+            pool["members"].append(name)
+            self._write(state)
+
+    def discard(self, key: PoolKey, name: str) -> None:
+        """Forget a member that could not be created."""
+        with file_lock(self.lock_file):
+            state = self._read()
+            pool = state.get(str(key), None)
+            if pool is None:
+                return
+            pool["creating"] = [x for x in pool["creating"] if x != name]
+            self._write(state)
+
+    def claim(self, key: PoolKey) -> typing.Optional[str]:
+        """Take a ready member from a pool."""
+        with file_lock(self.lock_file):
+            state = self._read()
+            pool = state.get(str(key), None)
+            if (pool is None) or (len(pool["members"]) == 0):
+                return None
+            name = str(pool["members"].pop(0))
+            self._write(state)
+        return name
+
+    def remove(self, key: PoolKey) -> typing.List[str]:
+        """Remove a pool and return its members."""
+        with file_lock(self.lock_file):
+            state = self._read()
+            pool = state.pop(str(key), dict(members=[]))
+            self._write(state)
+        return list(pool["members"])
+
+    def release(self, key: PoolKey, name: str) -> None:
+        """Return a claimed member that could not be used to a pool."""
+        with file_lock(self.lock_file):
+            state = self._read()
+            pool = state.setdefault(str(key), _new_pool_state())
+            pool["members"].insert(0, name)
+            self._write(state)
+
+    def _read(self) -> PoolState:
+        try:
+            with open(self.file, "r") as f:
+                state = dict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            return {}
+        for pool in state.values():
+            pool.setdefault("creating", [])
+            pool["members"] = [
+                x for x in pool["members"]
+                if os.path.isdir(os.path.join(self.jails_mountpoint, x))
+            ]
+        return state
+
+    def _write(self, state: PoolState) -> None:
+        temporary_file = f"{self.file}.{os.getpid()}"
+        with open(temporary_file, "w") as f:
+            json.dump(state, f, sort_keys=True, indent=2)
+        os.rename(temporary_file, self.file)
+
+
+def _new_pool_state() -> typing.Dict[str, typing.Any]:
+    return dict(target=0, members=[], creating=[])
+
+
+def get_pool_members(host: 'libioc.Host.HostGenerator') -> typing.Set[str]:
+    """Return the names of the recorded members of all root datasets."""
+    names: typing.Set[str] = set()
+    for name, root_datasets in host.datasets.items():
+        names.update(WarmPool(
+            name,
+            root_datasets.root.mountpoint,
+            root_datasets.jails.mountpoint
+        ).members())
+    return names
+
+
+def selects_pool_members(filters: typing.Iterable[str]) -> bool:
+    """Return True when a name filter explicitly selects pool members."""
+    for value in filters:
+        key, separator, patterns = value.partition("=")
+        if separator == "":
+            key, patterns = "name", value
+        if key != "name":
+            continue
+        # names may be given with their root dataset (<source>/<name>)
+        names = [x.rsplit("/", maxsplit=1)[-1] for x in patterns.split(",")]
+        if any(x.startswith(POOL_MEMBER_PREFIX) for x in names):
+            return True
+    return False
+
+
+def exclude_pool_members(
+    jails: typing.Iterable[JailType],
+    filters: typing.Iterable[str]=()
+) -> typing.Iterator[JailType]:
+    """
+    Skip the members of warm pools, unless the filters name them.
+
+    Members are reserved for ioc create, so that filters such as `*` must
+    not list, start, stop, snapshot or destroy them. Membership is read
+    from the pool state files, so that other jails with the member name
+    prefix are not hidden.
+    """
+    if selects_pool_members(filters) is True:
+        yield from jails
+        return
+    members: typing.Optional[typing.Set[str]] = None
+    for jail in jails:
+        if jail.name.startswith(POOL_MEMBER_PREFIX) is False:
+            yield jail
+            continue
+        if members is None:
+            members = get_pool_members(jail.host)
+        if jail.name not in members:
+            yield jail
+
+
+def new_member_name() -> str:
+    """Return a unique name for a new pool member."""
+    return POOL_MEMBER_PREFIX + uuid.uuid4().hex[:12]
+
+
+def get_pool(
+    host: 'libioc.Host.HostGenerator',
+    source: typing.Optional[str]=None
+) -> WarmPool:
+    """Return the pools of a root dataset, by default the first one."""
+    for name, root_datasets in host.datasets.items():
+        if (source is None) or (source == name):
+            return WarmPool(
+                name,
+                root_datasets.root.mountpoint,
+                root_datasets.jails.mountpoint
+            )
+    raise KeyError(source)
+
+
+def refill_in_background(source: str, key: PoolKey) -> None:
+    """Start a detached ioc pool fill that outlives this process."""
+    command = [
+        sys.executable,
+        "-c", "import ioc_cli; ioc_cli.cli(prog_name='ioc')",
+        "pool", "fill",
+        "--source", source,
+        f"--{key.kind}", key.name,
+        "--basejail" if (key.basejail is True) else "--no-basejail"
+    ]
+    # ioc_cli is not on the default path of bin/ioc installations
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    subprocess.Popen(  # nosec: B603
+        command,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        close_fds=True
+    )
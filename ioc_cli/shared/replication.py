@@ -0,0 +1,120 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Write and apply ZFS replication streams of jail datasets."""
+import os
+import struct
+import subprocess  # nosec: B404
+import typing
+
+from .zfs import ZFS_COMMAND, ZFSCommandError
+
+# drr_magic of the DRR_BEGIN record that starts every send stream
+DMU_BACKUP_MAGIC = 0x2F5BACBAC
+
+# the magic follows the record type and payload length (two uint32)
+DMU_BACKUP_MAGIC_OFFSET = 8
+
+
+def is_zfs_stream(path: str) -> bool:
+    """Return True when a file starts with a ZFS send stream header."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(DMU_BACKUP_MAGIC_OFFSET + 8)
+    except OSError:
+        return False
+    if len(header) < (DMU_BACKUP_MAGIC_OFFSET + 8):
+        return False
+    magic = header[DMU_BACKUP_MAGIC_OFFSET:]
+    # streams are written in the byte order of the sending host
+    return DMU_BACKUP_MAGIC in (
+        struct.unpack("<Q", magic)[0],
+        struct.unpack(">Q", magic)[0]
+    )
+
+
+def send(
+    dataset: str,
+    snapshot: str,
+    destination: str,
+    since: typing.Optional[str]=None
+) -> None:
+    """
+    Write a replication stream of a dataset and its children to a file.
+
+    With a base snapshot the stream is incremental and contains all
+    snapshots from the base to the given snapshot. The destination must
+    not exist and is removed when the stream is incomplete.
+    """
+    command = [ZFS_COMMAND, "send", "-R"]
+    if since is not None:
+        command += ["-I", f"@{since}"]
+    command.append(f"{dataset}@{snapshot}")
+
+    with open(destination, "xb") as f:
+        try:
+            _run_with_file(command, stdout=f)
+        except ZFSCommandError:
+            os.remove(destination)
+            raise
+
+
+def receive(
+    sources: typing.Iterable[str],
+    dataset: str,
+    force: bool=False
+) -> None:
+    """
+    Apply a chain of send streams to a dataset, one after another.
+
+    The first stream creates the dataset unless it exists. Only when
+    forced, streams roll the dataset back to their base snapshot and
+    discard the changes and snapshots made after it.
+    """
+    command = [ZFS_COMMAND, "receive"]
+    if force is True:
+        command.append("-F")
+    command.append(dataset)
+    for source in sources:
+        with open(source, "rb") as f:
+            _run_with_file(command, stdin=f)
+
+
+def _run_with_file(
+    command: typing.List[str],
+    stdin: typing.Optional[typing.IO[bytes]]=None,
+    stdout: typing.Optional[typing.IO[bytes]]=None
+) -> None:
+    try:
+        process = subprocess.run(  # nosec: B603
+            command,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+            check=False
+        )
+    except OSError as e:
+        raise ZFSCommandError(command, str(e))
+    if process.returncode != 0:
+        raise ZFSCommandError(command, process.stderr.decode("UTF-8"))
@@ -0,0 +1,95 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Select expired jail snapshots by a retention policy."""
+import fnmatch
+import typing
+
+from .snapshots import Snapshot
+
+# jail property that holds the retention policy of the jail
+RETENTION_PROPERTY = "user.retention"
+
+
+class RetentionRule(typing.NamedTuple):
+    """Keep the newest snapshots whose name matches a pattern."""
+
+    pattern: str
+    keep: int
+
+
+def parse_policy(value: str) -> typing.List[RetentionRule]:
+    """
+    Parse a retention policy such as `hourly-*=24,daily-*=7,weekly-*=4`.
+
+    Each rule keeps the given number of the newest snapshots whose name
+    matches its pattern. Raises ValueError for invalid policies.
+    """
+    rules = []
+    for rule in value.split(","):
+        rule = rule.strip()
+        if rule == "":
+            continue
+        pattern, separator, keep = rule.rpartition("=")
+        if (separator == "") or (pattern == ""):
+            raise ValueError(f"Invalid retention rule: {rule}")
+        try:
+            rules.append(RetentionRule(pattern, int(keep)))
+        except ValueError:
+            raise ValueError(f"Invalid retention count: {rule}")
+        if rules[-1].keep < 0:
+            raise ValueError(f"Invalid retention count: {rule}")
+    if len(rules) == 0:
+        raise ValueError("Empty retention policy")
+    return rules
+
+
+def select_expired(
+    snapshots: typing.Iterable[Snapshot],
+    policy: typing.List[RetentionRule]
+) -> typing.List[Snapshot]:
+    """
+    Return the snapshots of a dataset that the policy does not keep.
+
+    Every snapshot is counted by the first rule that matches its name.
+    Snapshots that match no rule are kept. The age of snapshots is
+    compared by their transaction group, because creation times only have
+    a resolution of one second.
+    """
+    matches: typing.List[typing.List[Snapshot]] = [[] for _ in policy]
+    for snapshot in snapshots:
+        for index, rule in enumerate(policy):
+            if fnmatch.fnmatchcase(snapshot.name, rule.pattern):
+                matches[index].append(snapshot)
+                break
+
+    expired = []
+    for rule, rule_snapshots in zip(policy, matches):
+        newest_first = sorted(
+            rule_snapshots,
+            key=lambda x: x.createtxg,
+            reverse=True
+        )
+        expired += newest_first[rule.keep:]
+    return sorted(expired, key=lambda x: x.createtxg)
@@ -0,0 +1,145 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Answer jail runtime state from a single jls(8) snapshot."""
+import json
+import subprocess  # nosec: B404
+import typing
+
+import libioc.Host
+import libioc.Jail
+
+from .host import HostCapabilities
+
+JLS_COMMAND = "/usr/sbin/jls"
+
+JailInfo = typing.Dict[str, typing.Any]
+
+
+class JailRuntime:
+    """
+    Index of the running jails of the host.
+
+    All running jails are enumerated with one jls command the first time a
+    jail state is requested. Commands that change the state of jails call
+    invalidate(), so that the next lookup takes a fresh snapshot.
+    """
+
+    def __init__(
+        self,
+        capabilities: typing.Optional[HostCapabilities]=None
+    ) -> None:
+        self.capabilities = capabilities
+        self._jails: typing.Optional[typing.Dict[str, JailInfo]] = None
+
+    def invalidate(self) -> None:
+        """Drop the snapshot after jails were started or stopped."""
+        self._jails = None
+
+    @property
+    def jails(self) -> typing.Dict[str, JailInfo]:
+        """Return the running jails indexed by their jail name."""
+        if self._jails is None:
+            self._jails = _query_jails()
+        return self._jails
+
+    def get(
+        self,
+        jail: 'libioc.Jail.JailGenerator'
+    ) -> typing.Optional[JailInfo]:
+        """Return the jls information of a running jail."""
+        # libioc names jails by their identifier, which unlike the root
+        # path is known without a ZFS mountpoint lookup
+        return self.jails.get(jail.identifier, None)
+
+    def running(self, jail: 'libioc.Jail.JailGenerator') -> bool:
+        """Return True when the jail is running."""
+        return self.get(jail) is not None
+
+    def jid(self, jail: 'libioc.Jail.JailGenerator') -> typing.Optional[int]:
+        """Return the JID of a running jail."""
+        info = self.get(jail)
+        return None if (info is None) else int(info["jid"])
+
+    def hostid_check_ok(self, jail: 'libioc.Jail.JailGenerator') -> bool:
+        """Return True when the jail may be started on this host."""
+        # libioc owns the hostid rules, they do not depend on the snapshot
+        return bool(jail.hostid_check_ok)
+
+
+def get_runtime(host: 'libioc.Host.HostGenerator') -> JailRuntime:
+    """Return the runtime snapshot attached to the host."""
+    runtime = getattr(host, "runtime", None)
+    if runtime is None:
+        runtime = JailRuntime()
+        setattr(host, "runtime", runtime)
+    return typing.cast(JailRuntime, runtime)
+
+
+def filter_running(
+    jails: typing.Iterable['libioc.Jail.JailGenerator'],
+    runtime: JailRuntime,
+    running: typing.Optional[bool]
+) -> typing.Generator['libioc.Jail.JailGenerator', None, None]:
+    """Yield the jails whose running state matches."""
+    for jail in jails:
+        if (running is None) or (runtime.running(jail) is running):
+            yield jail
+
+
+def pop_running_filter(
+    filters: typing.Tuple[str, ...]
+) -> typing.Tuple[typing.Tuple[str, ...], typing.Optional[bool]]:
+    """
+    Split a running=yes|no filter from the jail filters.
+
+    The running state would otherwise be queried per jail while filtering.
+    Ambiguous running filters are left in place.
+    """
+    remaining: typing.Tuple[str, ...] = tuple()
+    running: typing.Optional[bool] = None
+    for _filter in filters:
+        if _filter in ("running=yes", "running=no"):
+            running = (_filter == "running=yes")
+        else:
+            remaining += (_filter,)
+    return remaining, running
+
+
+def _query_jails() -> typing.Dict[str, JailInfo]:
+    try:
+        output = subprocess.check_output(  # nosec: B603
+            [JLS_COMMAND, "-v", "--libxo=json"],
+            stderr=subprocess.PIPE
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return {}
+    try:
+        data = json.loads(output.decode("UTF-8"))
+        # jls omits the jail list when no jail is running
+        jails = data["jail-information"].get("jail", [])
+        return dict((str(x["name"]), x) for x in jails)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        # unexpected output is treated like a failed jls call
+        return {}
@@ -0,0 +1,206 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Create, list and destroy the snapshots of many jails at once."""
+import tempfile
+import typing
+
+import libioc.Jail
+
+from .zfs import run, ZFSCommandError
+
+SNAPSHOT_PROPERTIES = (
+    "name", "creation", "createtxg", "used", "referenced",
+)
+
+# snapshots destroyed by one channel program, bounded by its memory limit
+DESTROY_BATCH_SIZE = 1000
+
+# destroys all snapshots given as arguments in one transaction group, or
+# none of them when any can't be destroyed
+DESTROY_CHANNEL_PROGRAM = """
+args = ...
+snapshots = args["argv"]
+for i, snapshot in ipairs(snapshots) do
+    err = zfs.check.destroy(snapshot)
+    if err ~= 0 then
+        error(snapshot .. ": " .. err)
+    end
+end
+for i, snapshot in ipairs(snapshots) do
+    zfs.sync.destroy(snapshot)
+end
+"""
+
+
+class Snapshot(typing.NamedTuple):
+    """A ZFS snapshot of a jail dataset or one of its children."""
+
+    jail: str
+    dataset: str
+    name: str
+    creation: int
+    createtxg: int
+    used: int
+    referenced: int
+
+    @property
+    def full_name(self) -> str:
+        """Return the ZFS name of the snapshot."""
+        return f"{self.dataset}@{self.name}"
+
+
+def list_snapshots(
+    jails: typing.Iterable['libioc.Jail.JailGenerator'],
+    recursive: bool=False
+) -> typing.List[Snapshot]:
+    """
+    Return the snapshots of the jail datasets.
+
+    The snapshots of all jails are listed with one zfs list command and
+    are ordered by their transaction group. Recursive listings include the
+    snapshots of child datasets, such as the jail root.
+    """
+    jail_names = {jail.dataset_name: jail.name for jail in jails}
+    if len(jail_names) == 0:
+        return []
+
+    args = [
+        "list", "-H", "-p",
+        "-t", "snapshot",
+        "-o", ",".join(SNAPSHOT_PROPERTIES),
+        "-s", "createtxg"
+    ]
+    args += ["-r"] if (recursive is True) else ["-d", "1"]
+    args += list(jail_names.keys())
+
+    snapshots = []
+    for line in run(args).splitlines():
+        full_name, creation, createtxg, used, referenced = line.split("\t")
+        dataset, name = full_name.split("@", maxsplit=1)
+        jail_dataset = _get_jail_dataset(dataset, jail_names)
+        if jail_dataset is None:
+            continue
+        snapshots.append(Snapshot(
+            jail=jail_names[jail_dataset],
+            dataset=dataset,
+            name=name,
+            creation=int(creation),
+            createtxg=int(createtxg),
+            used=int(used),
+            referenced=int(referenced)
+        ))
+    return snapshots
+
+
+def _get_jail_dataset(
+    dataset: str,
+    jail_datasets: typing.Iterable[str]
+) -> typing.Optional[str]:
+    while dataset not in jail_datasets:
+        if "/" not in dataset:
+            return None
+        dataset = dataset.rsplit("/", maxsplit=1)[0]
+    return dataset
+
+
+def create_snapshots(
+    datasets: typing.Iterable[str],
+    name: str,
+    recursive: bool=True
+) -> None:
+    """
+    Snapshot many datasets at the same point in time.
+
+    All snapshots of a pool are created by a single zfs snapshot command,
+    which is atomic: either all of them are taken in one transaction group
+    or none is.
+    """
+    for pool_datasets in _group_by_pool(datasets).values():
+        args = ["snapshot"]
+        if recursive is True:
+            args.append("-r")
+        run(args + [f"{dataset}@{name}" for dataset in pool_datasets])
+
+
+def destroy_snapshots(
+    snapshots: typing.Iterable[str],
+    batch_size: int=DESTROY_BATCH_SIZE
+) -> typing.Dict[str, ZFSCommandError]:
+    """
+    Destroy many snapshots and return the errors of those that remain.
+
+    Each batch of snapshots of a pool is destroyed by one ZFS channel
+    program in a single transaction group. When the channel program can't
+    be run or any snapshot of the batch can't be destroyed, the snapshots
+    of each dataset are destroyed with one zfs destroy each.
+    """
+    failed: typing.Dict[str, ZFSCommandError] = {}
+    for pool, pool_snapshots in _group_by_pool(snapshots).items():
+        for start in range(0, len(pool_snapshots), batch_size):
+            batch = pool_snapshots[start:start + batch_size]
+            try:
+                _run_channel_program(pool, DESTROY_CHANNEL_PROGRAM, batch)
+            except ZFSCommandError:
+                failed.update(_destroy_snapshots_per_dataset(batch))
+    return failed
+
+
+def _destroy_snapshots_per_dataset(
+    snapshots: typing.List[str]
+) -> typing.Dict[str, ZFSCommandError]:
+    names: typing.Dict[str, typing.List[str]] = {}
+    for snapshot in snapshots:
+        dataset, name = snapshot.split("@", maxsplit=1)
+        names.setdefault(dataset, []).append(name)
+
+    failed: typing.Dict[str, ZFSCommandError] = {}
+    for dataset, dataset_names in names.items():
+        try:
+            run(["destroy", f"{dataset}@{','.join(dataset_names)}"])
+        except ZFSCommandError as e:
+            for name in dataset_names:
+                failed[f"{dataset}@{name}"] = e
+    return failed
+
+
+def _run_channel_program(
+    pool: str,
+    program: str,
+    args: typing.List[str]
+) -> str:
+    with tempfile.NamedTemporaryFile("w", suffix=".lua") as f:
+        f.write(program)
+        f.flush()
+        return run(["program", pool, f.name] + args)
+
+
+def _group_by_pool(
+    names: typing.Iterable[str]
+) -> typing.Dict[str, typing.List[str]]:
+    pools: typing.Dict[str, typing.List[str]] = {}
+    for name in names:
+        pool = name.split("@", maxsplit=1)[0].split("/", maxsplit=1)[0]
+        pools.setdefault(pool, []).append(name)
+    return pools
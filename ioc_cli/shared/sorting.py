@@ -0,0 +1,142 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Sort, limit and offset streams of listed items."""
+import heapq
+import itertools
+import typing
+
+T = typing.TypeVar("T")
+
+# prefix of a sort column that reverses its order
+DESCENDING_PREFIX = "-"
+
+
+class SortColumn(typing.NamedTuple):
+    """A column that items are ordered by."""
+
+    name: str
+    descending: bool
+
+
+def parse_sort_columns(value: typing.Optional[str]) -> typing.List[SortColumn]:
+    """Parse a comma separated list of columns, descending when prefixed."""
+    if value is None:
+        return []
+    sort_columns: typing.List[SortColumn] = []
+    for name in value.split(","):
+        name = name.strip()
+        descending = name.startswith(DESCENDING_PREFIX)
+        if descending is True:
+            name = name[len(DESCENDING_PREFIX):]
+        if name == "":
+            continue
+        sort_columns.append(SortColumn(name, descending))
+    return sort_columns
+
+
+def split_sort_columns(
+    sort_columns: typing.Sequence[SortColumn],
+    columns: typing.Sequence[str]
+) -> typing.Tuple[typing.List[SortColumn], typing.List[str]]:
+    """Return the sort columns that are listed and the names of all others."""
+    listed = [x for x in sort_columns if x.name in columns]
+    unlisted = [x.name for x in sort_columns if x.name not in columns]
+    return listed, unlisted
+
+
+class _SortKey:
+    """Comparable key of an item with mixed column directions."""
+
+    __slots__ = ("values", "sort_columns",)
+
+    def __init__(
+        self,
+        values: typing.Sequence[typing.Any],
+        sort_columns: typing.Sequence[SortColumn]
+    ) -> None:
+        self.values = values
+        self.sort_columns = sort_columns
+
+    def __lt__(self, other: '_SortKey') -> bool:
+        """Return True when this item is ordered before the other one."""
+        for value, other_value, sort_column in zip(
+            self.values,
+            other.values,
+            self.sort_columns
+        ):
+            if value == other_value:
+                continue
+            return _value_lt(value, other_value, sort_column.descending)
+        return False
+
+
+def _value_lt(a: typing.Any, b: typing.Any, descending: bool) -> bool:
+    # unset values are listed last in both directions
+    if a is None:
+        return False
+    if b is None:
+        return True
+    if descending is True:
+        a, b = b, a
+    try:
+        return bool(a < b)
+    except TypeError:
+        return str(a) < str(b)
+
+
+def paginate(
+    items: typing.Iterable[T],
+    sort_columns: typing.Sequence[SortColumn]=(),
+    get_values: typing.Optional[
+        typing.Callable[[T, typing.List[str]], typing.Sequence[typing.Any]]
+    ]=None,
+    limit: typing.Optional[int]=None,
+    offset: int=0
+) -> typing.Iterator[T]:
+    """
+    Return the requested page of items.
+
+    Unsorted pages are sliced from the stream, so that no more items than
+    needed are enumerated. Sorted pages with a limit only keep the top
+    offset + limit items on a heap instead of sorting all of them.
+    """
+    if len(sort_columns) == 0:
+        stop = None if (limit is None) else offset + limit
+        return itertools.islice(items, offset, stop)
+
+    if get_values is None:
+        raise ValueError("sorting requires a value getter")
+
+    column_names = [sort_column.name for sort_column in sort_columns]
+    _get_values = get_values
+
+    def key(item: T) -> _SortKey:
+        return _SortKey(_get_values(item, column_names), sort_columns)
+
+    if limit is None:
+        ordered = sorted(items, key=key)
+    else:
+        ordered = heapq.nsmallest(offset + limit, items, key=key)
+    return iter(ordered[offset:])
@@ -0,0 +1,303 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Remove many datasets at once through a trash dataset."""
+import os
+import subprocess  # nosec: B404
+import sys
+import time
+import typing
+import uuid
+
+import libioc.Host
+
+from .zfs import run, ZFSCommandError
+
+# datasets are moved below this child of the root dataset before removal
+TRASH_DATASET_NAME = "trash"
+
+# seconds before an empty batch of an unknown destroy is removed
+BATCH_GRACE_PERIOD = 60
+
+# a single reaper runs per root dataset, locked in its mountpoint
+REAP_LOCK_FILENAME = ".ioc-reap.lock"
+
+
+class TrashBatch(typing.NamedTuple):
+    """Datasets that were moved into the trash together."""
+
+    name: str
+    moved: typing.Dict[str, str]
+    failed: typing.Dict[str, ZFSCommandError]
+
+
+def get_root_dataset_name(
+    host: libioc.Host.HostGenerator,
+    source: str
+) -> str:
+    """Return the name of the root dataset of a source."""
+    for name, root_datasets in host.datasets.items():
+        if name == source:
+            return str(root_datasets.root.name)
+    raise KeyError(source)
+
+
+def get_reap_lock_file(
+    host: libioc.Host.HostGenerator,
+    source: str
+) -> str:
+    """Return the lock file of the reaper of a source."""
+    for name, root_datasets in host.datasets.items():
+        if name == source:
+            return os.path.join(
+                root_datasets.root.mountpoint,
+                REAP_LOCK_FILENAME
+            )
+    raise KeyError(source)
+
+
+def get_trash_dataset_name(root_dataset_name: str) -> str:
+    """Return the name of the trash dataset of a root dataset."""
+    return f"{root_dataset_name}/{TRASH_DATASET_NAME}"
+
+
+def move_to_trash(
+    datasets: typing.Iterable[str],
+    root_dataset_name: str
+) -> TrashBatch:
+    """
+    Move datasets into a new batch in the trash of a root dataset.
+
+    Renaming is instant, regardless of the size of the dataset or the
+    number of its snapshots. The trash is not mounted and the renamed
+    datasets are not remounted, so that processes using them are not
+    disturbed until the batch is destroyed.
+    """
+    trash_dataset_name = get_trash_dataset_name(root_dataset_name)
+    try:
+        run(["create", "-o", "mountpoint=none", trash_dataset_name])
+    except ZFSCommandError as e:
+        if "exists" not in e.stderr:
+            raise
+
+    batch_name = f"{trash_dataset_name}/{_new_batch_id()}"
+    run(["create", batch_name])
+
+    moved: typing.Dict[str, str] = {}
+    failed: typing.Dict[str, ZFSCommandError] = {}
+    for index, dataset in enumerate(datasets):
+        # the index keeps names unique, the basename keeps them readable
+        basename = dataset.rsplit("/", maxsplit=1)[-1]
+        trashed_dataset = f"{batch_name}/{index}-{basename}"
+        try:
+            run(["rename", "-u", dataset, trashed_dataset])
+            moved[dataset] = trashed_dataset
+        except ZFSCommandError as e:
+            failed[dataset] = e
+    return TrashBatch(batch_name, moved, failed)
+
+
+def unmount_batch(batch: TrashBatch) -> typing.Dict[str, ZFSCommandError]:
+    """
+    Detach the datasets of a batch from their original mountpoints.
+
+    Deferred batches stay in the trash until they are reaped, so their
+    datasets must not remain mounted at the paths of jails created again
+    with the same names. Returns the errors by original dataset name.
+    """
+    failed: typing.Dict[str, ZFSCommandError] = {}
+    for dataset, trashed_dataset in batch.moved.items():
+        try:
+            _disable_mountpoint(trashed_dataset)
+        except ZFSCommandError as e:
+            failed[dataset] = e
+    return failed
+
+
+def restore(batch: TrashBatch, dataset: str) -> None:
+    """Move a dataset of a batch back to its original name."""
+    run(["rename", "-u", batch.moved[dataset], dataset])
+
+
+def destroy_batch(batch_name: str) -> typing.Dict[str, ZFSCommandError]:
+    """
+    Destroy a trash batch with one recursive zfs destroy.
+
+    When the batch cannot be destroyed at once, its datasets are destroyed
+    one by one and the errors of those that remain are returned.
+    """
+    try:
+        run(["destroy", "-r", "-f", batch_name])
+        return {}
+    except ZFSCommandError:
+        pass
+
+    failed: typing.Dict[str, ZFSCommandError] = {}
+    for dataset in list_datasets(batch_name):
+        try:
+            run(["destroy", "-r", "-f", dataset])
+        except ZFSCommandError as e:
+            failed[dataset] = e
+    if len(failed) == 0:
+        run(["destroy", "-r", "-f", batch_name])
+    return failed
+
+
+def reap(
+    root_dataset_name: str,
+    delay: float=0,
+    limit: typing.Optional[int]=None,
+    complete_batches: typing.Iterable[str]=()
+) -> typing.Iterator[typing.Tuple[str, typing.Optional[ZFSCommandError]]]:
+    """
+    Destroy the trashed datasets of a root dataset, oldest batch first.
+
+    Datasets are destroyed one at a time with a delay in between, so that
+    freeing space does not compete with the workload of the host. At most
+    limit datasets are destroyed. Yields each dataset with its error, if
+    any. Batches that were added while reaping are included.
+
+    Empty batches are removed when they are listed in complete_batches,
+    because their destroy has finished moving datasets, or when they are
+    older than BATCH_GRACE_PERIOD.
+    """
+    complete_batches = set(complete_batches)
+    trash_dataset_name = get_trash_dataset_name(root_dataset_name)
+    count = 0
+    skipped: typing.Set[str] = set()
+    while True:
+        batch_names = [
+            x for x in list_datasets(trash_dataset_name)
+            if x not in skipped
+        ]
+        if len(batch_names) == 0:
+            return
+        for batch_name in batch_names:
+            datasets = list_datasets(batch_name)
+            if all((x in skipped) for x in datasets):
+                if len(datasets) == 0:
+                    if batch_name in complete_batches:
+                        _remove_batch(batch_name)
+                    elif _is_stale_batch(batch_name):
+                        _remove_batch(batch_name)
+                skipped.add(batch_name)
+                continue
+            for dataset in datasets:
+                if dataset in skipped:
+                    continue
+                if (limit is not None) and (count >= limit):
+                    return
+                if (count > 0) and (delay > 0):
+                    time.sleep(delay)
+                count += 1
+                try:
+                    run(["destroy", "-r", "-f", dataset])
+                    yield dataset, None
+                except ZFSCommandError as e:
+                    skipped.add(dataset)
+                    yield dataset, e
+
+
+def reap_in_background(
+    source: str,
+    batch_names: typing.Iterable[str]=(),
+    delay: float=0
+) -> None:
+    """
+    Start a detached ioc reap that outlives this process.
+
+    The given batches are complete and are removed once they are empty.
+    """
+    command = [
+        sys.executable,
+        "-c", "import ioc_cli; ioc_cli.cli(prog_name='ioc')",
+        "reap",
+        "--source", source,
+        "--delay", str(delay)
+    ]
+    for batch_name in batch_names:
+        command += ["--batch", batch_name]
+    # ioc_cli is not on the default path of bin/ioc installations
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    subprocess.Popen(  # nosec: B603
+        command,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        close_fds=True
+    )
+
+
+def list_datasets(parent_dataset_name: str) -> typing.List[str]:
+    """Return the direct children of a dataset, sorted by name."""
+    try:
+        output = run([
+            "list", "-H", "-o", "name", "-d", "1", "-s", "name",
+            "-t", "filesystem", parent_dataset_name
+        ])
+    except ZFSCommandError:
+        return []
+    return [x for x in output.splitlines() if x != parent_dataset_name]
+
+
+def _disable_mountpoint(dataset: str) -> None:
+    try:
+        run(["set", "mountpoint=none", dataset])
+        return
+    except ZFSCommandError:
+        pass
+    # the stopped jail may still hold busy mounts, deepest ones first
+    output = run([
+        "list", "-H", "-o", "name,mounted", "-r", "-t", "filesystem",
+        dataset
+    ])
+    for line in reversed(output.splitlines()):
+        name, mounted = line.split("\t")
+        if mounted == "yes":
+            run(["unmount", "-f", name])
+    run(["set", "mountpoint=none", dataset])
+
+
+def _is_stale_batch(batch_name: str) -> bool:
+    # empty batches may still receive datasets from a running destroy
+    try:
+        created_at = int(batch_name.rsplit("/", 1)[-1].split("-", 1)[0])
+    except ValueError:
+        return True
+    return (time.time() - created_at) > BATCH_GRACE_PERIOD
+
+
+def _remove_batch(batch_name: str) -> None:
+    try:
+        run(["destroy", batch_name])
+    except ZFSCommandError:
+        # another reaper or destroy is still using the batch
+        pass
+
+
+def _new_batch_id() -> str:
+    # batches sort by the time they were created
+    return f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
@@ -0,0 +1,93 @@
+# Copyright (c) 2017-2019, Stefan Grönke
+# Copyright (c) 2014-2018, iocage
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Query and modify many ZFS datasets with few zfs(8) invocations."""
+import subprocess  # nosec: B404
+import typing
+
+ZFS_COMMAND = "/sbin/zfs"
+
+PropertyValues = typing.Dict[str, typing.Optional[str]]
+
+
+class ZFSCommandError(Exception):
+    """Raised when a zfs(8) command fails."""
+
+    def __init__(self, command: typing.List[str], stderr: str) -> None:
+        self.command = command
+        self.stderr = stderr
+        super().__init__(
+            f"{' '.join(command[:2])} failed: {stderr.strip()}"
+        )
+
+
+def run(args: typing.List[str]) -> str:
+    """Run zfs(8) with the given arguments and return its output."""
+    command = [ZFS_COMMAND] + args
+    try:
+        process = subprocess.run(  # nosec: B603
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False
+        )
+    except OSError as e:
+        raise ZFSCommandError(command, str(e))
+    if process.returncode != 0:
+        raise ZFSCommandError(command, process.stderr.decode("UTF-8"))
+    return str(process.stdout.decode("UTF-8"))
+
+
+def get_properties(
+    datasets: typing.Iterable[str],
+    properties: typing.Iterable[str],
+    depth: typing.Optional[int]=None,
+    dataset_type: str="filesystem"
+) -> typing.Dict[str, PropertyValues]:
+    """
+    Get properties of many datasets with a single zfs get command.
+
+    With a depth the children of the given datasets are included. Values
+    are returned in their parseable (-p) representation, and unset values
+    (`-`) are returned as None.
+    """
+    _datasets = list(datasets)
+    _properties = list(properties)
+    if (len(_datasets) == 0) or (len(_properties) == 0):
+        return {}
+
+    args = [
+        "get", "-H", "-p",
+        "-o", "name,property,value",
+        "-t", dataset_type
+    ]
+    if depth is not None:
+        args += ["-d", str(depth)]
+    args += [",".join(_properties)] + _datasets
+
+    result: typing.Dict[str, PropertyValues] = {}
+    for line in run(args).splitlines():
+        name, prop, value = line.split("\t", maxsplit=2)
+        result.setdefault(name, {})[prop] = None if (value == "-") else value
+    return result
@@ -23,6 +23,8 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """Create and manage jail snapshots with the CLI."""
+import json
+import time
 import typing
 import click
 
@@ -30,11 +32,35 @@ import libioc.Jail
 import libioc.Logger
 
 from .shared.click import IocClickContext
+from .shared.inventory import list_jails
 from .shared.jail import get_jail
-from .shared.output import print_table
+from .shared.output import format_size, print_table_stream
+from .shared.pool import exclude_pool_members
+from .shared.retention import (
+    parse_policy,
+    select_expired,
+    RetentionRule,
+    RETENTION_PROPERTY
+)
+from .shared.snapshots import (
+    create_snapshots,
+    destroy_snapshots,
+    list_snapshots,
+    Snapshot
+)
+from .shared.sorting import (
+    paginate,
+    parse_sort_columns,
+    split_sort_columns
+)
+from .shared.zfs import get_properties, ZFSCommandError
 
 __rootcmd__ = True
 
+supported_output_formats = ["table", "json", "ndjson"]
+
+SNAPSHOT_COLUMNS = ["jail", "name", "creation", "used", "referenced"]
+
 
 @click.command(
     name="list_or_create"
@@ -52,12 +78,12 @@ def cli_list_or_create(
     if "@" in ctx.info_name:
         return _cli_create(ctx, ctx.info_name)
     else:
-        return _cli_list(ctx, ctx.info_name)
+        return _cli_list(ctx, (ctx.info_name,))
 
 
 @click.command(
     name="create",
-    help="Create a snapshot"
+    help="Create a snapshot of all jails matching <filter>@<snapshot_name>"
 )
 @click.pass_context
 @click.argument("identifier", nargs=1, required=True)
@@ -67,15 +93,14 @@ def cli_create(ctx: IocClickContext, identifier: str) -> None:
 
 
 def _cli_create(ctx: IocClickContext, identifier: str) -> None:
+    logger = ctx.parent.logger
+    jails, snapshot_name = _get_jails(ctx, identifier)
     try:
-        ioc_jail, snapshot_name = _parse_identifier(
-            ctx=ctx.parent,
-            identifier=identifier,
-            require_full_identifier=True
-        )
-        ioc_jail.snapshots.create(snapshot_name)
-    except libioc.errors.IocException:
-        pass
+        create_snapshots([jail.dataset_name for jail in jails], snapshot_name)
+    except ZFSCommandError as e:
+        logger.error(str(e))
+        exit(1)
+    logger.verbose(f"Snapshot {snapshot_name} of {len(jails)} jails created")
 
 
 @click.command(
@@ -107,43 +132,308 @@ def cli_rollback(
     help="List all snapshots"
 )
 @click.pass_context
-@click.argument("jail", nargs=1, required=True)
-def cli_list(ctx: IocClickContext, jail: str) -> None:
-    """List existing snapshots."""
-    _cli_list(ctx, jail)
+@click.option("--recursive", "-r", is_flag=True, default=False,
+              help="Include the snapshots of child datasets.")
+@click.option("--sort", "-s", "_sort", default=None, nargs=1,
+              help="Comma separated list of columns to sort by. Columns"
+                   " prefixed with - are sorted in descending order.")
+@click.option("--limit", "-n", default=None, type=click.IntRange(min=1),
+              help="List at most this number of snapshots.")
+@click.option("--offset", default=0, type=click.IntRange(min=0),
+              help="Skip this number of snapshots.")
+@click.option("--output-format", "-f", default="table",
+              type=click.Choice(supported_output_formats))
+@click.option("--header/--no-header", "-H/-NH", is_flag=True, default=True,
+              help="Show or hide column name heading.")
+@click.argument("filters", nargs=-1)
+def cli_list(
+    ctx: IocClickContext,
+    recursive: bool,
+    _sort: typing.Optional[str],
+    limit: typing.Optional[int],
+    offset: int,
+    output_format: str,
+    header: bool,
+    filters: typing.Tuple[str, ...]
+) -> None:
+    """List existing snapshots of the matching jails."""
+    _cli_list(
+        ctx,
+        filters,
+        recursive=recursive,
+        _sort=_sort,
+        limit=limit,
+        offset=offset,
+        output_format=output_format,
+        header=header
+    )
+
+
+def _cli_list(
+    ctx: IocClickContext,
+    filters: typing.Tuple[str, ...],
+    recursive: bool=False,
+    _sort: typing.Optional[str]=None,
+    limit: typing.Optional[int]=None,
+    offset: int=0,
+    output_format: str="table",
+    header: bool=True
+) -> None:
+    logger = ctx.parent.logger
+    columns = list(SNAPSHOT_COLUMNS)
+    if recursive is True:
+        columns.insert(1, "dataset")
 
+    # like in ioc list, unlisted columns do not affect the order
+    sort_columns, unknown_sort_columns = split_sort_columns(
+        parse_sort_columns(_sort),
+        columns
+    )
+    if len(unknown_sort_columns) > 0:
+        unknown_names = ", ".join(unknown_sort_columns)
+        logger.warn(f"Not sorting by unlisted columns: {unknown_names}")
 
-def _cli_list(ctx: IocClickContext, jail: str) -> None:
     try:
-        ioc_jail, snapshot_name = _parse_identifier(
-            ctx=ctx.parent,
-            identifier=jail,
-            require_full_identifier=False
-        )
-        columns = ["NAME"]
-        data = [[x.name.split("@", maxsplit=1)[1]] for x in ioc_jail.snapshots]
-        print_table(data, columns)
+        jails = list(exclude_pool_members(
+            list_jails(filters, ctx.parent.host, logger, ctx.parent.zfs),
+            filters
+        ))
+        snapshots = list_snapshots(jails, recursive=recursive)
     except libioc.errors.IocException:
-        pass
+        exit(1)
+    except ZFSCommandError as e:
+        logger.error(str(e))
+        exit(1)
+
+    if (len(jails) == 0) and (len(filters) > 0):
+        logger.error("No jails matched your input: " + " ".join(filters))
+        exit(1)
+
+    page = paginate(
+        snapshots,
+        sort_columns=sort_columns,
+        get_values=lambda snapshot, names: [
+            _get_snapshot_value(snapshot, name) for name in names
+        ],
+        limit=limit,
+        offset=offset
+    )
+
+    if output_format == "table":
+        # all snapshots are in memory, so that all rows determine the widths
+        rows = [
+            [_format_snapshot_value(snapshot, x) for x in columns]
+            for snapshot in page
+        ]
+        print_table_stream(
+            rows,
+            columns,
+            show_header=header,
+            sample_size=len(rows)
+        )
+        return
+
+    items = (
+        {x: _get_snapshot_value(snapshot, x) for x in columns}
+        for snapshot in page
+    )
+    if output_format == "ndjson":
+        for item in items:
+            print(
+                json.dumps(item, separators=(",", ":"), sort_keys=True),
+                flush=True
+            )
+    else:
+        print(json.dumps(list(items), indent=2, sort_keys=True))
+
+
+def _get_snapshot_value(
+    snapshot: Snapshot,
+    column: str
+) -> typing.Union[str, int]:
+    return typing.cast(typing.Union[str, int], getattr(snapshot, column))
+
+
+def _format_snapshot_value(snapshot: Snapshot, column: str) -> str:
+    if column == "creation":
+        return time.strftime(
+            "%Y-%m-%d %H:%M:%S",
+            time.localtime(snapshot.creation)
+        )
+    elif column in ("used", "referenced",):
+        return format_size(
+            typing.cast(int, _get_snapshot_value(snapshot, column))
+        )
+    return str(_get_snapshot_value(snapshot, column))
+
+
+def _is_jail_snapshot(snapshot: Snapshot, dataset_name: str) -> bool:
+    if snapshot.dataset == dataset_name:
+        return True
+    return snapshot.dataset.startswith(f"{dataset_name}/")
 
 
 @click.command(
     name="remove",
-    help="Delete existing snapshots"
+    help="Delete the snapshots of all jails matching <filter>@<snapshot_name>"
 )
 @click.argument("identifier", nargs=1, required=True)
 @click.pass_context
 def cli_remove(ctx: IocClickContext, identifier: str) -> None:
-    """Remove a snapshot."""
+    """Remove a snapshot from all matching jails."""
+    logger = ctx.parent.logger
+    jails, snapshot_name = _get_jails(ctx, identifier)
     try:
-        ioc_jail, snapshot_name = _parse_identifier(
-            ctx=ctx.parent,
-            identifier=identifier,
-            require_full_identifier=True
-        )
-        ioc_jail.snapshots.delete(snapshot_name)
+        snapshots = [
+            snapshot.full_name for snapshot
+            in list_snapshots(jails, recursive=True)
+            if snapshot.name == snapshot_name
+        ]
+    except ZFSCommandError as e:
+        logger.error(str(e))
+        exit(1)
+
+    if len(snapshots) == 0:
+        logger.error(f"No snapshot matched your input: {identifier}")
+        exit(1)
+
+    failed_snapshots = destroy_snapshots(snapshots)
+    for snapshot, error in failed_snapshots.items():
+        logger.error(f"{snapshot}: {error}")
+    if len(failed_snapshots) > 0:
+        exit(1)
+
+
+@click.command(
+    name="prune",
+    help="Delete snapshots that are not kept by a retention policy"
+)
+@click.pass_context
+@click.option("--policy", "-p", default=None,
+              help="Default retention policy such as hourly-*=24,daily-*=7"
+                   f" for jails without the {RETENTION_PROPERTY} property.")
+@click.option("--dry-run", "-n", is_flag=True, default=False,
+              help="List the snapshots that would be deleted.")
+@click.argument("filters", nargs=-1)
+def cli_prune(
+    ctx: IocClickContext,
+    policy: typing.Optional[str],
+    dry_run: bool,
+    filters: typing.Tuple[str, ...]
+) -> None:
+    """
+    Delete the snapshots of the matching jails that exceed their policy.
+
+    The snapshots of all jails are listed with one zfs list. Expired
+    snapshots are deleted in batches, including the snapshots of the same
+    name of the child datasets.
+    """
+    logger = ctx.parent.logger
+
+    try:
+        default_policy = None if (policy is None) else parse_policy(policy)
+        jails = list(exclude_pool_members(
+            list_jails(filters, ctx.parent.host, logger, ctx.parent.zfs),
+            filters
+        ))
+        policies = {
+            jail.name: _get_retention_policy(jail, default_policy)
+            for jail in jails
+        }
+    except ValueError as e:
+        logger.error(str(e))
+        exit(1)
     except libioc.errors.IocException:
-        pass
+        exit(1)
+
+    jails = [jail for jail in jails if policies[jail.name] is not None]
+    if len(jails) == 0:
+        logger.error("No jails with a retention policy matched your input")
+        exit(1)
+
+    try:
+        snapshots = list_snapshots(jails, recursive=True)
+    except ZFSCommandError as e:
+        logger.error(str(e))
+        exit(1)
+
+    # retention is decided on the jail dataset, children follow by name
+    expired: typing.List[Snapshot] = []
+    expired_jail_snapshots: typing.List[Snapshot] = []
+    for jail in jails:
+        jail_snapshots = [
+            x for x in snapshots
+            if _is_jail_snapshot(x, jail.dataset_name)
+        ]
+        jail_expired = select_expired(
+            [x for x in jail_snapshots if x.dataset == jail.dataset_name],
+            typing.cast(typing.List[RetentionRule], policies[jail.name])
+        )
+        expired_names = set(x.name for x in jail_expired)
+        expired += [x for x in jail_snapshots if x.name in expired_names]
+        expired_jail_snapshots += jail_expired
+
+    if dry_run is True:
+        rows = [
+            [_format_snapshot_value(snapshot, x) for x in SNAPSHOT_COLUMNS]
+            for snapshot in expired_jail_snapshots
+        ]
+        print_table_stream(rows, SNAPSHOT_COLUMNS, sample_size=len(rows))
+        reclaimed_size = format_size(sum(x.used for x in expired))
+        logger.log(
+            f"{len(rows)} snapshots would be deleted, "
+            f"reclaiming at least {reclaimed_size}"
+        )
+        return
+
+    if len(expired) == 0:
+        logger.log("No snapshots have expired")
+        return
+
+    datasets = [jail.dataset_name for jail in jails]
+    try:
+        used_before = _get_used_space(datasets)
+        failed_snapshots = destroy_snapshots(x.full_name for x in expired)
+        used_after = _get_used_space(datasets)
+    except ZFSCommandError as e:
+        logger.error(str(e))
+        exit(1)
+
+    for snapshot, error in failed_snapshots.items():
+        logger.error(f"{snapshot}: {error}")
+    failed_names = set(failed_snapshots.keys())
+    deleted_count = len([
+        x for x in expired_jail_snapshots if x.full_name not in failed_names
+    ])
+    logger.log(
+        f"{deleted_count} snapshots of {len(jails)} jails deleted, "
+        f"{format_size(max(0, used_before - used_after))} reclaimed"
+    )
+    if len(failed_snapshots) > 0:
+        exit(1)
+
+
+def _get_retention_policy(
+    jail: libioc.Jail.JailGenerator,
+    default_policy: typing.Optional[typing.List[RetentionRule]]
+) -> typing.Optional[typing.List[RetentionRule]]:
+    try:
+        value = jail.config[RETENTION_PROPERTY]
+    except (KeyError, libioc.errors.IocException):
+        value = None
+    if value in (None, "", "-",):
+        return default_policy
+    try:
+        return parse_policy(str(value))
+    except ValueError as e:
+        raise ValueError(f"{jail.name}: {e}")
+
+
+def _get_used_space(datasets: typing.List[str]) -> int:
+    return sum(
+        int(properties["used"] or 0)
+        for properties in get_properties(datasets, ["used"]).values()
+    )
 
 
 class SnapshotCli(click.MultiCommand):
@@ -155,7 +445,8 @@ class SnapshotCli(click.MultiCommand):
             "list",
             "create",
             "rollback",
-            "remove"
+            "remove",
+            "prune"
         ]
 
     def get_command(
@@ -174,6 +465,8 @@ class SnapshotCli(click.MultiCommand):
             command = cli_remove
         elif cmd_name == "rollback":
             command = cli_rollback
+        elif cmd_name == "prune":
+            command = cli_prune
         else:
             command = cli_list_or_create
 
@@ -194,6 +487,39 @@ def cli(
     """Take and manage resource snapshots."""
     ctx.logger = ctx.parent.logger
     ctx.host = ctx.parent.host
+    ctx.zfs = ctx.parent.zfs
+
+
+def _get_jails(
+    ctx: IocClickContext,
+    identifier: str
+) -> typing.Tuple[typing.List[libioc.Jail.JailGenerator], str]:
+    """
+    Return the jails and the snapshot name of a snapshot identifier.
+
+    The part before the last @ is a jail filter, so that a name like
+    `tag=db*@nightly` selects the snapshot of all matching jails.
+    """
+    logger = ctx.parent.logger
+    if "@" not in identifier:
+        logger.error(f"Invalid snapshot identifier: {identifier}")
+        exit(1)
+    jail_filter, snapshot_name = identifier.rsplit("@", maxsplit=1)
+
+    try:
+        filters = (jail_filter,)
+        jails = list(exclude_pool_members(
+            list_jails(filters, ctx.parent.host, logger, ctx.parent.zfs),
+            filters
+        ))
+    except libioc.errors.IocException:
+        exit(1)
+
+    if len(jails) == 0:
+        logger.error(f"No jails matched your input: {jail_filter}")
+        exit(1)
+
+    return jails, snapshot_name
 
 
 def _parse_identifier(
@@ -27,11 +27,15 @@ import typing
 import click
 
 import libioc.errors
-import libioc.Jails
+import libioc.Jail
 import libioc.Logger
 
 from .shared.click import IocClickContext
-from .shared.jail import set_properties
+from .shared.inventory import list_jails
+from .shared.pool import exclude_pool_members
+from .shared.jail import get_isolated_jail, set_properties
+from .shared.parallel import group_tiers, run_parallel
+from .shared.runtime import filter_running, get_runtime, pop_running_filter
 
 __rootcmd__ = True
 
@@ -47,6 +51,15 @@ __rootcmd__ = True
         "order with smaller value for priority starting first."
     )
 )
+@click.option(
+    "--jobs", "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help=(
+        "Number of jails with the same priority that are started "
+        "concurrently with --rc."
+    )
+)
 @click.option(
     "--option", "-o",
     "temporary_config_override",
@@ -57,6 +70,7 @@ __rootcmd__ = True
 def cli(
     ctx: IocClickContext,
     rc: bool,
+    jobs: int,
     temporary_config_override: typing.Tuple[str, ...],
     jails: typing.Tuple[str, ...]
 ) -> None:
@@ -77,7 +91,7 @@ def cli(
         if len(jails) > 0:
             logger.error("Cannot use --rc and jail selectors simultaniously")
             exit(1)
-        _autostart(**start_args)
+        _autostart(jobs=jobs, **start_args)
     else:
         start_normal_successful = _normal(
             jails,
@@ -95,39 +109,70 @@ def _autostart(
     print_function: typing.Callable[
         [typing.Generator[libioc.events.IocEvent, None, None]],
         None
-    ]
+    ],
+    jobs: int=1
 ) -> None:
 
-    filters = ("boot=yes", "running=no", "template=no,-",)
+    filters, running = pop_running_filter(
+        ("boot=yes", "running=no", "template=no,-",)
+    )
 
-    ioc_jails = libioc.Jails.Jails(
+    ioc_jails = exclude_pool_members(list_jails(
+        filters,
         zfs=zfs,
         host=host,
         logger=logger,
-        filters=filters
-    )
+        jail_class=libioc.Jail.Jail,
+        skip_invalid_config=False
+    ))
+    runtime = get_runtime(host)
 
-    # sort jails by their priority
-    jails = sorted(
-        list(ioc_jails),
+    # group jails by their priority, smaller values start first
+    tiers = group_tiers(
+        filter_running(ioc_jails, runtime, running),
         key=lambda x: x.config["priority"]
     )
 
     failed_jails = []
-    for jail in jails:
-        try:
-            if jail.running is True:
-                logger.log(f"{jail.name} is already running - skipping start")
+    for priority, tier in tiers:
+        # jails of previous tiers may have started dependencies
+        runtime.invalidate()
+        jails = []
+        for jail in tier:
+            try:
+                if runtime.running(jail) is True:
+                    logger.log(
+                        f"{jail.name} is already running - skipping start"
+                    )
+                    continue
+                elif runtime.hostid_check_ok(jail) is False:
+                    logger.log(f"{jail.name} hostid mismatch - skipping start")
+                    continue
+            except libioc.errors.IocException:
+                failed_jails.append(jail)
                 continue
-            elif jail.hostid_check_ok is False:
-                logger.log(f"{jail.name} hostid mismatch - skipping start")
-                continue
-            jail.start()
-        except libioc.errors.IocException:
-            failed_jails.append(jail)
-            continue
+            jails.append(jail)
 
-        logger.log(f"{jail.humanreadable_name} running as JID {jail.jid}")
+        logger.verbose(
+            f"Starting {len(jails)} jails with priority {priority}"
+        )
+
+        # events of concurrently started jails would interleave,
+        # so that only the outcome is reported from this thread
+        for result in run_parallel(
+            jails,
+            worker=lambda x: _start_isolated(x, host, logger),
+            jobs=jobs
+        ):
+            jail = result.item
+            if result.failed is True:
+                logger.error(
+                    f"{jail.humanreadable_name} failed to start: "
+                    f"{result.error}"
+                )
+                failed_jails.append(jail)
+                continue
+            logger.log(f"{jail.humanreadable_name} running as JID {jail.jid}")
 
     if len(failed_jails) > 0:
         exit(1)
@@ -135,6 +180,21 @@ def _autostart(
     exit(0)
 
 
+def _start_isolated(
+    jail: 'libioc.Jail.Jail',
+    host: libioc.Host.HostGenerator,
+    logger: libioc.Logger.Logger
+) -> None:
+    # jails are started concurrently, so each start loads its jail with
+    # its own ZFS handle and host
+    get_isolated_jail(
+        jail,
+        host,
+        logger,
+        jail_class=libioc.Jail.Jail
+    ).start()
+
+
 def _normal(
     filters: typing.Tuple[str, ...],
     temporary_config_override: typing.Tuple[str, ...],
@@ -149,12 +209,14 @@ def _normal(
 
     filters += ("template=no,-",)
 
-    jails = libioc.Jails.JailsGenerator(
+    jails = exclude_pool_members(list_jails(
+        filters,
         logger=logger,
         zfs=zfs,
         host=host,
-        filters=filters
-    )
+        skip_invalid_config=False
+    ), filters)
+    runtime = get_runtime(host)
 
     changed_jails = []
     skipped_jails = []
@@ -170,15 +232,19 @@ def _normal(
             exit(1)
         try:
             jail.require_jail_not_template()
-            if jail.running is True:
+            if runtime.running(jail) is True:
                 logger.log(f"{jail.name} is already running - skipping start")
                 skipped_jails.append(jail)
                 continue
-            elif jail.hostid_check_ok is False:
+            elif runtime.hostid_check_ok(jail) is False:
                 logger.log(f"{jail.name} hostid mismatch - skipping start")
                 skipped_jails.append(jail)
                 continue
-            print_function(jail.start())
+            try:
+                print_function(jail.start())
+            finally:
+                # starting a jail may start its dependencies as well
+                runtime.invalidate()
         except libioc.errors.IocException:
             failed_jails.append(jail)
             continue
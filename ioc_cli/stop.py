@@ -23,14 +23,20 @@
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 """Stop jails with the CLI."""
+import time
 import typing
 import click
 
 import libioc.errors
+import libioc.Jail
 import libioc.Jails
 import libioc.Logger
 
 from .shared.click import IocClickContext
+from .shared.jail import get_isolated_jail
+from .shared.parallel import group_tiers, run_parallel
+from .shared.pool import exclude_pool_members
+from .shared.runtime import filter_running, get_runtime, pop_running_filter
 
 __rootcmd__ = True
 
@@ -42,11 +48,19 @@ __rootcmd__ = True
                    " order with higher value for priority stopping first.")
 @click.option("--force", "-f", is_flag=True, default=False,
               help="Skip checks and enforce jail shutdown")
+@click.option("--jobs", "-j", default=1, type=click.IntRange(min=1),
+              help="Number of jails with the same priority that are stopped"
+                   " concurrently with --rc.")
+@click.option("--timeout", "-t", default=0, type=click.IntRange(min=0),
+              help="Seconds after which a jail is forcefully stopped with"
+                   " --rc. Disabled with 0 (default).")
 @click.argument("jails", nargs=-1)
 def cli(
     ctx: IocClickContext,
     rc: bool,
     force: bool,
+    jobs: int,
+    timeout: int,
     jails: typing.Tuple[str, ...]
 ) -> None:
     """
@@ -78,7 +92,9 @@ def cli(
             zfs=ctx.parent.zfs,
             logger=logger,
             print_function=ctx.parent.print_events,
-            force=force
+            force=force,
+            jobs=jobs,
+            timeout=(timeout if (timeout > 0) else None)
         )
     else:
         if not _normal(jails, **stop_args):
@@ -100,13 +116,13 @@ def _normal(
     filters += ("template=no,-",)
 
     try:
-        jails = libioc.Jails.JailsGenerator(
+        jails = exclude_pool_members(libioc.Jails.JailsGenerator(
             zfs=zfs,
             host=host,
             logger=logger,
             filters=filters,
             skip_invalid_config=True
-        )
+        ), filters)
     except libioc.errors.IocException:
         exit(1)
 
@@ -141,37 +157,80 @@ def _autostop(
         [typing.Generator[libioc.events.IocEvent, None, None]],
         None
     ],
-    force: bool=True
+    force: bool=True,
+    jobs: int=1,
+    timeout: typing.Optional[float]=None
 ) -> None:
 
-    filters = ("running=yes", "template=no,-",)
+    filters, running = pop_running_filter(
+        ("running=yes", "template=no,-",)
+    )
 
     try:
-        ioc_jails = libioc.Jails.Jails(
+        ioc_jails = exclude_pool_members(libioc.Jails.Jails(
             host=host,
             zfs=zfs,
             logger=logger,
             filters=filters,
             skip_invalid_config=True
-        )
+        ))
     except libioc.errors.IocException:
         exit(1)
 
-    # sort jails by their priority
-    jails = reversed(sorted(
-        list(ioc_jails),
-        key=lambda x: x.config["priority"]
-    ))
+    runtime = get_runtime(host)
+
+    # group jails by their priority, higher values stop first
+    tiers = group_tiers(
+        filter_running(ioc_jails, runtime, running),
+        key=lambda x: x.config["priority"],
+        reverse=True
+    )
+
+    # jails are stopped concurrently, so each stop loads its jail with
+    # its own ZFS handle and host
+    def _stop(jail: 'libioc.Jail.Jail') -> None:
+        get_isolated_jail(
+            jail,
+            host,
+            logger,
+            jail_class=libioc.Jail.Jail
+        ).stop(force=force)
+
+    def _force_stop(jail: 'libioc.Jail.Jail') -> None:
+        logger.warn(
+            f"{jail.name} did not stop within {timeout}s - enforcing stop"
+        )
+        # the hung stop still uses its Jail object, so it is not shared
+        get_isolated_jail(
+            jail,
+            host,
+            logger,
+            jail_class=libioc.Jail.Jail
+        ).stop(force=True)
 
     failed_jails = []
-    for jail in jails:
-        try:
-            jail.stop(force=force)
-        except libioc.errors.IocException:
-            failed_jails.append(jail)
-            continue
-
-        logger.log(f"{jail.name} stopped")
+    for priority, jails in tiers:
+        tier_start = time.monotonic()
+        for result in run_parallel(
+            jails,
+            worker=_stop,
+            jobs=jobs,
+            timeout=timeout,
+            escalate=_force_stop
+        ):
+            jail = result.item
+            if result.failed is True:
+                failed_jails.append(jail)
+                continue
+
+            logger.log(f"{jail.name} stopped")
+
+        runtime.invalidate()
+        tier_duration = round(time.monotonic() - tier_start, 3)
+        logger.log(
+            f"{len(jails)} jails with priority {priority}"
+            f" stopped in {tier_duration}s"
+        )
 
     if len(failed_jails) > 0:
         exit(1)
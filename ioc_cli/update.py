@@ -39,6 +39,7 @@ import libioc.Logger
 import libioc.Config.Jail.File.Fstab
 
 from .shared.click import IocClickContext
+from .shared.pool import exclude_pool_members
 
 __rootcmd__ = True
 
@@ -63,12 +64,12 @@ def cli(
 
     filters = jails + ("template=no,-",)
     try:
-        ioc_jails = libioc.Jails.JailsGenerator(
+        ioc_jails = exclude_pool_members(libioc.Jails.JailsGenerator(
             logger=logger,
             host=ctx.parent.host,
             zfs=ctx.parent.zfs,
             filters=filters
-        )
+        ), filters)
     except libioc.errors.IocException:
         exit(1)
 